@@ -0,0 +1,124 @@
+# src/chatbot/batching.py
+"""Gom các câu hỏi đến gần nhau thành một lượt encode duy nhất (micro-batching).
+
+Mỗi lời gọi `submit()` nhận về một Future; một thread nền lấy yêu cầu đầu tiên trong
+hàng đợi, chờ thêm tối đa `max_wait_ms` (hoặc tới khi đủ `max_batch_size`) rồi encode
+cả lô trong một lượt forward của bi-encoder. Khi hàng đợi đầy, `encode()`/`aencode()` encode
+trực tiếp câu hỏi đó (aencode trên thread riêng) thay vì chặn người gọi, vốn có thể là event loop.
+"""
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# -- configuration --
+EMBEDDING_BATCH_ENABLED = os.getenv("EMBEDDING_BATCH_ENABLED", "1") == "1"
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", 32))
+EMBEDDING_BATCH_MAX_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_MAX_WAIT_MS", 5))
+EMBEDDING_BATCH_QUEUE_SIZE = int(os.getenv("EMBEDDING_BATCH_QUEUE_SIZE", 1024))
+EMBEDDING_BATCH_TIMEOUT = float(os.getenv("EMBEDDING_BATCH_TIMEOUT", 30))
+
+# -- metrics --
+QUEUE_DEPTH = metrics.gauge("chatbot_embedding_queue_depth", "Số câu hỏi đang chờ encode.")
+BATCH_SIZE = metrics.histogram(
+    "chatbot_embedding_batch_size", "Số câu hỏi trong mỗi lượt encode.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+QUEUE_WAIT = metrics.histogram("chatbot_embedding_queue_wait_seconds", "Thời gian một câu hỏi chờ trong hàng đợi.")
+ENCODE_SECONDS = metrics.histogram("chatbot_embedding_encode_seconds", "Thời gian encode một lô.")
+BATCH_ERRORS = metrics.counter("chatbot_embedding_batch_errors_total", "Số lô encode bị lỗi.")
+QUEUE_FULL = metrics.counter(
+    "chatbot_embedding_queue_full_total", "Số câu hỏi encode trực tiếp vì hàng đợi gom lô đã đầy."
+)
+
+
+class EmbeddingBatcher:
+    def __init__(self, model, max_batch_size=EMBEDDING_BATCH_MAX_SIZE,
+                 max_wait_ms=EMBEDDING_BATCH_MAX_WAIT_MS, max_queue_size=EMBEDDING_BATCH_QUEUE_SIZE):
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, text):
+        """Đưa câu hỏi vào hàng đợi; ném queue.Full ngay nếu hàng đợi đầy (không bao giờ chặn)."""
+        self._ensure_started()
+        future = Future()
+        self._queue.put_nowait((text, future, time.perf_counter()))
+        QUEUE_DEPTH.set(self._queue.qsize())
+        return future
+
+    def encode(self, text, timeout=EMBEDDING_BATCH_TIMEOUT):
+        try:
+            future = self.submit(text)
+        except queue.Full:
+            QUEUE_FULL.inc()
+            return self.model.encode(text)
+        return future.result(timeout=timeout)
+
+    async def aencode(self, text):
+        try:
+            future = self.submit(text)
+        except queue.Full:
+            QUEUE_FULL.inc()
+            return await asyncio.to_thread(self.model.encode, text)
+        return await asyncio.wrap_future(future)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        QUEUE_DEPTH.set(self._queue.qsize())
+        # Người gọi đã huỷ (aencode bị cancel) thì bỏ qua; Future còn lại chuyển sang RUNNING nên không thể bị huỷ nữa.
+        return [item for item in batch if item[1].set_running_or_notify_cancel()]
+
+    def _run(self):
+        while True:
+            try:
+                batch = self._collect()
+                if batch:
+                    self._encode(batch)
+            except Exception as e:
+                # Thread nền chết thì mọi lời gọi sau đó treo: ghi log và tiếp tục vòng lặp.
+                logger.exception(f"Lỗi không mong đợi trong thread gom lô embedding: {e}")
+
+    def _encode(self, batch):
+        started = time.perf_counter()
+        for _, _, enqueued_at in batch:
+            QUEUE_WAIT.observe(started - enqueued_at)
+        BATCH_SIZE.observe(len(batch))
+        try:
+            vectors = self.model.encode([text for text, _, _ in batch], batch_size=len(batch))
+        except Exception as e:
+            logger.exception(f"Lỗi khi encode lô {len(batch)} câu hỏi: {e}")
+            BATCH_ERRORS.inc()
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        ENCODE_SECONDS.observe(time.perf_counter() - started)
+        for (_, future, _), vector in zip(batch, vectors):
+            future.set_result(vector)
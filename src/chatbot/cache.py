@@ -0,0 +1,241 @@
+# src/chatbot/cache.py
+"""Cache hai tầng đặt trước pipeline RAG.
+
+- Tầng 1: câu hỏi đã chuẩn hoá -> vector embedding.
+- Tầng 2: (câu hỏi đã chuẩn hoá, limit) -> danh sách SearchHit (id điều khoản, điểm số).
+
+Backend `local` là LRU + TTL trong từng tiến trình; backend `django` dùng alias
+`CHATBOT_CACHE_ALIAS` trong settings.CACHES (Redis khi có CHATBOT_CACHE_URL) để các
+worker dùng chung. `invalidate()` xoá cả hai tầng: với backend `django` nó tăng số thế hệ
+trong alias cache nên mọi worker dùng chung alias đó bỏ qua khoá cũ.
+
+create_embeddings chạy trong tiến trình riêng nên gọi `invalidate_rag_cache()`, hàm này tăng
+số thế hệ `RAG_CACHE_GENERATION` trong PostgreSQL (chatbot.generations). `rag_cache` của mỗi
+worker đọc số đó tối đa mỗi RAG_CACHE_GENERATION_CHECK_SECONDS giây và tự xoá khi số đổi, nên
+việc vô hiệu hoá có hiệu lực cả với backend `local` lẫn alias LocMem mặc định (không có
+CHATBOT_CACHE_URL); kết quả cũ còn được phục vụ tối đa chừng ấy giây sau khi collection đổi.
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# -- configuration --
+CHATBOT_CACHE_BACKEND = os.getenv("CHATBOT_CACHE_BACKEND", "local")
+CHATBOT_CACHE_ALIAS = os.getenv("CHATBOT_CACHE_ALIAS", "chatbot")
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 2048))
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", 2048))
+CHATBOT_CACHE_TTL = int(os.getenv("CHATBOT_CACHE_TTL", 3600))
+RAG_CACHE_GENERATION_CHECK_SECONDS = float(os.getenv("RAG_CACHE_GENERATION_CHECK_SECONDS", 5))
+
+RAG_CACHE_GENERATION = "rag_cache"
+
+# -- metrics --
+CACHE_REQUESTS = metrics.counter(
+    "chatbot_cache_requests_total", "Số lần tra cache theo tầng và kết quả.", ["layer", "result"]
+)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_TRAILING_PUNCT_RE = re.compile(r"[\s?.!…]+$")
+
+
+def normalize_question(text):
+    text = unicodedata.normalize("NFC", text).lower()
+    text = _WHITESPACE_RE.sub(" ", text).strip()
+    return _TRAILING_PUNCT_RE.sub("", text)
+
+
+class LocalLRUCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    async def aget(self, key):
+        return self.get(key)
+
+    async def aset(self, key, value):
+        self.set(key, value)
+
+
+class DjangoCacheBackend:
+    """Bọc một alias trong settings.CACHES; khoá mang số thế hệ để có thể vô hiệu hoá toàn cục."""
+
+    def __init__(self, namespace, ttl, alias=CHATBOT_CACHE_ALIAS):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.alias = alias
+
+    @property
+    def cache(self):
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    def _generation_key(self):
+        return f"{self.namespace}:generation"
+
+    def _key(self, key, generation):
+        # Câu hỏi tiếng Việt có dấu cách/ký tự Unicode: băm để khoá hợp lệ với mọi backend (memcached, redis).
+        return f"{self.namespace}:{generation}:{hashlib.sha256(key.encode('utf-8')).hexdigest()}"
+
+    def get(self, key):
+        generation = self.cache.get(self._generation_key(), 0)
+        return self.cache.get(self._key(key, generation))
+
+    def set(self, key, value):
+        generation = self.cache.get(self._generation_key(), 0)
+        self.cache.set(self._key(key, generation), value, self.ttl)
+
+    def clear(self):
+        key = self._generation_key()
+        self.cache.add(key, 0, None)
+        self.cache.incr(key)
+
+    async def aget(self, key):
+        generation = await self.cache.aget(self._generation_key(), 0)
+        return await self.cache.aget(self._key(key, generation))
+
+    async def aset(self, key, value):
+        generation = await self.cache.aget(self._generation_key(), 0)
+        await self.cache.aset(self._key(key, generation), value, self.ttl)
+
+
+def make_backend(namespace, maxsize, ttl=CHATBOT_CACHE_TTL, backend=None):
+    backend = backend or CHATBOT_CACHE_BACKEND
+    if backend == "local":
+        return LocalLRUCache(maxsize, ttl)
+    if backend == "django":
+        return DjangoCacheBackend(namespace, ttl)
+    raise ValueError(f"CHATBOT_CACHE_BACKEND không hợp lệ: '{backend}' (chỉ hỗ trợ 'local' hoặc 'django').")
+
+
+class RAGCache:
+    """generation: tên số thế hệ dùng chung (chatbot.generations) được theo dõi để tự xoá cache;
+    None thì chỉ `invalidate()` gọi trực tiếp mới xoá."""
+
+    def __init__(self, backend=None, generation=None, check_seconds=RAG_CACHE_GENERATION_CHECK_SECONDS):
+        self.embeddings = make_backend("chatbot:embedding", EMBEDDING_CACHE_SIZE, backend=backend)
+        self.retrieval = make_backend("chatbot:retrieval", RETRIEVAL_CACHE_SIZE, backend=backend)
+        self.generation = generation
+        self.check_seconds = check_seconds
+        self._seen_generation = None
+        self._checked_at = None
+
+    def _check_due(self):
+        if self.generation is None:
+            return False
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_seconds:
+            return False
+        # Đánh dấu trước khi đọc để các request đồng thời không cùng truy vấn PostgreSQL.
+        self._checked_at = now
+        return True
+
+    def _apply_generation(self, generation):
+        if generation is None:
+            return
+        if self._seen_generation is not None and generation != self._seen_generation:
+            self.invalidate()
+            logger.info(f"Số thế hệ cache RAG đổi ({self._seen_generation} -> {generation}): đã xoá cache.")
+        self._seen_generation = generation
+
+    def refresh(self):
+        """Xoá cache nếu một tiến trình khác đã tăng số thế hệ dùng chung."""
+        if self._check_due():
+            from .generations import current_generation
+            self._apply_generation(current_generation(self.generation))
+
+    async def arefresh(self):
+        if self._check_due():
+            from .generations import acurrent_generation
+            self._apply_generation(await acurrent_generation(self.generation))
+
+    @staticmethod
+    def _retrieval_key(question, limit):
+        return f"{limit}:{normalize_question(question)}"
+
+    @staticmethod
+    def _record(layer, value):
+        CACHE_REQUESTS.inc(layer=layer, result="miss" if value is None else "hit")
+        return value
+
+    def get_embedding(self, question):
+        self.refresh()
+        return self._record("embedding", self.embeddings.get(normalize_question(question)))
+
+    def set_embedding(self, question, vector):
+        self.embeddings.set(normalize_question(question), vector)
+
+    def get_hits(self, question, limit):
+        self.refresh()
+        return self._record("retrieval", self.retrieval.get(self._retrieval_key(question, limit)))
+
+    def set_hits(self, question, limit, hits):
+        self.retrieval.set(self._retrieval_key(question, limit), list(hits))
+
+    async def aget_embedding(self, question):
+        await self.arefresh()
+        return self._record("embedding", await self.embeddings.aget(normalize_question(question)))
+
+    async def aset_embedding(self, question, vector):
+        await self.embeddings.aset(normalize_question(question), vector)
+
+    async def aget_hits(self, question, limit):
+        await self.arefresh()
+        return self._record("retrieval", await self.retrieval.aget(self._retrieval_key(question, limit)))
+
+    async def aset_hits(self, question, limit, hits):
+        await self.retrieval.aset(self._retrieval_key(question, limit), list(hits))
+
+    def invalidate(self):
+        self.embeddings.clear()
+        self.retrieval.clear()
+
+
+rag_cache = RAGCache(generation=RAG_CACHE_GENERATION)
+
+
+def invalidate_rag_cache():
+    """Gọi sau khi collection vector được tạo lại hoặc cập nhật (kể cả từ tiến trình khác worker)."""
+    from .generations import bump_generation
+    try:
+        rag_cache.invalidate()
+    except Exception as e:
+        logger.warning(f"Không thể vô hiệu hoá cache truy vấn RAG: {e}")
+    if bump_generation(RAG_CACHE_GENERATION) is not None:
+        logger.info("Đã vô hiệu hoá cache truy vấn RAG.")
@@ -0,0 +1,295 @@
+# src/chatbot/coalesce.py
+"""Gộp các request giống hệt nhau đang chạy cùng lúc (single-flight).
+
+Khi một câu hỏi được nhiều người gửi trong cùng một giây (ví dụ ngay sau khi một văn bản
+sửa đổi được công bố), chỉ request đầu tiên gọi LLM; các request trùng khoá chờ và dùng
+chung kết quả. Khoá gồm câu hỏi đã chuẩn hoá, loại câu hỏi và danh sách điều khoản đã
+truy xuất theo thứ tự, nên cùng câu hỏi nhưng khác ngữ cảnh (collection vừa đổi) không bị gộp.
+
+- `SingleFlight` (/ask/): lời gọi đầu tiên chạy trong một task riêng, các request cùng khoá
+  chờ chính task đó; request dẫn đầu bị huỷ (client ngắt) không làm hỏng kết quả của người khác.
+- `StreamFlight` (view SSE): câu trả lời được sinh trong một task riêng; mọi request cùng
+  khoá (kể cả request đầu tiên) đọc lại các sự kiện đã phát rồi nhận tiếp sự kiện mới, nên
+  một client ngắt kết nối không làm hỏng luồng của những người còn lại.
+
+Với CHATBOT_COALESCE=django, request dẫn đầu của mỗi worker còn phải giành một khoá trong
+alias cache `chatbot` (Redis khi có CHATBOT_CACHE_URL). Worker không giành được khoá chờ
+câu trả lời hoàn chỉnh được ghi lại trong cache thay vì tự gọi LLM; giữa các worker chỉ
+chia sẻ câu trả lời cuối cùng, không chia sẻ từng token. Kết quả dùng chung có dạng
+{"answer": ..., "metadata": ...} cho cả hai view. Mỗi lượt giữ khoá có một token riêng và kết
+quả được gắn token đó, nên worker chờ không nhận nhầm kết quả còn lưu của lượt trước. Câu trả
+lời dự phòng (kết quả có "fallback": True khi LLM lỗi hoặc bộ ngắt mạch mở) không bao giờ được
+ghi vào cache dùng chung.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+import uuid
+
+from . import metrics
+from .cache import CHATBOT_CACHE_ALIAS, normalize_question
+from .timing import stage
+
+logger = logging.getLogger(__name__)
+
+# -- configuration --
+CHATBOT_COALESCE = os.getenv("CHATBOT_COALESCE", "local")  # off | local | django
+COALESCE_LOCK_TTL = int(os.getenv("COALESCE_LOCK_TTL", 90))  # lớn hơn LLM_DEADLINE: khoá không hết hạn khi leader còn chạy
+COALESCE_WAIT = float(os.getenv("COALESCE_WAIT", 60))
+COALESCE_POLL_MS = float(os.getenv("COALESCE_POLL_MS", 50))
+COALESCE_RESULT_TTL = int(os.getenv("COALESCE_RESULT_TTL", 30))
+
+# -- metrics --
+COALESCE_REQUESTS = metrics.counter(
+    "chatbot_coalesce_requests_total",
+    "Số request theo vai trò khi gộp câu hỏi trùng lặp: leader (tự gọi LLM), follower (dùng kết quả của request "
+    "cùng worker), remote (dùng kết quả của worker khác), fallback (chờ worker khác quá lâu nên tự gọi LLM).",
+    ["mode", "role"],
+)
+COALESCE_INFLIGHT = metrics.gauge("chatbot_coalesce_inflight", "Số lượt sinh câu trả lời đang được gộp.", ["mode"])
+
+
+def flight_key(question, provision_ids, question_class=None):
+    ids = ",".join(str(i) for i in provision_ids)
+    raw = f"{question_class}|{normalize_question(question)}|{ids}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SharedFlightLock:
+    """Khoá và kết quả dùng chung giữa các worker (cache.add là thao tác nguyên tử).
+
+    Lỗi của cache dùng chung (Redis mất kết nối) không làm hỏng request: worker coi như
+    giành được khoá và tự tính.
+    """
+
+    def __init__(self, alias=CHATBOT_CACHE_ALIAS, lock_ttl=COALESCE_LOCK_TTL, result_ttl=COALESCE_RESULT_TTL,
+                 wait=COALESCE_WAIT, poll_ms=COALESCE_POLL_MS):
+        self.alias = alias
+        self.lock_ttl = lock_ttl
+        self.result_ttl = result_ttl
+        self.wait = wait
+        self.poll = poll_ms / 1000
+
+    @property
+    def cache(self):
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    @staticmethod
+    def _lock_key(key):
+        return f"chatbot:coalesce:lock:{key}"
+
+    @staticmethod
+    def _result_key(key):
+        return f"chatbot:coalesce:result:{key}"
+
+    async def aacquire(self, key):
+        """(True, token của mình) nếu giành được khoá; (False, token của lượt đang chạy) nếu worker khác giữ."""
+        token = uuid.uuid4().hex
+        try:
+            for _ in range(2):
+                if await self.cache.aadd(self._lock_key(key), token, self.lock_ttl):
+                    return True, token
+                holder = await self.cache.aget(self._lock_key(key))
+                if holder is not None:
+                    return False, holder
+                # Khoá vừa được nhả giữa hai lần đọc: thử giành lại một lần.
+        except Exception as e:
+            logger.warning(f"Không giành được khoá gộp request dùng chung: {e}")
+        return True, None
+
+    async def apublish(self, key, token, result):
+        """Ghi kết quả (trừ câu trả lời dự phòng) cho các worker đang chờ rồi nhả khoá."""
+        if token is not None and result is not None and not result.get("fallback"):
+            try:
+                await self.cache.aset(self._result_key(key), {"token": token, "result": result}, self.result_ttl)
+            except Exception as e:
+                logger.warning(f"Không ghi được kết quả gộp request dùng chung: {e}")
+        await self.arelease(key, token)
+
+    async def arelease(self, key, token):
+        if token is None:
+            return
+        try:
+            # Chỉ xoá khoá của chính mình (khoá đã hết hạn có thể thuộc về lượt khác).
+            if await self.cache.aget(self._lock_key(key)) == token:
+                await self.cache.adelete(self._lock_key(key))
+        except Exception as e:
+            logger.warning(f"Không nhả được khoá gộp request dùng chung: {e}")
+
+    async def _aresult(self, key, token):
+        published = await self.cache.aget(self._result_key(key))
+        if published is not None and published.get("token") == token:
+            return published["result"]
+        return None
+
+    async def await_result(self, key, token):
+        """Kết quả của lượt mang token; None khi lượt đó nhả khoá mà không có kết quả hoặc chờ quá COALESCE_WAIT."""
+        deadline = time.monotonic() + self.wait
+        try:
+            while time.monotonic() < deadline:
+                result = await self._aresult(key, token)
+                if result is not None:
+                    return result
+                if await self.cache.aget(self._lock_key(key)) != token:
+                    # Leader ghi kết quả rồi mới nhả khoá: đọc lại một lần để không bỏ sót.
+                    return await self._aresult(key, token)
+                await asyncio.sleep(self.poll)
+        except Exception as e:
+            logger.warning(f"Không đọc được kết quả gộp request dùng chung: {e}")
+        return None
+
+
+class SingleFlight:
+    mode = "ask"
+
+    def __init__(self, shared=None):
+        self.shared = shared
+        self._tasks = {}
+
+    async def do(self, key, fn):
+        """Kết quả của `await fn()`; các lời gọi cùng khoá trong lúc nó đang chạy nhận chung kết quả (hoặc ngoại lệ)."""
+        loop = asyncio.get_running_loop()
+        task = self._tasks.get(key)
+        if task is not None and task.get_loop() is loop:
+            COALESCE_REQUESTS.inc(mode=self.mode, role="follower")
+            with stage("coalesce"):
+                return await asyncio.shield(task)
+        # Task chép context của request dẫn đầu: các bước prompt/llm vẫn được ghi vào Server-Timing của nó.
+        task = self._tasks[key] = loop.create_task(self._run(key, fn))
+        COALESCE_INFLIGHT.inc(mode=self.mode)
+        task.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        COALESCE_INFLIGHT.dec(mode=self.mode)
+        if not task.cancelled():
+            task.exception()  # đánh dấu đã lấy lỗi khi mọi người chờ đều đã huỷ
+
+    async def _run(self, key, fn):
+        if self.shared is None:
+            COALESCE_REQUESTS.inc(mode=self.mode, role="leader")
+            return await fn()
+        acquired, token = await self.shared.aacquire(key)
+        if acquired:
+            COALESCE_REQUESTS.inc(mode=self.mode, role="leader")
+            try:
+                result = await fn()
+            except Exception:
+                await self.shared.arelease(key, token)
+                raise
+            await self.shared.apublish(key, token, result)
+            return result
+        with stage("coalesce"):
+            result = await self.shared.await_result(key, token)
+        if result is not None:
+            COALESCE_REQUESTS.inc(mode=self.mode, role="remote")
+            return result
+        COALESCE_REQUESTS.inc(mode=self.mode, role="fallback")
+        return await fn()
+
+
+class _Stream:
+    """Các sự kiện (event, data) đã phát của một lượt sinh câu trả lời, đọc lại được từ đầu."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.events = []
+        self.done = False
+        self.updated = asyncio.Event()
+        self.task = None
+
+    def push(self, event):
+        self.events.append(event)
+        self.updated.set()
+        self.updated = asyncio.Event()
+
+    def close(self):
+        self.done = True
+        self.updated.set()
+
+    async def replay(self):
+        i = 0
+        while True:
+            while i < len(self.events):
+                yield self.events[i]
+                i += 1
+            if self.done:
+                return
+            await self.updated.wait()
+
+
+class StreamFlight:
+    mode = "stream"
+
+    def __init__(self, shared=None):
+        self.shared = shared
+        self._flights = {}
+
+    async def stream(self, key, factory):
+        """Các sự kiện của factory() (async generator); request cùng khoá đang chạy dùng chung một lượt sinh."""
+        loop = asyncio.get_running_loop()
+        flight = self._flights.get(key)
+        if flight is not None and flight.loop is loop:
+            COALESCE_REQUESTS.inc(mode=self.mode, role="follower")
+        else:
+            flight = self._flights[key] = _Stream(loop)
+            flight.task = loop.create_task(self._produce(key, flight, factory))
+        async for event in flight.replay():
+            yield event
+
+    async def _produce(self, key, flight, factory):
+        COALESCE_INFLIGHT.inc(mode=self.mode)
+        try:
+            acquired, token = (True, None) if self.shared is None else await self.shared.aacquire(key)
+            if acquired:
+                COALESCE_REQUESTS.inc(mode=self.mode, role="leader")
+                await self._generate(key, token, flight, factory)
+                return
+            result = await self.shared.await_result(key, token)
+            if result is not None:
+                COALESCE_REQUESTS.inc(mode=self.mode, role="remote")
+                flight.push(("token", {"text": result["answer"]}))
+                flight.push(("done", result))
+            else:
+                COALESCE_REQUESTS.inc(mode=self.mode, role="fallback")
+                async for event in factory():
+                    flight.push(event)
+        except Exception as e:
+            logger.exception(f"Lỗi khi sinh câu trả lời dùng chung: {e}")
+            flight.push(("error", {"error": "Câu trả lời bị gián đoạn do lỗi từ LLM."}))
+        finally:
+            flight.close()
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            COALESCE_INFLIGHT.dec(mode=self.mode)
+
+    async def _generate(self, key, token, flight, factory):
+        result = None
+        try:
+            async for event in factory():
+                flight.push(event)
+                if event[0] == "done":
+                    result = event[1]
+        finally:
+            if self.shared is not None:
+                await self.shared.apublish(key, token, result)
+
+
+def make_flights(backend=None):
+    backend = backend or CHATBOT_COALESCE
+    if backend == "off":
+        return None, None
+    if backend == "local":
+        return SingleFlight(), StreamFlight()
+    if backend == "django":
+        shared = SharedFlightLock()
+        return SingleFlight(shared), StreamFlight(shared)
+    raise ValueError(f"CHATBOT_COALESCE không hợp lệ: '{backend}' (chỉ hỗ trợ 'off', 'local' hoặc 'django').")
+
+
+single_flight, stream_flight = make_flights()
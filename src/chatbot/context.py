@@ -0,0 +1,167 @@
+# src/chatbot/context.py
+"""Dựng ngữ cảnh cho prompt Gemini trong một ngân sách token.
+
+Các điều khoản đi vào theo thứ tự xếp hạng. Bộ dựng làm ba việc:
+
+- Bỏ trùng: cùng (văn bản, Điều, Khoản/Điểm), hoặc nội dung đã nằm trọn trong một trích
+  đoạn khác của cùng Điều (dữ liệu cũ có Khoản chứa cả các Điểm con), chỉ giữ một lần.
+- Gộp: các Khoản/Điểm cùng một Điều đứng chung dưới một tiêu đề Điều duy nhất, thay vì
+  lặp lại tiền tố Chương/Mục/Điều cho từng trích đoạn.
+- Cắt: nếu prompt vượt CONTEXT_TOKEN_BUDGET, bỏ dần các trích đoạn xếp hạng thấp nhất.
+  Trích đoạn tốt nhất luôn được giữ; nếu riêng nó đã quá ngân sách thì bị cắt ngắn.
+
+Số token được ước lượng bằng cách đếm từ và dấu câu (count_tokens), không gọi API
+count_tokens của Gemini nên không thêm một vòng mạng vào mỗi request.
+"""
+import logging
+import os
+import re
+from collections import namedtuple
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# -- configuration --
+# Ngân sách cho toàn bộ prompt (khung prompt + câu hỏi + ngữ cảnh), tính theo token ước lượng.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 3000))
+
+# -- metrics --
+PROMPT_TOKENS = metrics.histogram(
+    "chatbot_prompt_tokens", "Số token (ước lượng) của prompt gửi Gemini.",
+    buckets=(128, 256, 512, 1024, 2048, 4096, 8192, 16384),
+)
+CONTEXT_DROPPED = metrics.counter(
+    "chatbot_context_dropped_total", "Số trích đoạn bị loại khỏi ngữ cảnh theo lý do: duplicate hoặc budget.", ["reason"]
+)
+
+PROMPT_TEMPLATE = (
+    "Dựa vào các trích đoạn sau từ Luật Doanh nghiệp Việt Nam:\n\n{context}\n\n"
+    "Hãy trả lời câu hỏi sau của người dùng một cách chi tiết, đầy đủ, đúng trọng tâm và "
+    "chính xác, không cắt bớt và CHỈ sử dụng thông tin từ các trích đoạn đã cung cấp. "
+    "Luôn trả lời bằng tiếng Việt. Nếu thông tin không có trong trích đoạn, hãy trả lời "
+    "\"Tôi không tìm thấy thông tin liên quan trong các điều khoản được cung cấp.\". "
+    "Không được suy diễn hoặc thêm thông tin bên ngoài.\n\nCâu hỏi: \"{query}\"\nTrả lời:"
+)
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+PackedPrompt = namedtuple("PackedPrompt", ["text", "tokens", "provisions"])
+
+
+def count_tokens(text):
+    """Ước lượng số token: mỗi từ (âm tiết tiếng Việt) hoặc dấu câu tính là một token."""
+    return len(_TOKEN_RE.findall(text))
+
+
+def truncate_tokens(text, limit):
+    if limit <= 0:
+        return ""
+    matches = list(_TOKEN_RE.finditer(text))
+    if len(matches) <= limit:
+        return text
+    return text[:matches[limit - 1].end()] + " …"
+
+
+class PromptTemplate:
+    """Khung prompt được tách thành các đoạn cố định một lần lúc import; mỗi request chỉ nối chuỗi."""
+
+    def __init__(self, template):
+        self.head, rest = template.split("{context}")
+        self.middle, self.tail = rest.split("{query}")
+        self.fixed_tokens = count_tokens(self.head + self.middle + self.tail)
+
+    def render(self, context, query):
+        return "".join((self.head, context, self.middle, query, self.tail))
+
+
+def article_key(p):
+    return (str(p.document_id), p.article_number)
+
+
+def article_header(p):
+    where = ", ".join(part for part in (p.chapter_info, p.section_info) if part)
+    header = f"Điều {p.article_number}. {p.article_title or ''}".rstrip()
+    return f"[{header}{f' ({where})' if where else ''}]"
+
+
+def provision_label(provision_id):
+    if not provision_id:
+        return "Phần mở đầu"
+    clause, _, point = provision_id.partition(".")
+    return f"Điểm {point} khoản {clause}" if point else f"Khoản {clause}"
+
+
+def deduplicate(provisions):
+    """Giữ thứ tự xếp hạng, bỏ các Khoản/Điểm trùng hoặc nằm trọn trong trích đoạn khác của cùng Điều."""
+    kept, seen = [], set()
+    for p in provisions:
+        key = article_key(p) + (p.provision_id,)
+        if key in seen:
+            CONTEXT_DROPPED.inc(reason="duplicate")
+            continue
+        overlap = None
+        for i, other in enumerate(kept):
+            if article_key(other) == article_key(p) and (p.content in other.content or other.content in p.content):
+                overlap = i
+                break
+        if overlap is None:
+            kept.append(p)
+        elif len(p.content) > len(kept[overlap].content):
+            # Trích đoạn mới bao trọn trích đoạn cũ: thay vào đúng vị trí (hạng cao hơn) của trích đoạn cũ.
+            kept[overlap] = p
+            CONTEXT_DROPPED.inc(reason="duplicate")
+        else:
+            CONTEXT_DROPPED.inc(reason="duplicate")
+        seen.add(key)
+    return kept
+
+
+class ContextBuilder:
+    def __init__(self, token_budget=CONTEXT_TOKEN_BUDGET, template=PROMPT_TEMPLATE):
+        self.token_budget = token_budget
+        self.template = PromptTemplate(template)
+
+    def _render(self, chunks):
+        """chunks: [(provision, dòng nội dung)] theo hạng; gộp theo Điều, Điều xếp theo hạng tốt nhất của nó."""
+        groups = {}
+        for p, line in chunks:
+            groups.setdefault(article_key(p), (article_header(p), []))[1].append(line)
+        return "\n\n".join("\n".join([header, *lines]) for header, lines in groups.values())
+
+    def build(self, query, provisions):
+        candidates = deduplicate(provisions)
+        chunks = [(p, f"{provision_label(p.provision_id)}: {p.content}") for p in candidates]
+        costs = [count_tokens(line) for _, line in chunks]
+        header_costs = {article_key(p): count_tokens(article_header(p)) for p in candidates}
+
+        available = self.token_budget - self.template.fixed_tokens - count_tokens(query)
+        used, articles, keep = 0, set(), 0
+        for (p, _), cost in zip(chunks, costs):
+            extra = cost + (0 if article_key(p) in articles else header_costs[article_key(p)])
+            if used + extra > available:
+                break
+            used += extra
+            articles.add(article_key(p))
+            keep += 1
+
+        if keep == 0 and chunks:
+            # Ngay trích đoạn tốt nhất đã vượt ngân sách: giữ lại phần đầu của nó.
+            p, line = chunks[0]
+            chunks[0] = (p, truncate_tokens(line, available - header_costs[article_key(p)]))
+            keep = 1
+        if keep < len(chunks):
+            CONTEXT_DROPPED.inc(len(chunks) - keep, reason="budget")
+        chunks = chunks[:keep]
+
+        text = self.template.render(self._render(chunks), query)
+        tokens = count_tokens(text)
+        PROMPT_TOKENS.observe(tokens)
+        logger.info(
+            f"Prompt ~{tokens} token (ngân sách {self.token_budget}), dùng {keep}/{len(provisions)} điều khoản "
+            f"({len(provisions) - len(candidates)} trùng, {len(candidates) - keep} bị cắt)."
+        )
+        return PackedPrompt(text, tokens, [p for p, _ in chunks])
+
+
+context_builder = ContextBuilder()
@@ -1,46 +1,222 @@
-from sentence_transformers import SentenceTransformer
-import torch
-import torch.quantization
-class EmbeddingModel:
-    _instance = None
-    _model = None
-
-    def __new__(cls):
-        if cls._instance is None:
-            print("INFO: Đang khởi tạo instance EmbeddingModel...")
-            cls._instance = super(EmbeddingModel, cls).__new__(cls)
-            device = 'cpu'
-            model_name = 'bkai-foundation-models/vietnamese-bi-encoder'
-
-            print(f"INFO: Đang tải mô hình '{model_name}' lên thiết bị '{device}'...")
-            original_model = SentenceTransformer(model_name, device=device)
-            print("INFO: Tải mô hình embedding thành công.")
-
-            # -- start dynamic quantization --
-            print(f"INFO: Đang áp dụng Quantization Động (int8) cho mô hình...")
-            try:
-                transformer_module = original_model._first_module()
-                quantized_model_transformer = torch.quantization.quantize_dynamic(
-                    transformer_module,
-                    {torch.nn.Linear},
-                    dtype=torch.qint8
-                )
-                original_model._modules['_modules']['0'] = quantized_model_transformer()
-
-                cls._model = original_model
-                print("INFO: Áp dụng Quantization Động thành công.")
-            except Exception as e:
-                print(f"WARNING: Không thể áp dụng Quantization Động: {e}. Sử dụng mô hình gốc.")
-                cls._model = original_model
-    
-        return cls._instance
-
-    def get_model(self):
-        if self._model is None:
-            raise RuntimeError("Mô hình chưa được khởi tạo!")
-        return self._model
-
-embedding_model_loader = EmbeddingModel()
+# src/chatbot/embedding.py
+"""Mô hình embedding câu hỏi/điều khoản với backend có thể chọn (EMBEDDING_BACKEND).
+
+- `torch`: SentenceTransformer gốc, tải từ Hugging Face, lượng tử hoá động int8 các lớp
+  Linear khi EMBEDDING_QUANTIZE=1.
+- `onnx`: mô hình đã export (thường là int8) chạy bằng ONNX Runtime, không cần import torch.
+- `torchscript`: mô hình đã export bằng torch.jit (int8), không cần sentence-transformers.
+
+Hai backend export đọc mọi thứ (mô hình, tokenizer, cấu hình pooling) từ
+EMBEDDING_ARTIFACT_DIR do lệnh `export_embedding_model` tạo ra. Chúng không truy cập
+mạng khi khởi động. Mọi backend có cùng giao diện như SentenceTransformer mà phần còn
+lại của code dùng: `encode(str | list[str], batch_size=...)` và
+`get_sentence_embedding_dimension()`.
+
+Mô hình chỉ được tải ở lần gọi `get_embedding_model()` đầu tiên, không tải lúc import.
+"""
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# -- configuration --
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "bkai-foundation-models/vietnamese-bi-encoder")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_BACKENDS = ("torch", "onnx", "torchscript")
+EMBEDDING_ARTIFACT_DIR = os.getenv("EMBEDDING_ARTIFACT_DIR", "/app/data/embedding_artifacts")
+EMBEDDING_QUANTIZE = os.getenv("EMBEDDING_QUANTIZE", "1") == "1"
+# Số luồng intra-op cho torch/ONNX Runtime; 0 = để runtime tự chọn.
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", 0))
+
+ARTIFACT_CONFIG_FILE = "embedding_config.json"
+ONNX_FILE = "model.onnx"
+ONNX_INT8_FILE = "model_int8.onnx"
+TORCHSCRIPT_FILE = "model.pt"
+
+
+def set_torch_threads(threads=EMBEDDING_THREADS):
+    if threads > 0:
+        import torch
+        torch.set_num_threads(threads)
+
+
+def load_sentence_transformer(model_name=EMBEDDING_MODEL_NAME, quantize=EMBEDDING_QUANTIZE):
+    from sentence_transformers import SentenceTransformer
+    import torch
+
+    set_torch_threads()
+    logger.info(f"Đang tải mô hình '{model_name}' lên thiết bị 'cpu'...")
+    model = SentenceTransformer(model_name, device="cpu")
+    logger.info("Tải mô hình embedding thành công.")
+
+    if quantize:
+        # Lượng tử hoá tại chỗ mô hình transformer bên trong module đầu tiên (module Transformer
+        # của sentence-transformers chỉ là lớp bọc, bản thân nó không có lớp Linear nào).
+        try:
+            torch.quantization.quantize_dynamic(
+                model[0].auto_model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+            )
+            logger.info("Áp dụng Quantization Động (int8) thành công.")
+        except Exception as e:
+            logger.warning(f"Không thể áp dụng Quantization Động: {e}. Sử dụng mô hình gốc.")
+    return model
+
+
+def pooling_config(model):
+    """Cấu hình pooling/chuẩn hoá của một SentenceTransformer, ghi kèm artifact khi export."""
+    pooling = next((m for m in model if type(m).__name__ == "Pooling"), None)
+    settings = pooling.get_config_dict() if pooling is not None else {}
+    # sentence-transformers < 5 lưu từng cờ pooling_mode_*; các bản mới lưu một khoá pooling_mode.
+    mode = settings.get("pooling_mode") or ("cls" if settings.get("pooling_mode_cls_token") else "mean")
+    return {
+        "pooling": "cls" if mode == "cls" else "mean",
+        "normalize": any(type(m).__name__ == "Normalize" for m in model),
+        "max_seq_length": model.max_seq_length,
+        "dimension": model.get_sentence_embedding_dimension(),
+    }
+
+
+class ArtifactEmbeddingModel:
+    """Phần chung của các backend export: tokenizer cục bộ, chia lô, pooling, chuẩn hoá."""
+
+    def __init__(self, artifact_dir=None):
+        self.artifact_dir = artifact_dir or EMBEDDING_ARTIFACT_DIR
+        with open(os.path.join(self.artifact_dir, ARTIFACT_CONFIG_FILE), "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+        self.max_seq_length = self.config["max_seq_length"]
+        # Tokenizer đã được lưu kèm artifact: không tra cứu Hugging Face Hub lúc khởi động.
+        # Có tokenizer.json thì dùng thẳng thư viện `tokenizers` (Rust) để không kéo theo
+        # transformers/torch; tokenizer "slow" (như PhoBERT) mới cần transformers.
+        tokenizer_file = os.path.join(self.artifact_dir, "tokenizer.json")
+        if os.path.exists(tokenizer_file):
+            self._tokenize = self._fast_tokenizer(tokenizer_file)
+        else:
+            from transformers import AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained(self.artifact_dir, local_files_only=True)
+
+            def tokenize(texts):
+                tokens = tokenizer(texts, padding=True, truncation=True, max_length=self.max_seq_length, return_tensors="np")
+                return tokens["input_ids"].astype(np.int64), tokens["attention_mask"].astype(np.int64)
+            self._tokenize = tokenize
+
+    def _fast_tokenizer(self, tokenizer_file):
+        from tokenizers import Tokenizer
+
+        tokenizer = Tokenizer.from_file(tokenizer_file)
+        with open(os.path.join(self.artifact_dir, "tokenizer_config.json"), "r", encoding="utf-8") as f:
+            pad_token = json.load(f).get("pad_token") or "[PAD]"
+        if isinstance(pad_token, dict):
+            pad_token = pad_token["content"]
+        tokenizer.enable_truncation(self.max_seq_length)
+        tokenizer.enable_padding(pad_id=tokenizer.token_to_id(pad_token) or 0, pad_token=pad_token)
+
+        def tokenize(texts):
+            encodings = tokenizer.encode_batch(texts)
+            return (
+                np.array([e.ids for e in encodings], dtype=np.int64),
+                np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            )
+        return tokenize
+
+    def get_sentence_embedding_dimension(self):
+        return self.config["dimension"]
+
+    def _forward(self, input_ids, attention_mask):
+        raise NotImplementedError
+
+    def _pool(self, hidden, attention_mask):
+        if self.config["pooling"] == "cls":
+            embeddings = hidden[:, 0]
+        else:
+            mask = attention_mask[..., None].astype(np.float32)
+            embeddings = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.config["normalize"]:
+            embeddings = embeddings / np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings.astype(np.float32)
+
+    def encode(self, sentences, batch_size=32, **kwargs):
+        single = isinstance(sentences, str)
+        sentences = [sentences] if single else list(sentences)
+        # Sắp theo độ dài để mỗi lô ít padding, rồi trả về đúng thứ tự ban đầu.
+        order = sorted(range(len(sentences)), key=lambda i: len(sentences[i]), reverse=True)
+        outputs = [None] * len(sentences)
+        for start in range(0, len(order), batch_size):
+            batch = order[start: start + batch_size]
+            input_ids, attention_mask = self._tokenize([sentences[i] for i in batch])
+            for i, vector in zip(batch, self._pool(self._forward(input_ids, attention_mask), attention_mask)):
+                outputs[i] = vector
+        if not outputs:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+        embeddings = np.stack(outputs)
+        return embeddings[0] if single else embeddings
+
+
+class OnnxEmbeddingModel(ArtifactEmbeddingModel):
+    def __init__(self, artifact_dir=None, threads=EMBEDDING_THREADS):
+        import onnxruntime as ort
+
+        super().__init__(artifact_dir)
+        path = os.path.join(self.artifact_dir, ONNX_INT8_FILE)
+        if not os.path.exists(path):
+            path = os.path.join(self.artifact_dir, ONNX_FILE)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.inter_op_num_threads = 1
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        logger.info(f"Đã tải mô hình embedding ONNX từ '{path}'.")
+
+    def _forward(self, input_ids, attention_mask):
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+        return self.session.run(["last_hidden_state"], feeds)[0]
+
+
+class TorchScriptEmbeddingModel(ArtifactEmbeddingModel):
+    def __init__(self, artifact_dir=None, threads=EMBEDDING_THREADS):
+        import torch
+
+        super().__init__(artifact_dir)
+        set_torch_threads(threads)
+        path = os.path.join(self.artifact_dir, TORCHSCRIPT_FILE)
+        self.module = torch.jit.load(path, map_location="cpu").eval()
+        self._torch = torch
+        logger.info(f"Đã tải mô hình embedding TorchScript từ '{path}'.")
+
+    def _forward(self, input_ids, attention_mask):
+        torch = self._torch
+        with torch.inference_mode():
+            hidden = self.module(torch.from_numpy(input_ids), torch.from_numpy(attention_mask))
+        return hidden.numpy()
+
+
+def load_embedding_model(backend=None, artifact_dir=None):
+    backend = backend or EMBEDDING_BACKEND
+    if backend == "torch":
+        return load_sentence_transformer()
+    if backend == "onnx":
+        return OnnxEmbeddingModel(artifact_dir)
+    if backend == "torchscript":
+        return TorchScriptEmbeddingModel(artifact_dir)
+    raise ValueError(f"EMBEDDING_BACKEND không hợp lệ: '{backend}' (chỉ hỗ trợ {', '.join(EMBEDDING_BACKENDS)}).")
+
+
+_model = None
+_model_lock = threading.Lock()
+
 
 def get_embedding_model():
-    return embedding_model_loader.get_model()
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                logger.info(f"Đang khởi tạo mô hình embedding (backend '{EMBEDDING_BACKEND}')...")
+                _model = load_embedding_model()
+    return _model
@@ -0,0 +1,160 @@
+# src/chatbot/evaluation.py
+"""Đánh giá chất lượng truy xuất và tổng hợp số đo hiệu năng cho lệnh benchmark_rag.
+
+- `HashingEncoder`: encoder tất định, không cần mô hình hay mạng, để benchmark chạy hoàn
+  toàn offline. Nó băm âm tiết và cặp âm tiết (lexical.tokenize) vào `dim` chiều có dấu.
+  Chất lượng chỉ xấp xỉ tìm kiếm từ vựng: dùng để so sánh các thay đổi của pipeline giữa
+  hai lần chạy, không thay cho việc đánh giá mô hình embedding thật (--encoder model).
+- Golden set: mỗi câu hỏi kèm các Điều đúng (`load_golden_set`). `retrieval_metrics` tính
+  recall@k và MRR, trong đó một hit được coi là đúng khi nó thuộc một Điều mong đợi.
+- `latency_summary`, `parse_server_timing`, `peak_rss_mb`: tổng hợp độ trễ (ms) và bộ nhớ.
+- `compare_reports`: so hai báo cáo JSON và liệt kê các chỉ số bị hồi quy quá ngưỡng.
+"""
+import hashlib
+import json
+import resource
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+from .lexical import tokenize
+
+# Chênh lệch độ trễ nhỏ hơn ngưỡng này (ms) được coi là nhiễu đo, không tính là hồi quy.
+LATENCY_NOISE_MS = 1.0
+
+GoldenQuestion = namedtuple("GoldenQuestion", ["question", "articles", "document"])
+
+
+@lru_cache(maxsize=65536)
+def _bucket(token, dim):
+    value = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+    return value % dim, 1.0 if value >> 63 else -1.0
+
+
+class HashingEncoder:
+    """Cùng giao diện với SentenceTransformer: `encode(str | list[str])`, `get_sentence_embedding_dimension()`."""
+
+    def __init__(self, dim=768):
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def _vector(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in tokenize(text):
+            index, sign = _bucket(token, self.dim)
+            vector[index] += sign
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def encode(self, sentences, batch_size=32, **kwargs):
+        if isinstance(sentences, str):
+            return self._vector(sentences)
+        return np.stack([self._vector(s) for s in sentences]) if sentences else np.zeros((0, self.dim), np.float32)
+
+
+def load_golden_set(path):
+    """File JSON: [{"question": ..., "articles": [số Điều], "document": source_file của văn bản,
+    tức đường dẫn tương đối mà ingest_law_data đặt, thường là tên file (tuỳ chọn)}]."""
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    return [GoldenQuestion(e["question"], [int(a) for a in e["articles"]], e.get("document")) for e in entries]
+
+
+def _is_relevant(item, hit):
+    document, article = hit
+    return article in item.articles and (item.document is None or document == item.document)
+
+
+def retrieval_metrics(ranked, ks=(1, 3, 5)):
+    """ranked: [(GoldenQuestion, [(file văn bản, số Điều) của từng hit theo hạng])].
+
+    recall@k: tỉ lệ Điều mong đợi có mặt trong k hit đầu; MRR: trung bình 1/hạng của hit đúng đầu tiên.
+    """
+    recalls = {k: [] for k in ks}
+    reciprocal_ranks, details = [], []
+    for item, hits in ranked:
+        relevant = [_is_relevant(item, hit) for hit in hits]
+        for k in ks:
+            found = {article for (_, article), ok in zip(hits[:k], relevant[:k]) if ok}
+            recalls[k].append(len(found) / len(item.articles))
+        rank = next((i for i, ok in enumerate(relevant, start=1) if ok), None)
+        reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+        details.append({
+            "question": item.question,
+            "expected": item.articles,
+            "retrieved": [article for _, article in hits],
+            "first_relevant_rank": rank,
+        })
+    summary = {"questions": len(ranked), "mrr": float(np.mean(reciprocal_ranks)) if ranked else 0.0}
+    summary.update({f"recall@{k}": float(np.mean(values)) if values else 0.0 for k, values in recalls.items()})
+    summary["details"] = details
+    return summary
+
+
+def latency_summary(values_ms):
+    if not values_ms:
+        return {"count": 0}
+    values = np.asarray(values_ms, dtype=np.float64)
+    return {
+        "count": int(values.size),
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+        "max": float(values.max()),
+    }
+
+
+def parse_server_timing(header):
+    """"embed;dur=2.1, llm;dur=50.0" -> {"embed": 2.1, "llm": 50.0} (ms)."""
+    stages = {}
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if name and key == "dur":
+                stages[name] = float(value)
+    return stages
+
+
+def peak_rss_mb():
+    """RSS cao nhất của tiến trình từ lúc khởi động (ru_maxrss tính bằng KB trên Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def compare_reports(current, baseline, quality_tolerance=0.02, latency_tolerance=0.2):
+    """Danh sách mô tả các hồi quy của `current` so với `baseline` (rỗng nếu không có).
+
+    Chất lượng (recall@k, MRR) hồi quy khi giảm quá `quality_tolerance` (tuyệt đối); độ trễ
+    p95, thông lượng và RSS đỉnh hồi quy khi xấu đi quá `latency_tolerance` (tương đối).
+    """
+    regressions = []
+    old_quality, new_quality = baseline.get("retrieval", {}), current.get("retrieval", {})
+    for key, old in old_quality.items():
+        if (key == "mrr" or key.startswith("recall@")) and key in new_quality:
+            if old - new_quality[key] > quality_tolerance:
+                regressions.append(f"{key}: {old:.3f} -> {new_quality[key]:.3f}")
+
+    def slower(label, old, new):
+        if old is not None and new is not None and new - old > max(old * latency_tolerance, LATENCY_NOISE_MS):
+            regressions.append(f"{label}: {old:.1f}ms -> {new:.1f}ms")
+
+    old_levels = {level["concurrency"]: level for level in baseline.get("load", [])}
+    for level in current.get("load", []):
+        old = old_levels.get(level["concurrency"])
+        if old is None:
+            continue
+        prefix = f"concurrency={level['concurrency']}"
+        slower(f"{prefix} p95", old["latency_ms"].get("p95"), level["latency_ms"].get("p95"))
+        for name, stats in level.get("stages_ms", {}).items():
+            slower(f"{prefix} {name} p95", old.get("stages_ms", {}).get(name, {}).get("p95"), stats.get("p95"))
+        if old["rps"] and old["rps"] - level["rps"] > old["rps"] * latency_tolerance:
+            regressions.append(f"{prefix} req/s: {old['rps']:.1f} -> {level['rps']:.1f}")
+
+    old_rss, new_rss = baseline.get("memory", {}).get("peak_rss_mb"), current.get("memory", {}).get("peak_rss_mb")
+    if old_rss and new_rss and new_rss - old_rss > old_rss * latency_tolerance:
+        regressions.append(f"peak RSS: {old_rss:.0f}MB -> {new_rss:.0f}MB")
+    return regressions
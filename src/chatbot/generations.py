@@ -0,0 +1,50 @@
+# src/chatbot/generations.py
+"""Số thế hệ dữ liệu dùng chung giữa các tiến trình, lưu trong PostgreSQL (bảng IndexGeneration).
+
+Lệnh quản trị (ingest_law_data, create_embeddings) chạy trong tiến trình riêng, còn alias
+cache `chatbot` mặc định là LocMem của từng tiến trình, nên một số thế hệ tăng trong cache
+đó không bao giờ tới được các worker web. Bảng IndexGeneration thì mọi tiến trình đều đọc
+được: lệnh quản trị gọi `bump_generation()` sau khi dữ liệu thay đổi, worker đọc
+`current_generation()` (thường chỉ mỗi vài giây) và dựng lại bản trong bộ nhớ khi số đổi.
+"""
+import logging
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import IndexGeneration
+
+logger = logging.getLogger(__name__)
+
+
+def current_generation(name):
+    """Số thế hệ hiện tại (0 nếu chưa từng tăng); None nếu không đọc được PostgreSQL."""
+    try:
+        value = IndexGeneration.objects.filter(name=name).values_list("value", flat=True).first()
+    except Exception as e:
+        logger.warning(f"Không đọc được số thế hệ '{name}': {e}")
+        return None
+    return value or 0
+
+
+async def acurrent_generation(name):
+    try:
+        value = await IndexGeneration.objects.filter(name=name).values_list("value", flat=True).afirst()
+    except Exception as e:
+        logger.warning(f"Không đọc được số thế hệ '{name}': {e}")
+        return None
+    return value or 0
+
+
+def bump_generation(name):
+    """Tăng số thế hệ; trả về giá trị mới hoặc None nếu không ghi được."""
+    try:
+        with transaction.atomic():
+            IndexGeneration.objects.get_or_create(name=name)
+            # update() không tự cập nhật auto_now: updated_at là mốc thay đổi mà các worker đọc.
+            IndexGeneration.objects.filter(name=name).update(value=F("value") + 1, updated_at=timezone.now())
+            return IndexGeneration.objects.values_list("value", flat=True).get(name=name)
+    except Exception as e:
+        logger.warning(f"Không thể tăng số thế hệ '{name}': {e}")
+        return None
@@ -0,0 +1,255 @@
+# src/chatbot/hierarchy.py
+"""Chỉ mục cấu trúc Điều/Khoản/Điểm trong tiến trình, dùng để mở rộng hit khi truy xuất.
+
+Truy xuất trả về từng Khoản/Điểm riêng lẻ, trong khi câu trả lời thường cần Khoản cha
+hoặc các Điểm cùng Khoản. `ArticleIndex` dựng sẵn từ LawProvision:
+
+- (văn bản, số Điều) -> các id điều khoản theo thứ tự phần dẫn < "2" < "2.a" < "10";
+- mỗi Điểm -> Khoản cha, mỗi Khoản -> phần dẫn của Điều (nếu có).
+
+Chỉ mục chỉ gồm vài mảng NumPy (id UUID 16 byte và các chỉ số int32, dưới 60 byte
+cho mỗi điều khoản) cùng một dict nhỏ theo Điều, nên mỗi worker giữ một bản mà không
+tốn đáng kể bộ nhớ. Tra cứu không chạm vào PostgreSQL: các id mở rộng được hydrate
+chung truy vấn với các hit gốc (nếu mọi hit gốc đều có payload `full` thì đó là truy
+vấn duy nhất của request).
+
+Chế độ mở rộng (CONTEXT_EXPANSION): "none", "parent" (Khoản cha/phần dẫn của Điều),
+"siblings" (Khoản cùng mọi Điểm của nó) hoặc "article" (cả Điều). Chỉ mục dùng chung số
+thế hệ với chỉ mục BM25 nên được dựng lại sau mỗi lần ingest_law_data có thay đổi.
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from . import metrics
+from .lexical import LEXICAL_REFRESH_SECONDS, _clause_order, current_lexical_generation
+from .models import LawProvision
+from .rag import SearchHit
+
+logger = logging.getLogger(__name__)
+
+# -- configuration --
+EXPANSION_MODES = ("none", "parent", "siblings", "article")
+CONTEXT_EXPANSION = os.getenv("CONTEXT_EXPANSION", "none")
+CONTEXT_EXPANSION_LIMIT = int(os.getenv("CONTEXT_EXPANSION_LIMIT", 10))
+
+# -- metrics --
+ARTICLE_INDEX_PROVISIONS = metrics.gauge("chatbot_article_index_provisions", "Số điều khoản trong chỉ mục cấu trúc Điều.")
+ARTICLE_INDEX_BYTES = metrics.gauge("chatbot_article_index_bytes", "Bộ nhớ các mảng của chỉ mục cấu trúc Điều.")
+EXPANDED_PROVISIONS = metrics.counter(
+    "chatbot_context_expanded_total", "Số điều khoản được thêm vào ngữ cảnh nhờ mở rộng theo cấu trúc.", ["mode"]
+)
+
+
+def _uuid_bytes(value):
+    return (value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))).bytes
+
+
+class _Snapshot:
+    """Chỉ mục đã dựng xong, không thay đổi sau khi tạo (đọc đồng thời an toàn).
+
+    Các hàng được sắp theo (văn bản, Điều, thứ tự Khoản/Điểm); mỗi Điều và mỗi nhóm
+    Khoản + Điểm là một đoạn liên tiếp [start, end) trong thứ tự đó.
+    """
+
+    def __init__(self, generation, ids, parents, article_bounds, clause_bounds, articles):
+        self.generation = generation
+        self.articles = articles              # (id văn bản, số Điều) -> (start, end)
+        self.ids = ids                        # S16, UUID của từng hàng
+        self.parents = parents                # int32, hàng cha hoặc -1
+        self.article_bounds = article_bounds  # int32 (n, 2), đoạn hàng của Điều chứa hàng này
+        self.clause_bounds = clause_bounds    # int32 (n, 2), đoạn hàng của Khoản chứa hàng này
+        self._order = np.argsort(ids, kind="stable").astype(np.int32)
+        self._sorted_ids = ids[self._order]
+
+    @property
+    def nbytes(self):
+        arrays = (self.ids, self.parents, self.article_bounds, self.clause_bounds, self._order, self._sorted_ids)
+        return sum(a.nbytes for a in arrays)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, generation, rows):
+        rows = sorted(
+            ((str(document_id), article, _clause_order(clause), clause, provision_id)
+             for provision_id, document_id, article, clause in rows),
+            key=lambda row: row[:3],
+        )
+        n = len(rows)
+        ids = np.array([_uuid_bytes(row[4]) for row in rows], dtype="S16")
+        parents = np.full(n, -1, dtype=np.int32)
+        article_bounds = np.zeros((n, 2), dtype=np.int32)
+        clause_bounds = np.zeros((n, 2), dtype=np.int32)
+        articles = {}
+
+        start = 0
+        while start < n:
+            end = start
+            while end < n and rows[end][:2] == rows[start][:2]:
+                end += 1
+            article_bounds[start:end] = (start, end)
+            articles[rows[start][:2]] = (start, end)
+            # Một lượt qua Điều: hàng của từng Khoản và đoạn [đầu, cuối) của nhóm Khoản + Điểm.
+            intro, clause_rows, groups = -1, {}, {}
+            for i in range(start, end):
+                clause = rows[i][3]
+                if not clause:
+                    intro = i
+                    continue
+                head = clause.partition(".")[0]
+                if "." not in clause:
+                    clause_rows[clause] = i
+                # Khoản và các Điểm của nó đứng liền nhau trong thứ tự đã sắp.
+                groups[head] = (groups.get(head, (i,))[0], i + 1)
+            for i in range(start, end):
+                clause = rows[i][3]
+                if not clause:
+                    clause_bounds[i] = (i, i + 1)
+                    continue
+                head = clause.partition(".")[0]
+                parents[i] = clause_rows.get(head, intro) if "." in clause else intro
+                clause_bounds[i] = groups[head]
+            start = end
+        return cls(generation, ids, parents, article_bounds, clause_bounds, articles)
+
+    def row(self, provision_id):
+        try:
+            key = _uuid_bytes(provision_id)
+        except ValueError:
+            return None
+        i = int(np.searchsorted(self._sorted_ids, key))
+        if i < len(self._sorted_ids) and bytes(self._sorted_ids[i]).ljust(16, b"\0") == key:
+            return int(self._order[i])
+        return None
+
+    def provision_id(self, row):
+        return str(uuid.UUID(bytes=bytes(self.ids[row]).ljust(16, b"\0")))
+
+    def article(self, document_id, article_number):
+        """Các id điều khoản của một Điều theo thứ tự trong Điều; [] nếu không có trong chỉ mục."""
+        start, end = self.articles.get((str(document_id), article_number), (0, 0))
+        return [self.provision_id(i) for i in range(start, end)]
+
+    def parent(self, provision_id):
+        row = self.row(provision_id)
+        if row is None or self.parents[row] < 0:
+            return None
+        return self.provision_id(self.parents[row])
+
+    def related(self, provision_id, mode):
+        row = self.row(provision_id)
+        if row is None:
+            return []
+        if mode == "parent":
+            rows = [self.parents[row]] if self.parents[row] >= 0 else []
+        elif mode == "siblings":
+            start, end = self.clause_bounds[row]
+            rows = range(start, end)
+        elif mode == "article":
+            start, end = self.article_bounds[row]
+            rows = range(start, end)
+        else:
+            rows = []
+        return [self.provision_id(i) for i in rows if i != row]
+
+
+class ArticleIndex:
+    def __init__(self, mode=CONTEXT_EXPANSION, limit=CONTEXT_EXPANSION_LIMIT,
+                 refresh_seconds=LEXICAL_REFRESH_SECONDS, queryset=None):
+        if mode not in EXPANSION_MODES:
+            raise ValueError(f"CONTEXT_EXPANSION phải là một trong {EXPANSION_MODES}, nhận được '{mode}'.")
+        self.mode = mode
+        self.limit = limit
+        self.refresh_seconds = refresh_seconds
+        self._queryset = queryset
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _rows(self):
+        queryset = self._queryset if self._queryset is not None else LawProvision.objects.order_by()
+        return queryset.values_list("id", "document_id", "article_number", "provision_id").iterator(chunk_size=5000)
+
+    def rebuild(self, generation=None):
+        started = time.perf_counter()
+        snapshot = _Snapshot.build(generation, self._rows())
+        self._snapshot = snapshot
+        ARTICLE_INDEX_PROVISIONS.set(len(snapshot))
+        ARTICLE_INDEX_BYTES.set(snapshot.nbytes)
+        logger.info(
+            f"Đã dựng chỉ mục cấu trúc Điều: {len(snapshot)} điều khoản, {snapshot.nbytes / 1024:.0f} KB, "
+            f"{time.perf_counter() - started:.2f}s."
+        )
+        return snapshot
+
+    def snapshot(self):
+        """Bản chỉ mục hiện hành; dựng lần đầu (chặn) hoặc dựng lại khi số thế hệ đổi (không chặn luồng khác)."""
+        snapshot = self._snapshot
+        now = time.monotonic()
+        if snapshot is not None and now - self._checked_at < self.refresh_seconds:
+            return snapshot
+        if not self._lock.acquire(blocking=snapshot is None):
+            return snapshot
+        try:
+            snapshot = self._snapshot
+            self._checked_at = time.monotonic()
+            generation = current_lexical_generation()
+            if snapshot is None or (generation is not None and generation != snapshot.generation):
+                snapshot = self.rebuild(generation)
+            return snapshot
+        finally:
+            self._lock.release()
+
+    def expand(self, hits):
+        """{id hit: [id điều khoản liên quan chưa có trong hits]} theo chế độ mở rộng.
+
+        Hit xếp hạng cao được mở rộng trước; tổng số điều khoản thêm vào không vượt `limit`.
+        """
+        if self.mode == "none" or not hits:
+            return {}
+        snapshot = self.snapshot()
+        seen = {hit.id for hit in hits}
+        expansion, added = {}, 0
+        for hit in hits:
+            if added >= self.limit:
+                break
+            related = [i for i in snapshot.related(hit.id, self.mode) if i not in seen][:self.limit - added]
+            if related:
+                seen.update(related)
+                expansion[hit.id] = related
+                added += len(related)
+        if added:
+            EXPANDED_PROVISIONS.inc(added, mode=self.mode)
+        return expansion
+
+    def invalidate(self):
+        self._snapshot = None
+
+
+def expansion_hits(hits, expansion):
+    """hits + các hit mở rộng (không payload), để hydrate tất cả trong cùng một truy vấn."""
+    return list(hits) + [SearchHit(i, None) for related in expansion.values() for i in related]
+
+
+def attach_expansion(provisions, expansion, hydrated):
+    """Nối sau `provisions` (đã rerank) các điều khoản mở rộng của chính chúng, theo thứ tự hạng.
+
+    Điều khoản mở rộng đứng cuối nên là phần bị bỏ trước khi prompt vượt ngân sách token.
+    """
+    if not expansion:
+        return provisions
+    by_id = {str(p.id): p for p in hydrated}
+    included = {str(p.id) for p in provisions}
+    extra = []
+    for p in provisions:
+        for related_id in expansion.get(str(p.id), ()):
+            if related_id in by_id and related_id not in included:
+                included.add(related_id)
+                extra.append(by_id[related_id])
+    return list(provisions) + extra
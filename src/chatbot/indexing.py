@@ -0,0 +1,124 @@
+# src/chatbot/indexing.py
+"""Định dạng dữ liệu được ghi vào chỉ mục vector, dùng chung cho create_embeddings và các view.
+
+Ở chế độ payload `full`, mỗi điểm Qdrant mang đủ các trường cần để dựng prompt và
+`sources`, nên view không phải quay lại PostgreSQL. `payload_version` cho phép phát hiện
+payload cũ: khi định dạng thay đổi, hãy tăng PAYLOAD_VERSION và chạy lại create_embeddings.
+
+Mọi payload đều mang `content_hash` (SHA-256 của đúng đoạn văn bản đã encode) để
+create_embeddings chỉ encode lại những điều khoản mới hoặc đã thay đổi. Payload `full` còn
+mang `payload_hash` (SHA-256 của các trường payload), vì tiêu đề văn bản, Chương, Mục có
+thể đổi mà không làm đổi đoạn văn bản đã encode.
+"""
+import hashlib
+import json
+import uuid
+from collections import namedtuple
+
+from .models import LawDocument, LawProvision
+
+PAYLOAD_VERSION = 2
+PAYLOAD_MODES = ("minimal", "full")
+
+# Các khoá payload đủ để create_embeddings quyết định có cần ghi lại một điểm hay không.
+INDEX_STATE_FIELDS = ["content_hash", "payload_version", "payload_hash"]
+
+_FULL_PAYLOAD_FIELDS = (
+    "document_id", "document_title", "chapter_info", "section_info",
+    "article_number", "article_title", "provision_id", "content",
+)
+
+
+# Các cột cần để encode và dựng payload, đọc bằng .values() thay vì dựng model instance.
+PROVISION_ROW_FIELDS = (
+    "id", "document_id", "document__title", "chapter_info", "section_info",
+    "article_number", "article_title", "provision_id", "content",
+)
+ProvisionRow = namedtuple("ProvisionRow", [f.replace("__", "_") for f in PROVISION_ROW_FIELDS])
+
+
+def provision_rows(queryset, chunk_size=2000):
+    """Duyệt điều khoản dưới dạng ProvisionRow theo từng đợt, không giữ toàn bộ kết quả trong bộ nhớ."""
+    for values in queryset.values_list(*PROVISION_ROW_FIELDS).iterator(chunk_size=chunk_size):
+        yield ProvisionRow(*values)
+
+
+def embedding_text(p):
+    return f"Điều {p.article_number} {p.article_title or ''}, Khoản {p.provision_id or 'chung'}: {p.content}"
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _full_payload_fields(p):
+    return {
+        "payload_version": PAYLOAD_VERSION,
+        "document_id": str(p.document_id),
+        "document_title": p.document_title if isinstance(p, ProvisionRow) else p.document.title,
+        "chapter_info": p.chapter_info,
+        "section_info": p.section_info,
+        "article_number": p.article_number,
+        "article_title": p.article_title,
+        "provision_id": p.provision_id,
+        "content": p.content,
+    }
+
+
+def _fields_hash(fields):
+    return content_hash(json.dumps(fields, ensure_ascii=False, sort_keys=True))
+
+
+def payload_hash(p):
+    """SHA-256 của các trường payload `full` (không gồm các hash)."""
+    return _fields_hash(_full_payload_fields(p))
+
+
+def provision_payload(p, mode="minimal", text_hash=None):
+    payload = {"postgres_id": str(p.id), "content_hash": text_hash or content_hash(embedding_text(p))}
+    if mode == "full":
+        fields = _full_payload_fields(p)
+        payload.update(fields, payload_hash=_fields_hash(fields))
+    return payload
+
+
+def index_state(payload, mode):
+    """Trạng thái của một điểm đã lưu để so với `provision_index_state`: (content_hash, payload_hash ở chế độ full)."""
+    return payload.get("content_hash"), payload.get("payload_hash") if mode == "full" else None
+
+
+def provision_index_state(p, mode, text_hash):
+    return text_hash, payload_hash(p) if mode == "full" else None
+
+
+def payload_is_current(payload, mode):
+    """Payload đang lưu (chỉ cần các khoá INDEX_STATE_FIELDS) có khớp với chế độ yêu cầu không."""
+    payload = payload or {}
+    if mode == "full":
+        return payload.get("payload_version") == PAYLOAD_VERSION
+    # Payload `full` còn sót từ lần chạy trước được view ưu tiên hơn PostgreSQL: phải ghi lại thành minimal.
+    return "payload_version" not in payload
+
+
+def payload_status(payload):
+    """'full' nếu payload dùng được thay cho PostgreSQL, 'stale' nếu khác phiên bản, ngược lại 'missing'."""
+    if not payload or "payload_version" not in payload:
+        return "missing"
+    if payload["payload_version"] != PAYLOAD_VERSION or any(f not in payload for f in _FULL_PAYLOAD_FIELDS):
+        return "stale"
+    return "full"
+
+
+def provision_from_payload(hit_id, payload):
+    """Dựng một LawProvision (chưa lưu) từ payload `full`, đủ cho build_prompt và source_entry."""
+    document = LawDocument(id=uuid.UUID(payload["document_id"]), title=payload["document_title"])
+    return LawProvision(
+        id=uuid.UUID(str(hit_id)),
+        document=document,
+        chapter_info=payload["chapter_info"],
+        section_info=payload["section_info"],
+        article_number=payload["article_number"],
+        article_title=payload["article_title"],
+        provision_id=payload["provision_id"],
+        content=payload["content"],
+    )
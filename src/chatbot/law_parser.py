@@ -0,0 +1,146 @@
+# src/chatbot/law_parser.py
+"""Bóc tách văn bản luật (Chương/Mục/Điều/Khoản/Điểm) theo từng dòng.
+
+Bộ bóc tách là một máy trạng thái: nó giữ Chương, Mục, Điều và số Khoản hiện tại, đọc
+từng dòng từ một iterable (thường là file đang mở) và sinh ra từng điều khoản ngay khi
+điều khoản đó kết thúc. Thời gian tỉ lệ tuyến tính với số dòng, bộ nhớ chỉ bằng một
+điều khoản đang mở.
+
+Mỗi điều khoản là một dict với các khoá: chapter_info, section_info, article_number,
+article_title, provision_id (None cho phần dẫn của Điều, '3' cho Khoản, '3.a' cho Điểm),
+content.
+"""
+import re
+
+CHAPTER_RE = re.compile(r'^Chương\s+[A-Z]+\b')
+SECTION_RE = re.compile(r'^Mục\s+\d+\b')
+ARTICLE_RE = re.compile(r'^Điều\s+(\d+)\.\s+(.*)')
+CLAUSE_RE = re.compile(r'^\s*(\d+)\.\s+(.*)')
+POINT_RE = re.compile(r'^\s*([a-zđ])\)\s+(.*)')
+
+_FOOTNOTE_RE = re.compile(r'\[\w+\]')
+_WHITESPACE_RE = re.compile(r'\s+')
+_INVISIBLE_CHARS = str.maketrans('', '', '\uffef\ufeff')
+
+
+def clean_text(text):
+    if not text:
+        return ""
+    text = _FOOTNOTE_RE.sub('', text)
+    text = text.translate(_INVISIBLE_CHARS)
+    return _WHITESPACE_RE.sub(' ', text).strip()
+
+
+class LawTextParser:
+    def __init__(self):
+        self.started = False
+        self.chapter = ""
+        self.section = ""
+        self.article_number = 0
+        self.article_title = ""
+        self.clause = None
+        # Chương/Mục: dòng tiêu đề nằm ở dòng kế tiếp
+        self.pending_heading = None
+        self.heading_label = ""
+        # Điều khoản đang mở: (provision_id, các dòng nội dung)
+        self.open_id = None
+        self.open_lines = None
+
+    def _close(self):
+        if self.open_lines is None:
+            return None
+        content = clean_text(" ".join(self.open_lines))
+        provision = None
+        if content:
+            provision = {
+                "chapter_info": self.chapter, "section_info": self.section,
+                "article_number": self.article_number, "article_title": self.article_title,
+                "provision_id": self.open_id, "content": content,
+            }
+        self.open_id = self.open_lines = None
+        return provision
+
+    def _open(self, provision_id, text):
+        self.open_id = provision_id
+        self.open_lines = [text]
+
+    def feed(self, line):
+        """Xử lý một dòng; trả về điều khoản vừa kết thúc (nếu có)."""
+        line = line.rstrip('\r\n').lstrip('\ufeff')
+
+        if self.pending_heading is not None:
+            title = clean_text(f"{self.heading_label} {line}")
+            if self.pending_heading == "chapter":
+                self.chapter = title
+            else:
+                self.section = title
+            self.pending_heading = None
+            return None
+
+        if CHAPTER_RE.match(line):
+            self.started = True
+            finished = self._close()
+            self.pending_heading, self.heading_label = "chapter", line.strip()
+            self.section = ""
+            return finished
+        if not self.started:
+            # Bỏ qua phần header của văn bản (trước Chương hoặc Điều đầu tiên)
+            if not ARTICLE_RE.match(line):
+                return None
+            self.started = True
+
+        if SECTION_RE.match(line):
+            finished = self._close()
+            self.pending_heading, self.heading_label = "section", line.strip()
+            return finished
+
+        match = ARTICLE_RE.match(line)
+        if match:
+            finished = self._close()
+            self.article_number = int(match.group(1))
+            self.article_title = clean_text(match.group(2))
+            self.clause = None
+            return finished
+
+        if self.article_number == 0:
+            return None
+
+        match = CLAUSE_RE.match(line)
+        if match:
+            finished = self._close()
+            self.clause = match.group(1)
+            self._open(self.clause, match.group(2))
+            return finished
+
+        match = POINT_RE.match(line)
+        if match:
+            finished = self._close()
+            self._open(f"{self.clause or 'unknown'}.{match.group(1)}", match.group(2))
+            return finished
+
+        # Dòng nội dung: nối vào điều khoản đang mở, hoặc mở phần dẫn của Điều
+        if self.open_lines is not None:
+            self.open_lines.append(line)
+        elif line.strip():
+            self._open(None, line)
+        return None
+
+    def close(self):
+        """Kết thúc văn bản; trả về điều khoản cuối cùng (nếu có)."""
+        return self._close()
+
+
+def parse_law_lines(lines):
+    parser = LawTextParser()
+    for line in lines:
+        provision = parser.feed(line)
+        if provision is not None:
+            yield provision
+    provision = parser.close()
+    if provision is not None:
+        yield provision
+
+
+def parse_law_file(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        yield from parse_law_lines(f)
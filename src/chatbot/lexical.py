@@ -0,0 +1,293 @@
+# src/chatbot/lexical.py
+"""Chỉ mục từ vựng (BM25) trong tiến trình và tra cứu trực tiếp "Điều N khoản M điểm x".
+
+Câu hỏi luật hay trích nguyên văn thuật ngữ ("công ty TNHH hai thành viên", "Điều 47")
+mà bi-encoder có thể bỏ sót. `LexicalIndex` đánh chỉ mục ngược trên article_title +
+content của LawProvision, tách theo âm tiết tiếng Việt (mỗi âm tiết là một từ cách
+nhau bởi dấu cách) kèm cặp âm tiết liền kề để khớp cụm từ. Kết quả được trộn với hit
+từ Qdrant bằng reciprocal rank fusion (`reciprocal_rank_fusion`).
+
+Tra cứu trực tiếp theo từng văn bản: khi kho có nhiều văn bản cùng có "Điều 47", văn bản
+được xác định từ câu hỏi (số hiệu hoặc tiêu đề văn bản), rồi tới DIRECT_LOOKUP_DEFAULT_DOCUMENT
+(tiêu đề hoặc số hiệu), rồi tới văn bản duy nhất có Điều đó. Không xác định được thì không
+tra cứu trực tiếp (câu hỏi đi qua tìm kiếm thường) thay vì trộn điều khoản của nhiều luật.
+
+Chỉ mục được dựng lười từ PostgreSQL ở lần tra đầu tiên và dựng lại khi số thế hệ
+`LEXICAL_GENERATION` (bảng IndexGeneration, xem chatbot.generations) thay đổi; ingest_law_data
+tăng nó sau mỗi lần nạp có thay đổi. Việc kiểm tra số thế hệ chỉ diễn ra mỗi
+LEXICAL_REFRESH_SECONDS giây; trong lúc dựng lại, các luồng khác vẫn dùng bản cũ.
+"""
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict, namedtuple
+
+import numpy as np
+
+from . import metrics
+from .generations import bump_generation, current_generation
+from .models import LawDocument, LawProvision
+from .rag import SearchHit
+
+logger = logging.getLogger(__name__)
+
+# -- configuration --
+HYBRID_SEARCH_ENABLED = os.getenv("HYBRID_SEARCH_ENABLED", "1") == "1"
+HYBRID_CANDIDATE_FACTOR = int(os.getenv("HYBRID_CANDIDATE_FACTOR", 2))
+RRF_K = int(os.getenv("RRF_K", 60))
+DIRECT_LOOKUP_LIMIT = int(os.getenv("DIRECT_LOOKUP_LIMIT", 20))
+DIRECT_LOOKUP_DEFAULT_DOCUMENT = os.getenv("DIRECT_LOOKUP_DEFAULT_DOCUMENT", "")  # tiêu đề hoặc số hiệu văn bản
+LEXICAL_REFRESH_SECONDS = float(os.getenv("LEXICAL_REFRESH_SECONDS", 30))
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+LEXICAL_GENERATION = "lexical"
+
+# -- metrics --
+LEXICAL_DOCUMENTS = metrics.gauge("chatbot_lexical_index_documents", "Số điều khoản trong chỉ mục BM25.")
+LEXICAL_BUILD_SECONDS = metrics.gauge("chatbot_lexical_index_build_seconds", "Thời gian dựng chỉ mục BM25 gần nhất.")
+LEXICAL_SEARCH_SECONDS = metrics.histogram("chatbot_lexical_search_seconds", "Thời gian một lần tìm kiếm BM25.")
+DIRECT_LOOKUPS = metrics.counter(
+    "chatbot_direct_lookup_total",
+    "Số câu hỏi trích dẫn Điều/Khoản cụ thể, theo kết quả tra cứu (ambiguous: không xác định được văn bản).",
+    ["result"],
+)
+
+_TOKEN_RE = re.compile(r"\w+")
+_ARTICLE_REF_RE = re.compile(r"\bđiều\s+(\d+)\b")
+_CLAUSE_REF_RE = re.compile(r"\bkhoản\s+(\d+)\b")
+_POINT_REF_RE = re.compile(r"\bđiểm\s+([a-zđ])\b")
+
+Reference = namedtuple("Reference", ["article", "clause", "point"])
+
+
+def _normalize(text):
+    return " ".join(unicodedata.normalize("NFC", text or "").lower().split())
+
+
+def tokenize(text):
+    """Âm tiết (chữ thường, NFC) và các cặp âm tiết liền kề."""
+    syllables = _TOKEN_RE.findall(unicodedata.normalize("NFC", text or "").lower())
+    return syllables + [f"{a}_{b}" for a, b in zip(syllables, syllables[1:])]
+
+
+def parse_reference(question):
+    """Nhận dạng "Điều N [khoản M] [điểm x]" (theo thứ tự bất kỳ). Trả về None nếu không có
+    hoặc câu hỏi nhắc tới nhiều Điều khác nhau."""
+    text = unicodedata.normalize("NFC", question).lower()
+    articles = set(_ARTICLE_REF_RE.findall(text))
+    if len(articles) != 1:
+        return None
+    clause = _CLAUSE_REF_RE.search(text)
+    point = _POINT_REF_RE.search(text) if clause else None
+    return Reference(int(articles.pop()), clause and clause.group(1), point and point.group(1))
+
+
+def _clause_order(clause):
+    """Khoá sắp xếp "phần dẫn" < "2" < "2.a" < "2.b" < "10"."""
+    if not clause:
+        return (0, "")
+    number, _, point = clause.partition(".")
+    return (int(number) if number.isdigit() else 1 << 30, point)
+
+
+def reciprocal_rank_fusion(rankings, limit, k=RRF_K):
+    """Trộn nhiều danh sách SearchHit theo RRF: điểm của một id là tổng 1 / (k + hạng).
+
+    Hit trả về giữ `score`/`payload` của danh sách đầu tiên có id đó (đặt kết quả vector
+    trước để nguồn trích dẫn vẫn mang điểm cosine và payload Qdrant).
+    """
+    fused, first_seen = defaultdict(float), {}
+    for hits in rankings:
+        for rank, hit in enumerate(hits, start=1):
+            fused[hit.id] += 1.0 / (k + rank)
+            first_seen.setdefault(hit.id, hit)
+    ranked = sorted(fused, key=fused.__getitem__, reverse=True)[:limit]
+    return [first_seen[hit_id] for hit_id in ranked]
+
+
+class _Snapshot:
+    """Chỉ mục đã dựng xong, không thay đổi sau khi tạo (đọc đồng thời an toàn)."""
+
+    def __init__(self, generation, ids, clauses, doc_lengths, postings, references, articles, documents=(),
+                 default_document=None):
+        self.generation = generation
+        self.ids = ids
+        self.clauses = clauses
+        self.doc_lengths = doc_lengths
+        self.avg_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+        self.postings = postings
+        self.references = references
+        self.articles = articles
+        self.article_documents = defaultdict(set)
+        for document_id, article_number in articles:
+            self.article_documents[article_number].add(document_id)
+        # Khớp tên dài trước: "luật doanh nghiệp 2020" không bị nhận nhầm là "luật doanh nghiệp".
+        self.document_names = sorted(
+            ((name, document_id) for document_id, *names in documents for name in map(_normalize, names) if name),
+            key=lambda item: -len(item[0]),
+        )
+        self.default_document = default_document
+
+    @classmethod
+    def build(cls, generation, rows, documents=(), default_document=""):
+        """rows: (id, document_id, article_number, provision_id, article_title, content);
+        documents: (document_id, title, document_number)."""
+        ids, clauses, lengths = [], [], []
+        postings = defaultdict(lambda: ([], []))
+        references, articles = defaultdict(list), defaultdict(list)
+        for provision_id, document_id, article_number, clause, article_title, content in rows:
+            doc = len(ids)
+            ids.append(str(provision_id))
+            clauses.append(clause)
+            tokens = tokenize(f"{article_title or ''} {content}")
+            lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                docs, tfs = postings[term]
+                docs.append(doc)
+                tfs.append(tf)
+            references[(str(document_id), article_number, clause)].append(doc)
+            articles[(str(document_id), article_number)].append(doc)
+        for docs in articles.values():
+            docs.sort(key=lambda doc: _clause_order(clauses[doc]))
+        postings = {
+            term: (np.asarray(docs, dtype=np.int32), np.asarray(tfs, dtype=np.float32))
+            for term, (docs, tfs) in postings.items()
+        }
+        documents = [(str(document_id), title, number) for document_id, title, number in documents]
+        default = _normalize(default_document)
+        default_id = next((d for d, *names in documents if default and default in map(_normalize, names)), None)
+        if default and default_id is None:
+            logger.warning(f"DIRECT_LOOKUP_DEFAULT_DOCUMENT '{default_document}' không khớp văn bản nào.")
+        return cls(generation, ids, clauses, np.asarray(lengths, dtype=np.float32), postings, dict(references),
+                   dict(articles), documents, default_id)
+
+    def search(self, question, limit):
+        terms = [term for term in set(tokenize(question)) if term in self.postings]
+        if not terms or limit <= 0:
+            return []
+        n_docs = len(self.ids)
+        scores = np.zeros(n_docs, dtype=np.float32)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths / (self.avg_length or 1.0))
+        for term in terms:
+            docs, tfs = self.postings[term]
+            idf = np.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            # Mỗi doc xuất hiện tối đa một lần trong danh sách của một term nên có thể cộng theo chỉ số.
+            scores[docs] += idf * tfs * (BM25_K1 + 1) / (tfs + norm[docs])
+        top = min(limit, int(np.count_nonzero(scores)))
+        if not top:
+            return []
+        candidates = np.argpartition(-scores, top - 1)[:top]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [SearchHit(self.ids[i], None) for i in candidates]
+
+    def resolve_document(self, question, article):
+        """Văn bản mà câu hỏi trích dẫn Điều `article`; None nếu không xác định được."""
+        text = _normalize(question)
+        for name, document_id in self.document_names:
+            if name in text:
+                return document_id
+        candidates = self.article_documents.get(article, set())
+        if self.default_document in candidates:
+            return self.default_document
+        if len(candidates) == 1:
+            return next(iter(candidates))
+        return None
+
+    def lookup(self, reference, limit, document_id):
+        if reference.point:
+            docs = self.references.get((document_id, reference.article, f"{reference.clause}.{reference.point}"), [])
+        elif reference.clause:
+            # Khoản M kèm các điểm "M.a", "M.b"... của nó.
+            prefix = f"{reference.clause}."
+            docs = [
+                doc for doc in self.articles.get((document_id, reference.article), [])
+                if self.clauses[doc] == reference.clause or (self.clauses[doc] or "").startswith(prefix)
+            ]
+        else:
+            docs = self.articles.get((document_id, reference.article), [])
+        return [SearchHit(self.ids[doc], None) for doc in docs[:limit]]
+
+
+class LexicalIndex:
+    def __init__(self, refresh_seconds=LEXICAL_REFRESH_SECONDS, queryset=None,
+                 default_document=DIRECT_LOOKUP_DEFAULT_DOCUMENT):
+        self.refresh_seconds = refresh_seconds
+        self.default_document = default_document
+        self._queryset = queryset
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _rows(self):
+        queryset = self._queryset if self._queryset is not None else LawProvision.objects.order_by()
+        fields = ("id", "document_id", "article_number", "provision_id", "article_title", "content")
+        return queryset.values_list(*fields).iterator(chunk_size=2000)
+
+    def _documents(self):
+        return LawDocument.objects.order_by().values_list("id", "title", "document_number")
+
+    def rebuild(self, generation=None):
+        started = time.perf_counter()
+        snapshot = _Snapshot.build(generation, self._rows(), self._documents(), self.default_document)
+        self._snapshot = snapshot
+        elapsed = time.perf_counter() - started
+        LEXICAL_DOCUMENTS.set(len(snapshot.ids))
+        LEXICAL_BUILD_SECONDS.set(elapsed)
+        logger.info(f"Đã dựng chỉ mục BM25: {len(snapshot.ids)} điều khoản, {len(snapshot.postings)} term, {elapsed:.2f}s.")
+        return snapshot
+
+    def snapshot(self):
+        """Bản chỉ mục hiện hành; dựng lần đầu (chặn) hoặc dựng lại khi số thế hệ đổi (không chặn luồng khác)."""
+        snapshot = self._snapshot
+        now = time.monotonic()
+        if snapshot is not None and now - self._checked_at < self.refresh_seconds:
+            return snapshot
+        if not self._lock.acquire(blocking=snapshot is None):
+            return snapshot
+        try:
+            snapshot = self._snapshot
+            self._checked_at = time.monotonic()
+            generation = current_lexical_generation()
+            if snapshot is None or (generation is not None and generation != snapshot.generation):
+                snapshot = self.rebuild(generation)
+            return snapshot
+        finally:
+            self._lock.release()
+
+    def search(self, question, limit):
+        started = time.perf_counter()
+        hits = self.snapshot().search(question, limit)
+        LEXICAL_SEARCH_SECONDS.observe(time.perf_counter() - started)
+        return hits
+
+    def lookup(self, question, limit=DIRECT_LOOKUP_LIMIT):
+        """Tra cứu trực tiếp khi câu hỏi trích dẫn một Điều cụ thể; [] nếu không có hoặc không khớp."""
+        reference = parse_reference(question)
+        if reference is None:
+            return []
+        snapshot = self.snapshot()
+        document_id = snapshot.resolve_document(question, reference.article)
+        if document_id is None:
+            DIRECT_LOOKUPS.inc(result="ambiguous" if snapshot.article_documents.get(reference.article) else "miss")
+            return []
+        hits = snapshot.lookup(reference, limit, document_id)
+        DIRECT_LOOKUPS.inc(result="hit" if hits else "miss")
+        return hits
+
+    def invalidate(self):
+        self._snapshot = None
+
+
+def current_lexical_generation():
+    """Số thế hệ dữ liệu điều khoản hiện tại; None nếu không đọc được."""
+    return current_generation(LEXICAL_GENERATION)
+
+
+def bump_lexical_generation():
+    """Gọi sau khi điều khoản trong PostgreSQL thay đổi để mọi worker dựng lại chỉ mục
+    (BM25 và chỉ mục cấu trúc Điều trong chatbot.hierarchy)."""
+    bump_generation(LEXICAL_GENERATION)
@@ -0,0 +1,430 @@
+# src/chatbot/llm.py
+"""Lớp gateway quanh một nhà cung cấp LLM: hạn chót, giới hạn đồng thời, thử lại, hedge, ngắt mạch.
+
+- Mỗi lần gọi có hạn chót LLM_DEADLINE giây (tính cả thử lại), mỗi lượt gọi tối đa
+  LLM_TIMEOUT giây. Request HTTP không bị giữ lâu hơn mức đó.
+- Tối đa LLM_MAX_CONCURRENCY lời gọi upstream cùng lúc trong một worker. Lời gọi sync đã
+  quá hạn vẫn giữ chỗ cho tới khi upstream thực sự trả về, nên giới hạn là thật. Lời gọi
+  async chờ chỗ ngay trong event loop (được đánh thức khi có chỗ trả lại), không chiếm
+  thread của executor mặc định mà các bước `asyncio.to_thread` khác trong view cần dùng.
+- Lỗi tạm thời (quá hạn, mất kết nối, 429/5xx của Google API) được thử lại tối đa
+  LLM_RETRIES lần, chờ ngẫu nhiên trong [0, LLM_RETRY_BASE * 2^n] giây.
+- Hedge (LLM_HEDGE=1): nếu lượt đầu chưa xong sau p95 độ trễ gần đây, gửi thêm một
+  lượt thứ hai (khi còn chỗ) và lấy kết quả về trước.
+- Ngắt mạch: sau LLM_BREAKER_FAILURES lỗi tạm thời liên tiếp, mọi lời gọi bị từ chối
+  ngay (CircuitOpen) trong LLM_BREAKER_RESET giây; view trả câu trả lời dự phòng chỉ gồm
+  nguồn trích dẫn. Hết thời gian, một lời gọi thử quyết định đóng lại hay mở tiếp.
+
+Nhà cung cấp (Gemini, stub cục bộ) nằm trong chatbot.providers; LLM_PROVIDER=stub cho
+phép thử tải toàn bộ pipeline mà không cần mạng.
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# -- configuration --
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 30))
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", 60))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", 2))
+LLM_RETRY_BASE = float(os.getenv("LLM_RETRY_BASE", 0.5))
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_MIN_MS = float(os.getenv("LLM_HEDGE_MIN_MS", 500))
+LLM_HEDGE_MIN_SAMPLES = 20
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", 5))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", 30))
+
+# Tên lớp lỗi của google.api_core coi là tạm thời (không import để không phụ thuộc gói).
+TRANSIENT_ERROR_NAMES = {
+    "DeadlineExceeded", "ServiceUnavailable", "ResourceExhausted", "TooManyRequests",
+    "InternalServerError", "GatewayTimeout", "BadGateway", "RetryError",
+}
+
+# -- metrics --
+LLM_REQUESTS = metrics.counter(
+    "chatbot_llm_requests_total",
+    "Số lời gọi LLM theo kết quả: ok, timeout, error, busy hoặc breaker_open.", ["result"]
+)
+LLM_ATTEMPTS = metrics.counter("chatbot_llm_attempts_total", "Số lượt gọi upstream (gồm thử lại và hedge).", ["kind"])
+LLM_SECONDS = metrics.histogram("chatbot_llm_seconds", "Thời gian một lời gọi LLM thành công (gồm thử lại).")
+LLM_IN_FLIGHT = metrics.gauge("chatbot_llm_in_flight", "Số lượt gọi upstream đang chạy.")
+LLM_HEDGES = metrics.counter("chatbot_llm_hedges_total", "Số lượt hedge theo kết quả: won hoặc lost.", ["result"])
+LLM_BREAKER_STATE = metrics.gauge("chatbot_llm_breaker_open", "1 nếu bộ ngắt mạch LLM đang mở.")
+
+
+class LLMError(Exception):
+    pass
+
+
+class LLMTimeout(LLMError, TimeoutError):
+    pass
+
+
+class LLMBusy(LLMError):
+    pass
+
+
+class CircuitOpen(LLMError):
+    pass
+
+
+def is_transient(error):
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return type(error).__name__ in TRANSIENT_ERROR_NAMES
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=LLM_BREAKER_FAILURES, reset_seconds=LLM_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial = False
+        self._trial_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """True nếu được gọi upstream. Khi nửa mở chỉ cho một lời gọi thử; lời gọi thử không
+        báo kết quả (ví dụ hết chỗ) thì sau reset_seconds được thay bằng lời gọi thử khác."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            now = time.monotonic()
+            if self.state == "open" and now - self.opened_at >= self.reset_seconds:
+                self.state, self._trial = "half_open", False
+            if self.state == "half_open" and (not self._trial or now - self._trial_at >= self.reset_seconds):
+                self._trial, self._trial_at = True, now
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                logger.info("Bộ ngắt mạch LLM đóng lại.")
+            self.state, self.failures, self._trial = "closed", 0, False
+            LLM_BREAKER_STATE.set(0)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+                logger.warning(f"Bộ ngắt mạch LLM mở sau {self.failures} lỗi liên tiếp, từ chối trong {self.reset_seconds:.0f}s.")
+                self.state, self.opened_at, self._trial = "open", time.monotonic(), False
+                LLM_BREAKER_STATE.set(1)
+
+
+class LatencyTracker:
+    """Độ trễ các lượt gọi thành công gần đây; p95 quyết định lúc gửi hedge."""
+
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+
+    def observe(self, seconds):
+        self._samples.append(seconds)
+
+    def p95(self):
+        samples = sorted(self._samples)
+        if len(samples) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        return samples[int(0.95 * (len(samples) - 1))]
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class LLMGateway:
+    def __init__(self, provider, timeout=LLM_TIMEOUT, deadline=LLM_DEADLINE, max_concurrency=LLM_MAX_CONCURRENCY,
+                 retries=LLM_RETRIES, retry_base=LLM_RETRY_BASE, hedge=LLM_HEDGE, hedge_min_ms=LLM_HEDGE_MIN_MS,
+                 breaker=None):
+        self.provider = provider
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.retry_base = retry_base
+        self.hedge = hedge
+        self.hedge_min = hedge_min_ms / 1000.0
+        self.breaker = breaker or CircuitBreaker()
+        self.latencies = LatencyTracker()
+        self.max_concurrency = max_concurrency
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._waiters = set()  # (loop, future) của các lời gọi async đang chờ chỗ
+        self._waiters_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm-call")
+
+    def hedge_delay(self):
+        if not self.hedge:
+            return None
+        p95 = self.latencies.p95()
+        return None if p95 is None else max(self.hedge_min, p95)
+
+    def _backoff(self, attempt):
+        return random.uniform(0, self.retry_base * 2 ** (attempt - 1))
+
+    def _retry_delay(self, error, attempt, deadline):
+        """Ghi nhận lỗi vào bộ ngắt mạch; trả về thời gian chờ trước lần thử lại, hoặc None nếu không thử lại."""
+        if not is_transient(error):
+            # Upstream vẫn trả lời (yêu cầu sai, bị chặn nội dung...): không tính là sự cố.
+            if not isinstance(error, (CircuitOpen, LLMBusy)):
+                self.breaker.record_success()
+            return None
+        self.breaker.record_failure()
+        delay = self._backoff(attempt)
+        if attempt > self.retries or time.monotonic() + delay >= deadline or not self.breaker.allow():
+            return None
+        logger.warning(f"Lỗi tạm thời khi gọi LLM ({error!r}), thử lại lần {attempt} sau {delay:.2f}s.")
+        return delay
+
+    def _finish(self, started, error=None):
+        if error is None:
+            self.breaker.record_success()
+            LLM_SECONDS.observe(time.perf_counter() - started)
+            LLM_REQUESTS.inc(result="ok")
+        elif isinstance(error, CircuitOpen):
+            LLM_REQUESTS.inc(result="breaker_open")
+        elif isinstance(error, LLMBusy):
+            LLM_REQUESTS.inc(result="busy")
+        elif isinstance(error, TimeoutError):
+            LLM_REQUESTS.inc(result="timeout")
+        else:
+            LLM_REQUESTS.inc(result="error")
+
+    def _release_slot(self):
+        """Trả một chỗ và đánh thức các lời gọi async đang chờ (có thể từ thread của lời gọi sync)."""
+        self._slots.release()
+        with self._waiters_lock:
+            waiters = list(self._waiters)
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, waiter)
+            except RuntimeError:
+                pass  # event loop đã đóng
+
+    # -- sync --
+    def _submit(self, prompt, timeout, kind):
+        if not self._slots.acquire(timeout=max(0.0, timeout)):
+            raise LLMBusy(f"Đã đủ {self.max_concurrency} lời gọi LLM đồng thời.")
+        LLM_ATTEMPTS.inc(kind=kind)
+        LLM_IN_FLIGHT.inc()
+        started = time.monotonic()
+
+        def run():
+            try:
+                text = self.provider.generate(prompt)
+            finally:
+                self._release_slot()
+                LLM_IN_FLIGHT.dec()
+            self.latencies.observe(time.monotonic() - started)
+            return text
+        return self._executor.submit(run)
+
+    def _attempt(self, prompt, deadline):
+        timeout = min(self.timeout, deadline - time.monotonic())
+        if timeout <= 0:
+            raise LLMTimeout("Hết hạn chót gọi LLM.")
+        started = time.monotonic()
+        first = self._submit(prompt, timeout, "primary")
+        futures = [first]
+        hedge_delay = self.hedge_delay()
+        if hedge_delay is not None and hedge_delay < timeout:
+            done, _ = wait(futures, timeout=hedge_delay)
+            if not done:
+                try:
+                    futures.append(self._submit(prompt, 0, "hedge"))
+                except LLMBusy:
+                    pass
+
+        pending, error = set(futures), None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, timeout - (time.monotonic() - started)),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                raise LLMTimeout(f"LLM không trả lời trong {timeout:.1f}s.")
+            for future in done:
+                if future.exception() is None:
+                    if len(futures) > 1:
+                        LLM_HEDGES.inc(result="won" if future is futures[1] else "lost")
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def generate(self, prompt):
+        """Sinh câu trả lời (chặn); ném CircuitOpen/LLMTimeout/LLMBusy hoặc lỗi của upstream."""
+        started = time.perf_counter()
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        try:
+            if not self.breaker.allow():
+                raise CircuitOpen("Bộ ngắt mạch LLM đang mở.")
+            while True:
+                try:
+                    text = self._attempt(prompt, deadline)
+                    break
+                except Exception as e:
+                    attempt += 1
+                    delay = self._retry_delay(e, attempt, deadline)
+                    if delay is None:
+                        raise
+                    time.sleep(delay)
+        except Exception as e:
+            self._finish(started, e)
+            raise
+        self._finish(started)
+        return text
+
+    # -- async --
+    async def _aacquire(self, timeout):
+        deadline = time.monotonic() + max(0.0, timeout)
+        loop = asyncio.get_running_loop()
+        while True:
+            if self._slots.acquire(blocking=False):
+                return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise LLMBusy(f"Đã đủ {self.max_concurrency} lời gọi LLM đồng thời.")
+            entry = (loop, loop.create_future())
+            # Đăng ký trước rồi mới thử lại: chỗ được trả giữa hai bước vẫn đánh thức lời gọi này.
+            with self._waiters_lock:
+                self._waiters.add(entry)
+            try:
+                if self._slots.acquire(blocking=False):
+                    return
+                await asyncio.wait_for(entry[1], remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self._waiters_lock:
+                    self._waiters.discard(entry)
+
+    async def _acall(self, prompt, timeout, kind):
+        await self._aacquire(timeout)
+        LLM_ATTEMPTS.inc(kind=kind)
+        LLM_IN_FLIGHT.inc()
+        started = time.monotonic()
+        try:
+            text = await self.provider.agenerate(prompt)
+        finally:
+            self._release_slot()
+            LLM_IN_FLIGHT.dec()
+        self.latencies.observe(time.monotonic() - started)
+        return text
+
+    async def _aattempt(self, prompt, deadline):
+        timeout = min(self.timeout, deadline - time.monotonic())
+        if timeout <= 0:
+            raise LLMTimeout("Hết hạn chót gọi LLM.")
+        started = time.monotonic()
+        tasks = [asyncio.ensure_future(self._acall(prompt, timeout, "primary"))]
+        try:
+            hedge_delay = self.hedge_delay()
+            if hedge_delay is not None and hedge_delay < timeout:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+                if not done and self._slots.acquire(blocking=False):
+                    self._release_slot()
+                    tasks.append(asyncio.ensure_future(self._acall(prompt, 0, "hedge")))
+
+            pending, error = set(tasks), None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(0.0, timeout - (time.monotonic() - started)), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    raise LLMTimeout(f"LLM không trả lời trong {timeout:.1f}s.")
+                for task in done:
+                    if task.exception() is None:
+                        if len(tasks) > 1:
+                            LLM_HEDGES.inc(result="won" if task is tasks[1] else "lost")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def agenerate(self, prompt):
+        started = time.perf_counter()
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        try:
+            if not self.breaker.allow():
+                raise CircuitOpen("Bộ ngắt mạch LLM đang mở.")
+            while True:
+                try:
+                    text = await self._aattempt(prompt, deadline)
+                    break
+                except Exception as e:
+                    attempt += 1
+                    delay = self._retry_delay(e, attempt, deadline)
+                    if delay is None:
+                        raise
+                    await asyncio.sleep(delay)
+        except Exception as e:
+            self._finish(started, e)
+            raise
+        self._finish(started)
+        return text
+
+    async def astream(self, prompt):
+        """Sinh câu trả lời theo từng đoạn văn bản. Chỉ thử lại khi chưa nhận được đoạn nào;
+        mỗi đoạn phải tới trong LLM_TIMEOUT giây và cả luồng trong LLM_DEADLINE giây."""
+        started = time.perf_counter()
+        deadline = time.monotonic() + self.deadline
+        attempt, received = 0, False
+        try:
+            if not self.breaker.allow():
+                raise CircuitOpen("Bộ ngắt mạch LLM đang mở.")
+            while True:
+                try:
+                    async for text in self._astream_once(prompt, deadline):
+                        received = True
+                        yield text
+                    break
+                except Exception as e:
+                    attempt += 1
+                    delay = self._retry_delay(e, attempt, deadline)
+                    if delay is None or received:
+                        raise
+                    await asyncio.sleep(delay)
+        except Exception as e:
+            self._finish(started, e)
+            raise
+        self._finish(started)
+
+    async def _astream_once(self, prompt, deadline):
+        def remaining():
+            timeout = min(self.timeout, deadline - time.monotonic())
+            if timeout <= 0:
+                raise LLMTimeout("Hết hạn chót gọi LLM.")
+            return timeout
+
+        await self._aacquire(remaining())
+        LLM_ATTEMPTS.inc(kind="stream")
+        LLM_IN_FLIGHT.inc()
+        try:
+            chunks = self.provider.astream(prompt)
+            try:
+                while True:
+                    try:
+                        text = await asyncio.wait_for(chunks.__anext__(), remaining())
+                    except StopAsyncIteration:
+                        return
+                    except asyncio.TimeoutError:
+                        raise LLMTimeout("LLM ngừng gửi dữ liệu quá lâu.")
+                    yield text
+            finally:
+                await chunks.aclose()
+        finally:
+            self._release_slot()
+            LLM_IN_FLIGHT.dec()
@@ -0,0 +1,105 @@
+# src/chatbot/management/commands/benchmark_embedding.py
+
+import json
+import multiprocessing
+import os
+import resource
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from chatbot.embedding import EMBEDDING_ARTIFACT_DIR, EMBEDDING_BACKENDS
+
+BENCH_QUERIES = [
+    "Vốn điều lệ là gì?",
+    "Điều kiện thành lập công ty trách nhiệm hữu hạn hai thành viên trở lên",
+    "Thủ tục giải thể doanh nghiệp",
+    "Cổ đông sáng lập có quyền chuyển nhượng cổ phần không?",
+]
+
+def rss_mb():
+    """RSS hiện tại (Linux: /proc/self/status), nếu không có thì RSS cực đại."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def measure_backend(backend, artifact_dir, queries, batch_size, results):
+    """Chạy trong một process mới để đo đúng thời gian khởi động lạnh và RSS của từng backend."""
+    try:
+        baseline = rss_mb()
+        started = time.perf_counter()
+        from chatbot.embedding import load_embedding_model
+        model = load_embedding_model(backend, artifact_dir)
+        model.encode(BENCH_QUERIES[0])  # lượt đầu tiên (khởi tạo lười của runtime) tính vào khởi động
+        startup = time.perf_counter() - started
+        loaded_rss = rss_mb()
+
+        latencies = []
+        for i in range(queries):
+            started = time.perf_counter()
+            model.encode(f"{BENCH_QUERIES[i % len(BENCH_QUERIES)]} {i}")
+            latencies.append(time.perf_counter() - started)
+
+        texts = [f"{BENCH_QUERIES[i % len(BENCH_QUERIES)]} (mẫu {i})" for i in range(batch_size * 4)]
+        started = time.perf_counter()
+        model.encode(texts, batch_size=batch_size)
+        throughput = len(texts) / (time.perf_counter() - started)
+
+        results.put({
+            "backend": backend,
+            "startup_s": startup,
+            "rss_mb": loaded_rss,
+            "model_rss_mb": loaded_rss - baseline,
+            "p50_ms": float(np.percentile(latencies, 50) * 1000),
+            "p95_ms": float(np.percentile(latencies, 95) * 1000),
+            "batch_per_s": throughput,
+        })
+    except Exception as e:
+        results.put({"backend": backend, "error": str(e)})
+
+class Command(BaseCommand):
+    help = "So sánh các backend embedding: thời gian khởi động, RSS và độ trễ encode."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backends', nargs='+', choices=EMBEDDING_BACKENDS, default=list(EMBEDDING_BACKENDS))
+        parser.add_argument('--artifact-dir', default=EMBEDDING_ARTIFACT_DIR)
+        parser.add_argument('--queries', type=int, default=200, help="Số câu hỏi đơn lẻ để đo độ trễ.")
+        parser.add_argument('--batch-size', type=int, default=32)
+        parser.add_argument('--json', help="Ghi kết quả ra file JSON.")
+
+    def handle(self, *args, **options):
+        context = multiprocessing.get_context('spawn')
+        rows = []
+        for backend in options['backends']:
+            if backend != 'torch' and not os.path.isdir(options['artifact_dir']):
+                rows.append({"backend": backend, "error": "chưa có artifact, hãy chạy export_embedding_model"})
+                continue
+            self.stdout.write(f"Đang đo backend '{backend}'...")
+            results = context.Queue()
+            process = context.Process(
+                target=measure_backend,
+                args=(backend, options['artifact_dir'], options['queries'], options['batch_size'], results),
+            )
+            process.start()
+            row = results.get()
+            process.join()
+            rows.append(row)
+
+        self.stdout.write(
+            f"\n    {'Backend':<12} {'Khởi động':>10} {'RSS':>9} {'RSS mô hình':>12} {'p50':>9} {'p95':>9} {'Lô/giây':>9}"
+        )
+        for row in rows:
+            if "error" in row:
+                self.stdout.write(self.style.ERROR(f"    {row['backend']:<12} lỗi: {row['error']}"))
+                continue
+            self.stdout.write(
+                f"    {row['backend']:<12} {row['startup_s']:>9.2f}s {row['rss_mb']:>7.0f}MB {row['model_rss_mb']:>10.0f}MB "
+                f"{row['p50_ms']:>7.2f}ms {row['p95_ms']:>7.2f}ms {row['batch_per_s']:>9.1f}"
+            )
+        if options['json']:
+            with open(options['json'], 'w', encoding='utf-8') as f:
+                json.dump(rows, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,65 @@
+# src/chatbot/management/commands/benchmark_parser.py
+
+import math
+import os
+import tempfile
+import time
+from django.core.management.base import BaseCommand
+from chatbot.law_parser import parse_law_file
+
+CLAUSES_PER_ARTICLE = 3
+POINTS_PER_CLAUSE = 2
+ARTICLES_PER_CHAPTER = 50
+
+def write_synthetic_law(f, articles):
+    """Ghi một văn bản luật giả lập có `articles` Điều vào file đang mở (không dựng cả văn bản trong bộ nhớ)."""
+    f.write("QUỐC HỘI\nLUẬT GIẢ LẬP ĐỂ ĐO HIỆU NĂNG\n\n")
+    for n in range(1, articles + 1):
+        if n % ARTICLES_PER_CHAPTER == 1:
+            chapter = n // ARTICLES_PER_CHAPTER + 1
+            f.write(f"Chương {'I' * (chapter % 5 + 1)}\nQUY ĐỊNH SỐ {chapter}\n")
+        f.write(f"Điều {n}. Nội dung điều {n}\n")
+        for clause in range(1, CLAUSES_PER_ARTICLE + 1):
+            f.write(f"{clause}. Khoản {clause} của Điều {n} quy định như sau:\n")
+            for point in "abcdefgh"[:POINTS_PER_CLAUSE]:
+                f.write(f"{point}) Điểm {point} thuộc khoản {clause} Điều {n};\n")
+            f.write("dòng tiếp nối của khoản trên.\n")
+
+class Command(BaseCommand):
+    help = "Đo thời gian bóc tách văn bản luật giả lập ở nhiều kích thước để kiểm tra độ phức tạp tuyến tính."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+            help="Số Điều của từng văn bản giả lập."
+        )
+        parser.add_argument('--repeat', type=int, default=3, help="Số lần đo mỗi kích thước (lấy lần nhanh nhất).")
+
+    def handle(self, *args, **options):
+        results = []
+        self.stdout.write(f"    {'Số Điều':>10} {'Dòng':>10} {'Điều khoản':>11} {'Thời gian':>10} {'µs/Điều':>9}")
+        for articles in sorted(options['sizes']):
+            with tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix='.txt', delete=False) as f:
+                write_synthetic_law(f, articles)
+                path = f.name
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    lines = sum(1 for _ in f)
+                best, count = math.inf, 0
+                for _ in range(max(1, options['repeat'])):
+                    started = time.perf_counter()
+                    count = sum(1 for _ in parse_law_file(path))
+                    best = min(best, time.perf_counter() - started)
+            finally:
+                os.unlink(path)
+            results.append((articles, best))
+            self.stdout.write(
+                f"    {articles:>10} {lines:>10} {count:>11} {best:>9.3f}s {best / articles * 1e6:>9.1f}"
+            )
+
+        # Hệ số góc log-log giữa kích thước nhỏ nhất và lớn nhất: ~1.0 nghĩa là tuyến tính.
+        if len(results) >= 2 and results[0][1] > 0:
+            (n0, t0), (n1, t1) = results[0], results[-1]
+            slope = math.log(t1 / t0) / math.log(n1 / n0)
+            style = self.style.SUCCESS if slope < 1.3 else self.style.WARNING
+            self.stdout.write(style(f"Hệ số tăng trưởng (log-log): {slope:.2f} (1.0 = tuyến tính)"))
@@ -0,0 +1,282 @@
+# src/chatbot/management/commands/benchmark_rag.py
+
+import io
+import json
+import os
+import platform
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from unittest import mock
+from asgiref.sync import async_to_sync
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from chatbot import views
+from chatbot.batching import EMBEDDING_BATCH_ENABLED, EmbeddingBatcher
+from chatbot.cache import RAGCache
+from chatbot.context import CONTEXT_TOKEN_BUDGET
+from chatbot.embedding import EMBEDDING_BACKEND, load_embedding_model
+from chatbot.evaluation import (
+    HashingEncoder, compare_reports, latency_summary, load_golden_set, parse_server_timing, peak_rss_mb,
+    retrieval_metrics,
+)
+from chatbot.hierarchy import CONTEXT_EXPANSION, ArticleIndex
+from chatbot.indexing import PAYLOAD_MODES, embedding_text, provision_payload, provision_rows
+from chatbot.lexical import HYBRID_SEARCH_ENABLED, LexicalIndex
+from chatbot.llm import LLMGateway
+from chatbot.models import LawDocument, LawProvision
+from chatbot.providers import LLMRouter, StubProvider
+from chatbot.semantic_cache import SemanticAnswerCache
+from chatbot.services import services
+from chatbot.vectorstore import LOCAL_INDEX_DTYPE, LocalVectorStore, VectorPoint
+
+BENCHMARK_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'benchmark_data')
+GOLDEN_SET = os.path.join(BENCHMARK_DATA_DIR, 'golden.json')
+ENCODE_BATCH_SIZE = 32
+
+
+async def retrieve(question, limit):
+    """Đúng đường truy xuất của view: tra cứu trực tiếp, nếu không thì hybrid/vector qua rag_cache."""
+    return await views.alookup_reference(question) or await views.asearch_provisions(question, limit)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark offline toàn bộ pipeline RAG: nạp corpus mẫu vào một cơ sở dữ liệu test riêng, dựng chỉ mục "
+        "vector cục bộ, chấm recall@k/MRR trên golden set, rồi đo độ trễ từng bước và thông lượng qua view "
+        "/api/chatbot/ask/ với LLM giả lập ở nhiều mức đồng thời."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corpus', nargs='+', help=f"File .txt, thư mục hoặc glob. Mặc định: {BENCHMARK_DATA_DIR}")
+        parser.add_argument('--manifest', help="Manifest của corpus (mặc định: manifest.json trong thư mục corpus, nếu có).")
+        parser.add_argument('--golden', default=GOLDEN_SET, help="Golden set JSON: câu hỏi và các Điều đúng.")
+        parser.add_argument(
+            '--encoder', choices=('hashing', 'model'), default='hashing',
+            help="'hashing': encoder băm không cần mô hình; 'model': mô hình thật theo EMBEDDING_BACKEND (cần có sẵn trên máy)."
+        )
+        parser.add_argument('--payload-mode', choices=PAYLOAD_MODES, default='minimal')
+        parser.add_argument('--k', type=int, nargs='+', default=[1, 3, 5, 10], help="Các giá trị k cho recall@k.")
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+        parser.add_argument('--requests', type=int, default=200, help="Số request đo ở mỗi mức đồng thời.")
+        parser.add_argument('--llm-latency-ms', type=float, default=50, help="Độ trễ của LLM giả lập.")
+        parser.add_argument(
+            '--warm-cache', action='store_true',
+            help="Lặp lại nguyên câu hỏi và bật cache ngữ nghĩa (đo nhánh cache). Mặc định mỗi request là một câu hỏi mới."
+        )
+        parser.add_argument('--keep-db', action='store_true', help="Giữ lại cơ sở dữ liệu test giữa các lần chạy.")
+        parser.add_argument('--json', help="Ghi báo cáo ra file JSON.")
+        parser.add_argument('--baseline', help="Báo cáo JSON của lần chạy trước; lỗi nếu có chỉ số hồi quy.")
+        parser.add_argument('--quality-tolerance', type=float, default=0.02, help="Mức giảm recall@k/MRR tối đa (tuyệt đối).")
+        parser.add_argument('--latency-tolerance', type=float, default=0.2, help="Mức tăng p95/RSS, giảm req/s tối đa (tương đối).")
+
+    def handle(self, *args, **options):
+        golden = load_golden_set(options['golden'])
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline'], 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+
+        # -- isolated database: the configured one is never touched --
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keep_db'])
+        try:
+            with tempfile.TemporaryDirectory(prefix='benchmark-index-') as index_dir:
+                report = self.run_benchmark(golden, index_dir, options)
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keep_db'])
+            teardown_test_environment()
+
+        self.print_report(report)
+        if options['json']:
+            with open(options['json'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write(f"Đã ghi báo cáo vào {options['json']}.")
+        if baseline is not None:
+            regressions = compare_reports(report, baseline, options['quality_tolerance'], options['latency_tolerance'])
+            if regressions:
+                raise CommandError("Hồi quy so với baseline:\n    " + "\n    ".join(regressions))
+            self.stdout.write(self.style.SUCCESS("Không có chỉ số nào hồi quy so với baseline."))
+
+    def run_benchmark(self, golden, index_dir, options):
+        report = {"meta": self.describe(options), "corpus": {}}
+
+        # -- corpus: parsed and stored by ingest_law_data, exactly as in production --
+        started = time.perf_counter()
+        self.ingest(options)
+        report["corpus"].update(
+            documents=LawDocument.objects.count(),
+            provisions=LawProvision.objects.count(),
+            ingest_s=time.perf_counter() - started,
+        )
+
+        # -- local vector index in a temporary directory --
+        started = time.perf_counter()
+        encoder = HashingEncoder() if options['encoder'] == 'hashing' else load_embedding_model()
+        report["corpus"]["encoder_load_s"] = time.perf_counter() - started
+        started = time.perf_counter()
+        store = self.build_index(encoder, index_dir, options['payload_mode'])
+        report["corpus"]["index_s"] = time.perf_counter() - started
+        report["corpus"]["peak_rss_mb"] = peak_rss_mb()
+        self.stdout.write(
+            f"Corpus: {report['corpus']['provisions']} điều khoản, nạp {report['corpus']['ingest_s']:.2f}s, "
+            f"dựng chỉ mục {report['corpus']['index_s']:.2f}s."
+        )
+
+        components = {
+            "vector_store": store,
+            "embedding_model": encoder,
+            "embedding_batcher": EmbeddingBatcher(encoder) if EMBEDDING_BATCH_ENABLED else None,
+            "lexical_index": LexicalIndex() if HYBRID_SEARCH_ENABLED else None,
+            "article_index": ArticleIndex() if CONTEXT_EXPANSION != "none" else None,
+            # Cross-encoder cần tải mô hình: không dùng trong benchmark offline.
+            "reranker": None,
+            "llm": LLMRouter({"pro": LLMGateway(StubProvider(latency_ms=options['llm_latency_ms'], jitter_ms=0, failure_rate=0))}),
+        }
+        answer_cache = SemanticAnswerCache() if options['warm_cache'] else None
+        with services.override(**components), \
+                mock.patch.object(views, 'rag_cache', RAGCache(backend='local')), \
+                mock.patch.object(views, 'answer_cache', answer_cache):
+            report["retrieval"] = self.evaluate(golden, options['k'])
+            report["load"] = [
+                self.measure(golden, concurrency, options['requests'], options['warm_cache'])
+                for concurrency in options['concurrency']
+            ]
+        report["memory"] = {"peak_rss_mb": peak_rss_mb()}
+        return report
+
+    def describe(self, options):
+        return {
+            "started_at": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "encoder": options['encoder'] if options['encoder'] == 'hashing' else f"model:{EMBEDDING_BACKEND}",
+            "payload_mode": options['payload_mode'],
+            "llm_latency_ms": options['llm_latency_ms'],
+            "warm_cache": options['warm_cache'],
+            "golden": os.path.basename(options['golden']),
+            "search_limit": views.SEARCH_LIMIT,
+            "hybrid_search": HYBRID_SEARCH_ENABLED,
+            "context_expansion": CONTEXT_EXPANSION,
+            "context_token_budget": CONTEXT_TOKEN_BUDGET,
+            "embedding_batching": EMBEDDING_BATCH_ENABLED,
+            "local_index_dtype": LOCAL_INDEX_DTYPE,
+        }
+
+    def ingest(self, options):
+        paths = options['corpus'] or [BENCHMARK_DATA_DIR]
+        manifest = options['manifest']
+        if manifest is None and len(paths) == 1 and os.path.isfile(os.path.join(paths[0], 'manifest.json')):
+            manifest = os.path.join(paths[0], 'manifest.json')
+        output = io.StringIO()
+        call_command('ingest_law_data', *paths, manifest=manifest, workers=1, stdout=output)
+        if not LawProvision.objects.exists():
+            self.stdout.write(output.getvalue())
+            raise CommandError("Corpus không có điều khoản nào sau khi nạp.")
+
+    def build_index(self, encoder, index_dir, payload_mode):
+        rows = list(provision_rows(LawProvision.objects.order_by()))
+        vectors = encoder.encode([embedding_text(row) for row in rows], batch_size=ENCODE_BATCH_SIZE)
+        store = LocalVectorStore(directory=index_dir)
+        store.ensure_collection(encoder.get_sentence_embedding_dimension())
+        store.upsert(VectorPoint(str(row.id), vector, provision_payload(row, payload_mode)) for row, vector in zip(rows, vectors))
+        store.commit()
+        return store
+
+    def evaluate(self, golden, ks):
+        """Truy xuất như view (tra cứu trực tiếp, nếu không thì hybrid/vector) rồi chấm theo Điều."""
+        articles = {
+            str(pk): (source_file, article)
+            for pk, source_file, article in LawProvision.objects.values_list('id', 'document__source_file', 'article_number')
+        }
+        ranked = []
+        for item in golden:
+            hits = async_to_sync(retrieve)(item.question, max(ks))
+            ranked.append((item, [articles[hit.id] for hit in hits if hit.id in articles]))
+        return retrieval_metrics(ranked, ks)
+
+    def measure(self, golden, concurrency, total, warm_cache):
+        url = reverse('chatbot_ask')
+        lock = threading.Lock()
+        results = []
+
+        def ask(i):
+            question = golden[i % len(golden)].question
+            if not warm_cache:
+                question = f"{question} ({concurrency}-{i})"  # mỗi request là một câu hỏi chưa có trong cache
+            started = time.perf_counter()
+            response = Client().post(url, data=json.dumps({"question": question}), content_type='application/json')
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with lock:
+                results.append((response.status_code, elapsed_ms, parse_server_timing(response.get('Server-Timing'))))
+
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='benchmark-client') as pool:
+            list(pool.map(ask, range(-concurrency, 0)))  # làm nóng: chỉ mục BM25/Điều, luồng batcher
+            results.clear()
+            started = time.perf_counter()
+            list(pool.map(ask, range(total)))
+            elapsed = time.perf_counter() - started
+            # Mỗi luồng client giữ một kết nối DB riêng: đóng tất cả trước khi xoá cơ sở dữ liệu test.
+            barrier = threading.Barrier(concurrency)
+
+            def close_connections(_):
+                barrier.wait()  # mỗi luồng nhận đúng một tác vụ
+                connections.close_all()
+
+            list(pool.map(close_connections, range(concurrency)))
+
+        ok = [(latency, stages) for status, latency, stages in results if status == 200]
+        stage_names = dict.fromkeys(name for _, stages in ok for name in stages if name != 'total')
+        row = {
+            "concurrency": concurrency,
+            "requests": total,
+            "errors": len(results) - len(ok),
+            "rps": len(ok) / elapsed if elapsed else 0.0,
+            "latency_ms": latency_summary([latency for latency, _ in ok]),
+            "stages_ms": {
+                name: latency_summary([stages[name] for _, stages in ok if name in stages]) for name in stage_names
+            },
+            "peak_rss_mb": peak_rss_mb(),
+        }
+        self.stdout.write(
+            f"Đồng thời {concurrency}: {row['rps']:.1f} req/giây, p95 {row['latency_ms'].get('p95', 0):.1f}ms, "
+            f"{row['errors']} lỗi."
+        )
+        return row
+
+    def print_report(self, report):
+        retrieval = report["retrieval"]
+        recalls = [key for key in retrieval if key.startswith("recall@")]
+        self.stdout.write(f"\n📊 Truy xuất ({retrieval['questions']} câu hỏi):")
+        self.stdout.write("    " + "  ".join(f"{key} {retrieval[key]:.3f}" for key in recalls) + f"  MRR {retrieval['mrr']:.3f}")
+        missed = [d for d in retrieval["details"] if d["first_relevant_rank"] is None]
+        for detail in missed:
+            self.stdout.write(self.style.WARNING(
+                f"    ✗ {detail['question']} (mong đợi Điều {detail['expected']}, nhận {detail['retrieved'][:5]})"
+            ))
+
+        self.stdout.write("\n⏱️  Độ trễ đầu-cuối và thông lượng:")
+        self.stdout.write(f"    {'Đồng thời':>9} {'Req/giây':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'Lỗi':>5}")
+        for level in report["load"]:
+            latency = level["latency_ms"]
+            self.stdout.write(
+                f"    {level['concurrency']:>9} {level['rps']:>9.1f} {latency.get('p50', 0):>7.1f}ms "
+                f"{latency.get('p95', 0):>7.1f}ms {latency.get('p99', 0):>7.1f}ms {level['errors']:>5}"
+            )
+
+        for level in report["load"]:
+            self.stdout.write(f"\n    Từng bước (đồng thời {level['concurrency']}):")
+            self.stdout.write(f"    {'Bước':<14} {'Số lần':>7} {'p50':>9} {'p95':>9} {'p99':>9}")
+            for name, stats in level["stages_ms"].items():
+                self.stdout.write(
+                    f"    {name:<14} {stats['count']:>7} {stats['p50']:>7.2f}ms {stats['p95']:>7.2f}ms {stats['p99']:>7.2f}ms"
+                )
+        self.stdout.write(f"\n💾 RSS đỉnh: {report['memory']['peak_rss_mb']:.0f}MB")
@@ -0,0 +1,167 @@
+# src/chatbot/management/commands/benchmark_server.py
+
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+BENCH_QUESTIONS = [
+    "Vốn điều lệ là gì?",
+    "Điều kiện thành lập công ty trách nhiệm hữu hạn hai thành viên trở lên",
+    "Thủ tục giải thể doanh nghiệp",
+    "Cổ đông sáng lập có quyền chuyển nhượng cổ phần không?",
+]
+
+def memory_kb(pid):
+    """Rss/Pss/Private (kB) của một process, đọc từ /proc/<pid>/smaps_rollup (Linux)."""
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return {
+        "rss_mb": fields.get('Rss', 0) / 1024,
+        "pss_mb": fields.get('Pss', 0) / 1024,
+        "private_mb": (fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)) / 1024,
+    }
+
+def child_pids(parent):
+    pids = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # Trường thứ 4 (ppid) nằm sau tên process trong ngoặc, tên có thể chứa dấu cách.
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == parent:
+            pids.append(int(entry))
+    return pids
+
+class Command(BaseCommand):
+    help = "Chạy gunicorn (config/gunicorn.conf.py) với số worker tăng dần; đo RSS/PSS mỗi worker và thông lượng."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', nargs='+', type=int, default=[1, 2, 4])
+        parser.add_argument('--no-preload', action='store_true', help="Tắt preload_app để so sánh bộ nhớ.")
+        parser.add_argument('--no-gc-freeze', action='store_true', help="Preload nhưng không gọi gc.freeze() trong master.")
+        parser.add_argument('--app', default='config.asgi:application')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--path', default='/api/chatbot/ask/')
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--ready-timeout', type=float, default=300, help="Số giây chờ /readyz trả 200.")
+        parser.add_argument('--json', help="Ghi kết quả ra file JSON.")
+
+    def handle(self, *args, **options):
+        rows = [self.run_server(workers, options) for workers in options['workers']]
+
+        self.stdout.write(
+            f"\n    {'Worker':>6} {'Master RSS':>11} {'RSS/worker':>11} {'PSS/worker':>11} {'Riêng/worker':>13} "
+            f"{'Tổng PSS':>9} {'Req/giây':>9} {'p50':>9} {'p95':>9} {'Lỗi':>5}"
+        )
+        for row in rows:
+            line = (
+                f"    {row['workers']:>6} {row['master_rss_mb']:>9.0f}MB {row['worker_rss_mb']:>9.0f}MB "
+                f"{row['worker_pss_mb']:>9.0f}MB {row['worker_private_mb']:>11.0f}MB {row['total_pss_mb']:>7.0f}MB"
+            )
+            if 'rps' in row:
+                line += f" {row['rps']:>9.1f} {row['p50_ms']:>7.0f}ms {row['p95_ms']:>7.0f}ms {row['errors']:>5}"
+            self.stdout.write(line)
+            if 'error' in row:
+                self.stdout.write(self.style.WARNING(f"           {row['error']}"))
+        if options['json']:
+            with open(options['json'], 'w', encoding='utf-8') as f:
+                json.dump(rows, f, ensure_ascii=False, indent=2)
+
+    def run_server(self, workers, options):
+        base_url = f"http://127.0.0.1:{options['port']}"
+        env = dict(
+            os.environ, GUNICORN_WORKERS=str(workers), GUNICORN_BIND=f"127.0.0.1:{options['port']}",
+            GUNICORN_PRELOAD='0' if options['no_preload'] else '1',
+            GUNICORN_GC_FREEZE='0' if options['no_gc_freeze'] else '1', GUNICORN_ACCESSLOG='/dev/null',
+        )
+        self.stdout.write(f"Khởi động gunicorn với {workers} worker...")
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', options['app'], '-c', 'config/gunicorn.conf.py'],
+            cwd=settings.BASE_DIR, env=env,
+        )
+        row = {
+            "workers": workers,
+            "preload": not options['no_preload'],
+            "gc_freeze": not options['no_preload'] and not options['no_gc_freeze'],
+        }
+        try:
+            started = time.perf_counter()
+            ready = self.wait_ready(base_url, workers, options['ready_timeout'])
+            row["ready_s"] = time.perf_counter() - started
+
+            pids = child_pids(process.pid)
+            usage = [memory_kb(pid) for pid in pids]
+            row.update(
+                master_rss_mb=memory_kb(process.pid)["rss_mb"],
+                worker_rss_mb=float(np.mean([u["rss_mb"] for u in usage])) if usage else 0.0,
+                worker_pss_mb=float(np.mean([u["pss_mb"] for u in usage])) if usage else 0.0,
+                worker_private_mb=float(np.mean([u["private_mb"] for u in usage])) if usage else 0.0,
+                # Tổng PSS của master và các worker: bộ nhớ thật mà cả nhóm process chiếm.
+                total_pss_mb=memory_kb(process.pid)["pss_mb"] + sum(u["pss_mb"] for u in usage),
+            )
+            if not ready:
+                row["error"] = f"/readyz chưa trả 200 sau {options['ready_timeout']:.0f}s, bỏ qua đo thông lượng."
+                return row
+            row.update(self.measure_throughput(base_url + options['path'], options['requests'], options['concurrency']))
+            # Đo lại sau tải: trang copy-on-write bị ghi trong lúc phục vụ sẽ thành bộ nhớ riêng.
+            usage = [memory_kb(pid) for pid in child_pids(process.pid)]
+            row["worker_private_after_load_mb"] = float(np.mean([u["private_mb"] for u in usage])) if usage else 0.0
+            return row
+        finally:
+            process.send_signal(signal.SIGTERM)
+            process.wait()
+
+    def wait_ready(self, base_url, workers, timeout):
+        # Mỗi request /readyz rơi vào một worker bất kỳ: đòi nhiều lần 200 liên tiếp.
+        deadline, streak = time.monotonic() + timeout, 0
+        while time.monotonic() < deadline:
+            try:
+                ok = requests.get(f"{base_url}/readyz", timeout=5).status_code == 200
+            except requests.RequestException:
+                ok = False
+            streak = streak + 1 if ok else 0
+            if streak >= 3 * workers:
+                return True
+            time.sleep(0.05 if ok else 0.5)
+        return False
+
+    def measure_throughput(self, url, total, concurrency):
+        def ask(i):
+            question = f"{BENCH_QUESTIONS[i % len(BENCH_QUESTIONS)]} ({i})"
+            started = time.perf_counter()
+            try:
+                ok = requests.post(url, json={"question": question}, timeout=120).status_code == 200
+            except requests.RequestException:
+                ok = False
+            return ok, time.perf_counter() - started
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(ask, range(-concurrency, 0)))  # làm nóng kết nối và cache của từng worker
+            started = time.perf_counter()
+            results = list(pool.map(ask, range(total)))
+            elapsed = time.perf_counter() - started
+        latencies = [latency for ok, latency in results if ok]
+        return {
+            "requests": total,
+            "errors": sum(1 for ok, _ in results if not ok),
+            "rps": len(latencies) / elapsed,
+            "p50_ms": float(np.percentile(latencies, 50) * 1000) if latencies else 0.0,
+            "p95_ms": float(np.percentile(latencies, 95) * 1000) if latencies else 0.0,
+        }
@@ -1,19 +1,51 @@
 import os
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from django.core.management.base import BaseCommand
 from chatbot.models import LawProvision
 from chatbot.embedding import get_embedding_model
-from qdrant_client import QdrantClient, models
+from chatbot.cache import invalidate_rag_cache
+from chatbot.indexing import (
+    INDEX_STATE_FIELDS, PAYLOAD_MODES, content_hash, embedding_text, index_state, payload_is_current,
+    provision_index_state, provision_payload, provision_rows,
+)
+from chatbot.vectorstore import VECTOR_BACKEND, VECTOR_BACKENDS, VectorPoint, make_vector_store
 
 # --- Configs ---
-QDRANT_HOST = os.getenv("QDRANT_HOST", "qdrant")
-QDRANT_PORT = int(os.getenv("QDRANT_PORT", 6333))
-QDRANT_COLLECTION = os.getenv("QDRANT_COLLECTION", "luat_doanh_nghiep_v1")
+QDRANT_PAYLOAD_MODE = os.getenv("QDRANT_PAYLOAD_MODE", "minimal")
+ENCODE_BATCH_SIZE = 32
 
 class Command(BaseCommand):
-    help = "Tạo vector embeddings từ LawProvision và nạp vào Qdrant."
+    help = "Tạo vector embeddings từ LawProvision và nạp vào backend vector (Qdrant hoặc chỉ mục cục bộ)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--backend', choices=VECTOR_BACKENDS, default=VECTOR_BACKEND,
+            help="Backend vector cần ghi (mặc định theo VECTOR_BACKEND)."
+        )
+        parser.add_argument(
+            '--payload-mode', choices=PAYLOAD_MODES, default=QDRANT_PAYLOAD_MODE,
+            help="'full' ghi kèm nội dung điều khoản vào payload để view không cần truy vấn PostgreSQL."
+        )
+        parser.add_argument(
+            '--full', action='store_true',
+            help="Encode lại toàn bộ điều khoản thay vì chỉ những điều khoản mới hoặc đã thay đổi."
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=256,
+            help="Số điều khoản mỗi lô của pipeline; lô kế tiếp được encode trong khi lô này tải lên backend vector."
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help="Số dòng đọc từ PostgreSQL mỗi lần (QuerySet.iterator)."
+        )
 
     def handle(self, *args, **options):
-        self.stdout.write(self.style.SUCCESS("Bắt đầu quá trình tạo vector và nạp vào Qdrant..."))
+        payload_mode = options['payload_mode']
+        self.stdout.write(self.style.SUCCESS(f"Bắt đầu quá trình tạo vector và nạp vào backend '{options['backend']}'..."))
+        self.stdout.write(f"Chế độ payload: {payload_mode}")
 
         # -- embedding model loading --
         try:
@@ -25,85 +57,139 @@ class Command(BaseCommand):
 
             return
 
-        # -- connect to qdrant --
+        # -- connect to the vector backend and ensure the collection exists --
+        try:
+            store = make_vector_store(options['backend'])
+            store.ping()
+            self.stdout.write(f"Kết nối thành công tới backend vector '{store.name}'.")
+            if store.ensure_collection(vector_size):
+                self.stdout.write("Đã tạo collection/chỉ mục mới.")
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f"Lỗi khi kết nối/đảm bảo collection của backend vector: {e}"))
+            return
+
+        # -- current index state: point id -> (content hash, payload hash) already stored in the vector backend --
+        timings = defaultdict(float)
+        started = time.perf_counter()
         try:
-            qdrant_client = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
-            qdrant_client.get_collections()
-            self.stdout.write(f"Kết nối thành công tới Qdrant tại {QDRANT_HOST}:{QDRANT_PORT}")
+            with self.stage(timings, "scan"):
+                point_ids, indexed = self.fetch_index_state(store, payload_mode)
         except Exception as e:
-            self.stdout.write(self.style.ERROR(f"Lỗi khi tạo/tái tạo collection Qdrant: {e}"))
+            self.stdout.write(self.style.ERROR(f"Lỗi khi đọc trạng thái chỉ mục vector: {e}"))
             return
-        
-        # --- ensuring collection exists ---
+        if options['full']:
+            indexed = {}
+        self.stdout.write(f"Backend vector đang có {len(point_ids)} điểm, {len(indexed)} điểm còn dùng được.")
+
+        # -- streaming pipeline: read -> hash -> encode batch N+1 while batch N uploads --
+        batch_size = options['batch_size']
+        current_ids = set()
+        seen = encoded = 0
+        pending_upload = None
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vector-upload")
         try:
-            collection_exists = False
-            try:
-                qdrant_client.get_collection(collection_name=QDRANT_COLLECTION)
-                collection_exists = True
-                self.stdout.write(f"Collection '{QDRANT_COLLECTION}' đã tồn tại.")
-            except Exception as e:
-                 if "not found" in str(e).lower() or "doesn't exist" in str(e).lower() or "status_code=404" in str(e).lower():
-                    self.stdout.write(f"Collection '{QDRANT_COLLECTION}' chưa tồn tại.")
-                    collection_exists = False
-                 else:
-                    self.stdout.write(self.style.ERROR(f"Lỗi không mong đợi khi kiểm tra collection: {e}"))
-                    return
-
-            if not collection_exists:
-                self.stdout.write(f"Đang tạo collection '{QDRANT_COLLECTION}'...")
-                qdrant_client.create_collection(
-                    collection_name=QDRANT_COLLECTION,
-                    vectors_config=models.VectorParams(size=vector_size, distance=models.Distance.COSINE), # <-- Sử dụng vector_size đã định nghĩa
-                )
-                self.stdout.write(f"Đã tạo collection '{QDRANT_COLLECTION}' thành công.")
+            batch = []
+            rows = provision_rows(LawProvision.objects.order_by(), chunk_size=options['chunk_size'])
+            while True:
+                with self.stage(timings, "read"):
+                    row = next(rows, None)
+                if row is not None:
+                    seen += 1
+                    current_ids.add(str(row.id))
+                    with self.stage(timings, "hash"):
+                        text = embedding_text(row)
+                        text_hash = content_hash(text)
+                        state = provision_index_state(row, payload_mode, text_hash)
+                    # Chỉ payload đổi (tiêu đề văn bản, Chương, Mục) cũng ghi lại điểm, kèm vector encode lại.
+                    if indexed.get(str(row.id)) != state:
+                        batch.append((row, text, text_hash))
+                    if len(batch) < batch_size:
+                        continue
+                if not batch:
+                    break
 
+                with self.stage(timings, "encode"):
+                    vectors = model.encode([text for _, text, _ in batch], batch_size=ENCODE_BATCH_SIZE)
+                    points = [
+                        VectorPoint(str(r.id), vector, provision_payload(r, payload_mode, text_hash))
+                        for (r, _, text_hash), vector in zip(batch, vectors)
+                    ]
+                encoded += self.finish_upload(pending_upload, timings)
+                pending_upload = (executor.submit(self.upload, store, points), batch)
+                batch = []
+                self.stdout.write(f"    -> Đã đọc {seen} điều khoản, đã encode {encoded + len(points)}.")
+                if row is None:
+                    break
+            encoded += self.finish_upload(pending_upload, timings)
         except Exception as e:
-            self.stdout.write(self.style.ERROR(f"Lỗi trong quá trình đảm bảo collection tồn tại: {e}"))
+            self.stdout.write(self.style.ERROR(f"Lỗi trong quá trình tạo embedding/tải lên backend vector: {e}"))
             return
+        finally:
+            executor.shutdown(wait=True)
 
-        # -- get all provisions from PostgreSQL --
-        all_provisions = list(LawProvision.objects.all())
-        if not all_provisions:
+        if not seen:
             self.stdout.write(self.style.WARNING("Không tìm thấy điều khoản nào trong PostgreSQL để tạo embedding."))
-            return
-        
-        # -- create embedding for content --
-        self.stdout.write(f"Đang tạo embeddings cho {len(all_provisions)} điều khoản (có thể mất vài phút)...")
+
+        # -- remove points whose provision no longer exists --
+        stale_ids = [point_id for point_id in point_ids if point_id not in current_ids]
         try:
-            contents_to_embed = [
-                f"Điều {p.article_number} {p.article_title or ''}, Khoản {p.provision_id or 'chung'}: {p.content}"
-                for p in all_provisions
-            ]
-            vectors = model.encode(contents_to_embed, show_progress_bar=True, batch_size=32)
+            with self.stage(timings, "delete"):
+                if stale_ids:
+                    store.delete(stale_ids)
+            if stale_ids:
+                self.stdout.write(f"    -> Đã xoá {len(stale_ids)} điểm không còn trong PostgreSQL.")
+            with self.stage(timings, "commit"):
+                store.commit()
         except Exception as e:
-            self.stdout.write(self.style.ERROR(f"Lỗi trong quá trình tạo embedding: {e}"))
+            self.stdout.write(self.style.ERROR(f"Lỗi khi xoá điểm cũ/ghi chỉ mục vector: {e}"))
             return
 
-        # -- preparing and loading data to qdrant
-        self.stdout.write("Chuẩn bị tải dữ liệu vector lên Qdrant...")
-        points_to_upload = []
-        for i, p in enumerate(all_provisions):
-            points_to_upload.append(
-                models.PointStruct(
-                    id=str(p.id),
-                    vector=vectors[i].tolist(),
-                    payload={"postgres_id": str(p.id)}
-                )
-            )
+        # -- cached embeddings/hits may point at the previous collection state --
+        if encoded or stale_ids:
+            invalidate_rag_cache()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Hoàn thành! Đã nạp {encoded} vector, giữ nguyên {seen - encoded}, xoá {len(stale_ids)} điểm "
+            f"trong {elapsed:.2f}s ({seen / elapsed if elapsed else 0:.1f} điều khoản/giây, "
+            f"{encoded / timings['encode'] if timings['encode'] else 0:.1f} vector/giây khi encode)."
+        ))
+        self.stdout.write("Thời gian theo giai đoạn (upload chạy song song với encode):")
+        for name in ("scan", "read", "hash", "encode", "upload_wait", "upload", "db_update", "delete", "commit"):
+            self.stdout.write(f"    {name:<12} {timings[name]:8.2f}s")
 
+    @contextmanager
+    def stage(self, timings, name):
+        started = time.perf_counter()
         try:
-            batch_size = 100
-            for i in range(0, len(points_to_upload), batch_size):
-                batch = points_to_upload[i: i+batch_size]
-                qdrant_client.upsert(
-                    collection_name=QDRANT_COLLECTION,
-                    points=batch,
-                    wait=True
-                )
-                self.stdout.write(f"    -> Đã tải lên {min(i + batch_size, len(points_to_upload))}/{len(points_to_upload)} điểm.")
+            yield
+        finally:
+            timings[name] += time.perf_counter() - started
 
-        except Exception as e:
-            self.stdout.write(self.style.ERROR(f"Lỗi khi tải dữ liệu lên Qdrant: {e}"))
-            return
-        
-        self.stdout.write(self.style.SUCCESS(f"Hoàn thành! Đã nạp thành công {len(all_provisions)} vector vào Qdrant."))
\ No newline at end of file
+    def upload(self, store, points):
+        started = time.perf_counter()
+        store.upsert(points)
+        return time.perf_counter() - started
+
+    def finish_upload(self, pending_upload, timings):
+        """Chờ lô đang tải lên xong rồi ghi embedding_hash của lô đó vào PostgreSQL."""
+        if pending_upload is None:
+            return 0
+        future, batch = pending_upload
+        with self.stage(timings, "upload_wait"):
+            timings["upload"] += future.result()
+        with self.stage(timings, "db_update"):
+            LawProvision.objects.bulk_update(
+                [LawProvision(id=row.id, embedding_hash=text_hash) for row, _, text_hash in batch],
+                ['embedding_hash'], batch_size=500
+            )
+        return len(batch)
+
+    def fetch_index_state(self, store, payload_mode):
+        """Trả về (mọi point id, {point id: index_state} của các điểm có payload đúng chế độ hiện tại)."""
+        point_ids, indexed = [], {}
+        for point_id, payload in store.scroll(INDEX_STATE_FIELDS):
+            point_ids.append(point_id)
+            if payload.get("content_hash") and payload_is_current(payload, payload_mode):
+                indexed[point_id] = index_state(payload, payload_mode)
+        return point_ids, indexed
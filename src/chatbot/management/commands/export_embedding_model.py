@@ -0,0 +1,134 @@
+# src/chatbot/management/commands/export_embedding_model.py
+
+import json
+import os
+import time
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from chatbot.embedding import (
+    ARTIFACT_CONFIG_FILE, EMBEDDING_ARTIFACT_DIR, EMBEDDING_MODEL_NAME, ONNX_FILE, ONNX_INT8_FILE, TORCHSCRIPT_FILE,
+    load_embedding_model, load_sentence_transformer, pooling_config,
+)
+from chatbot.indexing import embedding_text
+from chatbot.models import LawProvision
+
+# Câu mẫu dùng để kiểm tra khi PostgreSQL chưa có điều khoản nào.
+VALIDATION_SENTENCES = [
+    "Vốn điều lệ là gì?",
+    "Điều kiện thành lập công ty trách nhiệm hữu hạn hai thành viên trở lên",
+    "Cổ đông sáng lập phải cùng nhau đăng ký mua ít nhất 20% tổng số cổ phần phổ thông.",
+    "Doanh nghiệp tư nhân không được quyền phát hành bất kỳ loại chứng khoán nào.",
+    "Thủ tục giải thể doanh nghiệp",
+    "Người đại diện theo pháp luật của doanh nghiệp là cá nhân đại diện cho doanh nghiệp thực hiện các quyền và nghĩa vụ phát sinh từ giao dịch của doanh nghiệp.",
+    "Hồ sơ đăng ký doanh nghiệp gồm những gì?",
+    "Hội đồng quản trị là cơ quan quản lý công ty.",
+]
+
+class Command(BaseCommand):
+    help = "Export mô hình embedding sang ONNX/TorchScript (int8) và kiểm tra độ khớp với mô hình gốc."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=['onnx', 'torchscript', 'all'], default='onnx')
+        parser.add_argument('--model', default=EMBEDDING_MODEL_NAME, help="Mô hình SentenceTransformer gốc.")
+        parser.add_argument('--output', default=EMBEDDING_ARTIFACT_DIR, help="Thư mục artifact (EMBEDDING_ARTIFACT_DIR).")
+        parser.add_argument('--no-quantize', action='store_true', help="Giữ trọng số float32 thay vì int8.")
+        parser.add_argument(
+            '--threshold', type=float, default=0.98,
+            help="Cosine tối thiểu giữa vector của mô hình export và mô hình gốc trên mọi câu mẫu."
+        )
+        parser.add_argument('--samples', type=int, default=128, help="Số điều khoản lấy từ PostgreSQL để kiểm tra.")
+        parser.add_argument('--opset', type=int, default=17)
+
+    def handle(self, *args, **options):
+        import torch
+
+        output, quantize = options['output'], not options['no_quantize']
+        formats = ['onnx', 'torchscript'] if options['format'] == 'all' else [options['format']]
+        os.makedirs(output, exist_ok=True)
+
+        # -- reference model (float32, never quantized) --
+        reference = load_sentence_transformer(options['model'], quantize=False)
+        config = dict(pooling_config(reference), source_model=options['model'], quantized=quantize)
+        reference.tokenizer.save_pretrained(output)
+        with open(os.path.join(output, ARTIFACT_CONFIG_FILE), 'w', encoding='utf-8') as f:
+            json.dump(config, f, ensure_ascii=False, indent=2)
+        self.stdout.write(f"Cấu hình: {config}")
+
+        transformer = reference[0].auto_model.eval()
+        sample = reference.tokenizer(["Vốn điều lệ là gì?", "Điều 1"], padding=True, return_tensors="pt")
+        example = (sample["input_ids"], sample["attention_mask"])
+
+        class LastHiddenState(torch.nn.Module):
+            def __init__(self, model):
+                super().__init__()
+                self.model = model
+
+            def forward(self, input_ids, attention_mask):
+                return self.model(input_ids=input_ids, attention_mask=attention_mask, return_dict=False)[0]
+
+        for fmt in formats:
+            started = time.perf_counter()
+            if fmt == 'onnx':
+                self.export_onnx(LastHiddenState(transformer), example, output, quantize, options['opset'])
+            else:
+                self.export_torchscript(LastHiddenState, transformer, example, output, quantize)
+            self.stdout.write(f"Đã export {fmt} trong {time.perf_counter() - started:.1f}s.")
+
+        # -- validation: cosine agreement with the original model --
+        texts = self.validation_texts(options['samples'])
+        expected = reference.encode(texts, batch_size=32, convert_to_numpy=True)
+        failed = []
+        for fmt in formats:
+            exported = load_embedding_model(fmt, output).encode(texts, batch_size=32)
+            cosine = np.sum(expected * exported, axis=1) / (
+                np.linalg.norm(expected, axis=1) * np.linalg.norm(exported, axis=1)
+            )
+            style = self.style.SUCCESS if cosine.min() >= options['threshold'] else self.style.ERROR
+            self.stdout.write(style(
+                f"{fmt}: cosine với mô hình gốc trên {len(texts)} câu: min {cosine.min():.4f}, "
+                f"trung bình {cosine.mean():.4f} (ngưỡng {options['threshold']})"
+            ))
+            if cosine.min() < options['threshold']:
+                failed.append(fmt)
+        if failed:
+            raise CommandError(f"Mô hình export không đạt ngưỡng cosine: {', '.join(failed)}.")
+        self.stdout.write(self.style.SUCCESS(
+            f"Hoàn thành! Đặt EMBEDDING_BACKEND={formats[0]} EMBEDDING_ARTIFACT_DIR={output} để sử dụng."
+        ))
+
+    def export_onnx(self, module, example, output, quantize, opset):
+        import torch
+
+        path = os.path.join(output, ONNX_FILE)
+        axes = {0: "batch", 1: "sequence"}
+        torch.onnx.export(
+            module, example, path,
+            input_names=["input_ids", "attention_mask"], output_names=["last_hidden_state"],
+            dynamic_axes={"input_ids": axes, "attention_mask": axes, "last_hidden_state": axes},
+            opset_version=opset, dynamo=False,
+        )
+        int8_path = os.path.join(output, ONNX_INT8_FILE)
+        if quantize:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            quantize_dynamic(path, int8_path, weight_type=QuantType.QInt8)
+        elif os.path.exists(int8_path):
+            os.remove(int8_path)  # OnnxEmbeddingModel ưu tiên file int8 nếu có
+
+    def export_torchscript(self, wrapper, transformer, example, output, quantize):
+        import copy
+        import torch
+
+        model = copy.deepcopy(transformer)
+        if quantize:
+            torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        with torch.inference_mode():
+            traced = torch.jit.trace(wrapper(model).eval(), example, strict=False)
+        traced.save(os.path.join(output, TORCHSCRIPT_FILE))
+
+    def validation_texts(self, samples):
+        try:
+            texts = [embedding_text(p) for p in LawProvision.objects.order_by('?')[:samples]]
+        except Exception as e:
+            self.stdout.write(self.style.WARNING(f"Không đọc được điều khoản từ PostgreSQL ({e}), dùng câu mẫu."))
+            texts = []
+        return texts + VALIDATION_SENTENCES
@@ -1,128 +1,238 @@
 # src/chatbot/management/commands/ingest_law_data.py
 
-import re
-from django.core.management.base import BaseCommand
-from django.db import transaction
+import glob
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from chatbot.law_parser import parse_law_file
+from chatbot.lexical import bump_lexical_generation
 from chatbot.models import LawDocument, LawProvision
+from chatbot.semantic_cache import purge_document_answers
 
 # --- Cấu hình ---
+# Văn bản mặc định khi không truyền đường dẫn nào (giữ tương thích với cách chạy cũ).
 FILE_PATH = '/app/data/67_VBHN-VPQH_671127.txt'
 DOCUMENT_TITLE = "Luật Doanh nghiệp (Văn bản hợp nhất 67/VBHN-VPQH)"
 DOCUMENT_NUMBER = "67/VBHN-VPQH"
+# Thư mục gốc để đặt khoá văn bản (LawDocument.source_file = đường dẫn tương đối so với thư mục này)
+# khi không có --root, --manifest và mọi file đều nằm trong thư mục này.
+LAW_DATA_DIR = os.getenv("LAW_DATA_DIR", os.path.dirname(FILE_PATH))
+# Các trường thông tin văn bản lấy từ manifest; đổi trường nào cũng được cập nhật dù file không đổi.
+MANIFEST_FIELDS = ['title', 'document_number', 'publication_date', 'effective_date']
 
-def clean_text(text):
-    if not text:
-        return ""
-    text = re.sub(r'\[\w+\]', '', text)
-    text = text.replace('\uffef', '').replace('\ufeff', '')
-    text = re.sub(r'\s+', ' ', text).strip()
-    return text
+# Các trường được cập nhật tại chỗ khi một (Điều, Khoản/Điểm) đã tồn tại, để giữ nguyên id
+# (và do đó các điểm trong Qdrant) của những điều khoản không đổi.
+SYNCED_FIELDS = ['chapter_info', 'section_info', 'article_title', 'content']
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def source_key(path, root):
+    """Khoá của văn bản: đường dẫn tương đối so với `root` (đường dẫn tuyệt đối nếu nằm ngoài `root`).
+
+    Hai file cùng tên ở hai thư mục khác nhau là hai văn bản khác nhau.
+    """
+    path = os.path.abspath(path)
+    relative = os.path.relpath(path, os.path.abspath(root))
+    return path if relative.startswith(os.pardir) else relative.replace(os.sep, '/')
+
+def default_root(files, manifest_path):
+    """Thư mục chứa manifest; nếu không có thì LAW_DATA_DIR, hoặc thư mục chung của các file nằm ngoài nó."""
+    if manifest_path:
+        return os.path.dirname(os.path.abspath(manifest_path))
+    folders = [os.path.dirname(os.path.abspath(path)) for path in files]
+    data_dir = os.path.abspath(LAW_DATA_DIR)
+    if all(os.path.commonpath([data_dir, folder]) == data_dir for folder in folders):
+        return data_dir
+    return os.path.commonpath(folders)
+
+def document_fields(key, meta):
+    """Các trường LawDocument lấy từ mục manifest (hoặc tên file khi không có trong manifest)."""
+    if meta is None:
+        return {'title': os.path.splitext(os.path.basename(key))[0]}
+    return {field: meta[field] for field in MANIFEST_FIELDS if field in meta}
+
+def parse_law_document(path):
+    """Bóc tách một file luật thành danh sách dict điều khoản (chạy trong process pool, không chạm DB).
+
+    Trả về (thời gian bóc tách, danh sách điều khoản, danh sách cảnh báo).
+    """
+    started = time.perf_counter()
+    seen_keys = set()
+    unique_provisions, warnings = [], []
+    for p in parse_law_file(path):
+        # Kiểm tra trùng lặp trước khi lưu
+        key = (p["article_number"], p["provision_id"])
+        if key in seen_keys:
+            warnings.append(f"Bỏ qua bản ghi trùng lặp - Điều {p['article_number']}, Khoản {p['provision_id']}")
+            continue
+        seen_keys.add(key)
+        unique_provisions.append(p)
+    return time.perf_counter() - started, unique_provisions, warnings
 
 class Command(BaseCommand):
-    help = 'Xử lý và nạp dữ liệu từ văn bản luật vào cơ sở dữ liệu (phiên bản ổn định).'
+    help = 'Xử lý và nạp dữ liệu từ các văn bản luật (file, thư mục hoặc glob) vào cơ sở dữ liệu.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='*',
+            help=f"File .txt, thư mục hoặc glob. Mặc định: {FILE_PATH}"
+        )
+        parser.add_argument(
+            '--manifest',
+            help="File JSON: danh sách {file, title, document_number, publication_date, effective_date}; "
+                 "`file` là đường dẫn tương đối so với thư mục chứa manifest."
+        )
+        parser.add_argument(
+            '--root',
+            help=f"Thư mục gốc để đặt khoá văn bản. Mặc định: thư mục chứa manifest, hoặc {LAW_DATA_DIR} "
+                 "(thư mục chung của các file nếu chúng nằm ngoài thư mục đó)."
+        )
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Số process bóc tách song song.")
+        parser.add_argument('--batch-size', type=int, default=1000, help="batch_size cho bulk_create/bulk_update.")
+        parser.add_argument('--force', action='store_true', help="Nạp lại cả những file có checksum không đổi.")
 
-    @transaction.atomic
     def handle(self, *args, **options):
         self.stdout.write(self.style.SUCCESS('🚀 Bắt đầu quá trình nạp dữ liệu luật...'))
 
-        # --- 1. Tạo hoặc lấy văn bản luật gốc ---
-        document, created = LawDocument.objects.update_or_create(
-            title=DOCUMENT_TITLE,
-            defaults={'document_number': DOCUMENT_NUMBER, 'source_file': FILE_PATH.split('/')[-1]}
-        )
-        if created:
-            self.stdout.write(f"✅ Đã tạo mới văn bản: '{document.title}'")
-        else:
-            self.stdout.write(f"🔍 Sử dụng văn bản đã có: '{document.title}'. Đang xóa các điều khoản cũ...")
-            LawProvision.objects.filter(document=document).delete()
-            self.stdout.write("🗑️  Xóa dữ liệu cũ thành công.")
-
-        # --- 2. Đọc file ---
-        try:
-            with open(FILE_PATH, 'r', encoding='utf-8') as f:
-                content = f.read()
-        except FileNotFoundError:
-            self.stdout.write(self.style.ERROR(f"❌ LỖI: Không tìm thấy file tại '{FILE_PATH}'."))
-            return
-        
-        self.stdout.write("📖 Đọc file thành công. Bắt đầu bóc tách...")
-
-        # --- 3. Bóc tách dữ liệu theo phương pháp mới ---
-        # Regex để tìm tất cả các loại khối: Chương, Mục, Điều, Khoản, Điểm
-        pattern = re.compile(
-            r'^(?:(Chương\s+[A-Z]+)\n(.*?)\n|'  # Group 1, 2: Chương
-            r'^(Mục\s+\d+)\n(.*?)\n|'          # Group 3, 4: Mục
-            r'^(Điều\s+(\d+)\.\s+(.*?))\n|'    # Group 5, 6, 7: Điều
-            r'^\s*(\d+)\.\s+(.*)|'              # Group 8, 9: Khoản
-            r'^\s*([a-zđ])\)\s+(.*))',         # Group 10, 11: Điểm
-            re.MULTILINE
-        )
+        # --- 1. Xác định danh sách file và thông tin văn bản ---
+        files = self.resolve_paths(options['paths']) if options['paths'] else [FILE_PATH]
+        if not files:
+            raise CommandError("Không tìm thấy file văn bản nào để nạp.")
+        root = options['root'] or default_root(files, options['manifest'])
+        manifest = self.load_manifest(options['manifest'], root)
+        if not options['paths']:
+            manifest.setdefault(source_key(FILE_PATH, root), {'title': DOCUMENT_TITLE, 'document_number': DOCUMENT_NUMBER})
 
-        provisions_to_create = []
-        last_pos = 0
-        current_context = {
-            "chapter": "", "section": "", "article_number": 0, "article_title": ""
-        }
-        
-        # Bỏ qua phần header của văn bản
-        content_start = re.search(r'Chương I', content).start()
-        
-        for match in pattern.finditer(content[content_start:]):
-            start, end = match.span()
-            
-            # Xử lý văn bản nằm giữa các match (thường là nội dung của Điều/Khoản)
-            intermediate_text = clean_text(content[content_start + last_pos : content_start + start])
-            if intermediate_text:
-                # Đây là nội dung thuộc về Điều trước đó nhưng không có số Khoản
-                 if current_context["article_number"] > 0:
-                    provisions_to_create.append(LawProvision(
-                        document=document, chapter_info=current_context["chapter"], section_info=current_context["section"],
-                        article_number=current_context["article_number"], article_title=current_context["article_title"],
-                        provision_id=None, content=intermediate_text
-                    ))
-
-            # Phân loại và cập nhật context
-            if match.group(1): # Chương
-                current_context["chapter"] = clean_text(f"{match.group(1)} {match.group(2)}")
-                current_context["section"] = ""
-            elif match.group(3): # Mục
-                current_context["section"] = clean_text(f"{match.group(3)} {match.group(4)}")
-            elif match.group(5): # Điều
-                current_context["article_number"] = int(match.group(6))
-                current_context["article_title"] = clean_text(match.group(7))
-            elif match.group(8): # Khoản
-                provisions_to_create.append(LawProvision(
-                    document=document, chapter_info=current_context["chapter"], section_info=current_context["section"],
-                    article_number=current_context["article_number"], article_title=current_context["article_title"],
-                    provision_id=match.group(8), content=clean_text(match.group(9))
-                ))
-            elif match.group(10): # Điểm
-                # Tìm khoản gần nhất để ghép ID
-                last_clause_num = "unknown"
-                for p in reversed(provisions_to_create):
-                    if p.article_number == current_context["article_number"] and p.provision_id and '.' not in p.provision_id:
-                        last_clause_num = p.provision_id
-                        break
-                
-                provisions_to_create.append(LawProvision(
-                    document=document, chapter_info=current_context["chapter"], section_info=current_context["section"],
-                    article_number=current_context["article_number"], article_title=current_context["article_title"],
-                    provision_id=f"{last_clause_num}.{match.group(10)}", content=clean_text(match.group(11))
-                ))
-
-            last_pos = end
+        # --- 2. Bỏ qua các file không đổi kể từ lần nạp trước (chỉ cập nhật thông tin nếu manifest đổi) ---
+        jobs, summary = [], []
+        documents = LawDocument.objects.only('source_file', 'checksum', *MANIFEST_FIELDS)
+        known = {document.source_file: document for document in documents}
+        for path in files:
+            name = source_key(path, root)
+            try:
+                checksum = file_checksum(path)
+            except FileNotFoundError:
+                self.stdout.write(self.style.ERROR(f"❌ LỖI: Không tìm thấy file tại '{path}'."))
+                summary.append((name, 'lỗi', 0, 0.0, 0.0))
+                continue
+            document = known.get(name)
+            if not options['force'] and document is not None and document.checksum == checksum:
+                try:
+                    status = self.update_metadata(document, document_fields(name, manifest.get(name)))
+                except Exception as e:
+                    self.stdout.write(self.style.ERROR(f"❌ Lỗi khi cập nhật thông tin '{name}': {e}"))
+                    status = 'lỗi'
+                summary.append((name, status, 0, 0.0, 0.0))
+                continue
+            jobs.append((path, name, checksum))
 
-        # Kiểm tra trùng lặp trước khi lưu
-        seen_keys = set()
-        unique_provisions = []
-        for p in provisions_to_create:
-            key = (p.document_id, p.article_number, p.provision_id)
-            if key in seen_keys:
-                self.stdout.write(self.style.WARNING(f"⚠️  Cảnh báo: Bỏ qua bản ghi trùng lặp - Điều {p.article_number}, Khoản {p.provision_id}"))
+        self.stdout.write(f"📖 {len(jobs)} file cần bóc tách ({len(files) - len(jobs)} bỏ qua), dùng {options['workers']} process...")
+
+        # --- 3. Bóc tách song song, lưu từng văn bản trong transaction riêng ---
+        connections.close_all()  # không chia sẻ kết nối DB đang mở với các process con
+        with ProcessPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+            futures = [(name, checksum, pool.submit(parse_law_document, path)) for path, name, checksum in jobs]
+            for name, checksum, future in futures:
+                try:
+                    parse_time, provisions, warnings = future.result()
+                except Exception as e:
+                    self.stdout.write(self.style.ERROR(f"❌ Lỗi khi bóc tách '{name}': {e}"))
+                    summary.append((name, 'lỗi', 0, 0.0, 0.0))
+                    continue
+                for warning in warnings:
+                    self.stdout.write(self.style.WARNING(f"⚠️  {name}: {warning}"))
+
+                started = time.perf_counter()
+                try:
+                    status = self.save_document(name, checksum, manifest.get(name), provisions, options['batch_size'])
+                except Exception as e:
+                    self.stdout.write(self.style.ERROR(f"❌ Lỗi khi lưu '{name}': {e}"))
+                    summary.append((name, 'lỗi', 0, parse_time, 0.0))
+                    continue
+                summary.append((name, status, len(provisions), parse_time, time.perf_counter() - started))
+
+        # --- 4. Tổng kết ---
+        self.stdout.write("\n📊 Tổng kết:")
+        self.stdout.write(f"    {'File':<40} {'Trạng thái':<22} {'Điều khoản':>10} {'Bóc tách':>9} {'Lưu':>8}")
+        for name, status, count, parse_time, save_time in summary:
+            self.stdout.write(f"    {name[:40]:<40} {status:<22} {count:>10} {parse_time:>8.2f}s {save_time:>7.2f}s")
+        total = sum(row[2] for row in summary)
+        self.stdout.write(self.style.SUCCESS(f'🎉 Hoàn thành! Đã nạp thành công {total} điều/khoản luật từ {len(jobs)} văn bản.'))
+
+    def load_manifest(self, path, root):
+        """{khoá văn bản: mục manifest}; `file` của mỗi mục tính từ thư mục chứa manifest."""
+        if not path:
+            return {}
+        with open(path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+        base = os.path.dirname(os.path.abspath(path))
+        manifest = {}
+        for entry in entries:
+            entry = dict(entry)
+            for field in ('publication_date', 'effective_date'):
+                if entry.get(field):
+                    entry[field] = date.fromisoformat(entry[field])
+            manifest[source_key(os.path.join(base, entry.pop('file')), root)] = entry
+        return manifest
+
+    def resolve_paths(self, paths):
+        files = []
+        for path in paths:
+            if os.path.isdir(path):
+                files.extend(sorted(glob.glob(os.path.join(path, '*.txt'))))
+            elif glob.has_magic(path):
+                files.extend(sorted(glob.glob(path)))
+            else:
+                files.append(path)
+        return list(dict.fromkeys(files))
+
+    def update_metadata(self, document, fields):
+        """File không đổi: chỉ ghi các trường manifest đã đổi (không bóc tách lại). Trả về trạng thái."""
+        changed = [field for field, value in fields.items() if getattr(document, field) != value]
+        if not changed:
+            return 'không đổi'
+        for field in changed:
+            setattr(document, field, fields[field])
+        document.save(update_fields=changed)
+        # Tiêu đề/số hiệu dùng để xác định văn bản khi tra cứu trực tiếp "Điều N".
+        bump_lexical_generation()
+        return f"cập nhật {', '.join(changed)}"
+
+    @transaction.atomic
+    def save_document(self, name, checksum, meta, provisions, batch_size):
+        """Đồng bộ một văn bản (khoá theo source_file): tạo mới, cập nhật tại chỗ, xoá phần không còn. Trả về trạng thái."""
+        if meta is None:
+            self.stdout.write(self.style.WARNING(f"⚠️  '{name}' không có trong manifest, dùng tên file làm tiêu đề."))
+        defaults = {**document_fields(name, meta), 'checksum': checksum}
+        document, created = LawDocument.objects.update_or_create(source_file=name, defaults=defaults)
+
+        existing = {(p.article_number, p.provision_id): p for p in LawProvision.objects.filter(document=document)}
+        to_create, to_update = [], []
+        for values in provisions:
+            current = existing.pop((values['article_number'], values['provision_id']), None)
+            if current is None:
+                to_create.append(LawProvision(document=document, **values))
                 continue
-            seen_keys.add(key)
-            unique_provisions.append(p)
+            changed = [field for field in SYNCED_FIELDS if getattr(current, field) != values[field]]
+            for field in changed:
+                setattr(current, field, values[field])
+            if changed:
+                to_update.append(current)
 
-        self.stdout.write(f"📊 Bóc tách hoàn tất. Chuẩn bị lưu {len(unique_provisions)} điều khoản vào database...")
-        LawProvision.objects.bulk_create(unique_provisions)
-        self.stdout.write(self.style.SUCCESS(f'🎉 Hoàn thành! Đã nạp thành công {len(unique_provisions)} điều/khoản luật.'))
\ No newline at end of file
+        LawProvision.objects.filter(id__in=[p.id for p in existing.values()]).delete()
+        LawProvision.objects.bulk_create(to_create, batch_size=batch_size)
+        LawProvision.objects.bulk_update(to_update, SYNCED_FIELDS, batch_size=batch_size)
+        if to_create or to_update or existing:
+            transaction.on_commit(lambda: purge_document_answers(document.id))
+            transaction.on_commit(bump_lexical_generation)
+        return f"{'mới' if created else 'cập nhật'} +{len(to_create)} ~{len(to_update)} -{len(existing)}"
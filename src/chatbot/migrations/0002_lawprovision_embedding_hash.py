@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lawprovision',
+            name='embedding_hash',
+            field=models.CharField(blank=True, help_text='SHA-256 của đúng đoạn văn bản đã được encode vào Qdrant.', max_length=64, null=True, verbose_name='Hash văn bản đã embed'),
+        ),
+    ]
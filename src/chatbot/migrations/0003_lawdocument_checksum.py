@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 15:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0002_lawprovision_embedding_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lawdocument',
+            name='checksum',
+            field=models.CharField(blank=True, help_text='SHA-256 của file đã nạp lần gần nhất.', max_length=64, null=True, verbose_name='Checksum file gốc'),
+        ),
+    ]
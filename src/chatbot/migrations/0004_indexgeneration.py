@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0003_lawdocument_checksum'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexGeneration',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False, verbose_name='Tên')),
+                ('value', models.BigIntegerField(default=0, verbose_name='Số thế hệ')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Số thế hệ dữ liệu',
+                'verbose_name_plural': 'Các số thế hệ dữ liệu',
+            },
+        ),
+    ]
@@ -9,6 +9,7 @@ class LawDocument(models.Model):
     publication_date = models.DateField("Ngày ban hành", blank=True, null=True)
     effective_date = models.DateField("Ngày có hiệu lực", blank=True, null=True)
     source_file = models.CharField("Tên file gốc", max_length=255)
+    checksum = models.CharField("Checksum file gốc", max_length=64, blank=True, null=True, help_text="SHA-256 của file đã nạp lần gần nhất.")
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -38,6 +39,8 @@ class LawProvision(models.Model):
 
     status = models.CharField("Trạng thái hiệu lực", max_length=20, choices=ProvisionStatus.choices, default=ProvisionStatus.ACTIVE)
     modification_note = models.TextField("Ghi chú sửa đổi", blank=True, null=True, help_text="Ví dụ: Sửa đổi, bổ sung bởi Luật số 76/2025/QH15")
+
+    embedding_hash = models.CharField("Hash văn bản đã embed", max_length=64, blank=True, null=True, help_text="SHA-256 của đúng đoạn văn bản đã được encode vào Qdrant.")
     
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -48,4 +51,21 @@ class LawProvision(models.Model):
         verbose_name = "Điều/Khoản Luật"
         verbose_name_plural = "Các Điều/Khoản Luật"
         ordering = ['document', 'article_number', 'id']
-        unique_together = ('document', 'article_number', 'provision_id')
\ No newline at end of file
+        unique_together = ('document', 'article_number', 'provision_id')
+
+class IndexGeneration(models.Model):
+    """Số thế hệ dữ liệu dùng chung giữa mọi tiến trình (lệnh quản trị và các worker web).
+
+    Cache trong bộ nhớ của từng worker (chỉ mục BM25, chỉ mục cấu trúc Điều...) so số thế
+    hệ đọc từ bảng này với bản đang giữ để biết khi nào phải dựng lại.
+    """
+    name = models.CharField("Tên", max_length=100, primary_key=True)
+    value = models.BigIntegerField("Số thế hệ", default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+    class Meta:
+        verbose_name = "Số thế hệ dữ liệu"
+        verbose_name_plural = "Các số thế hệ dữ liệu"
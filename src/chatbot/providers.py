@@ -0,0 +1,250 @@
+# src/chatbot/providers.py
+"""Nhà cung cấp LLM (Gemini, stub cục bộ) và bộ định tuyến chọn mô hình cho từng câu hỏi.
+
+Mỗi `LLMProvider` có ba phương thức: `generate` (chặn), `agenerate` và `astream`
+(bất đồng bộ, trả từng đoạn văn bản). Lớp con chỉ cài `_complete`, `_acomplete` và
+`_astream`; lớp cơ sở ghi độ trễ và số token (prompt/output) theo nhà cung cấp và mô hình.
+
+- `GeminiProvider`: google-generativeai, số token lấy từ usage_metadata.
+- `StubProvider`: không cần mạng, trả lời tất định (lặp lại câu hỏi hoặc theo mẫu) sau
+  một độ trễ giả lập; dùng cho benchmark và thử tải (LLM_PROVIDER=stub).
+
+`LLMRouter` giữ một `LLMGateway` cho mỗi tuyến ("fast", "pro"), mỗi tuyến có hạn mức
+đồng thời và bộ ngắt mạch riêng. Câu hỏi tra cứu trực tiếp Điều/Khoản và prompt không
+quá LLM_ROUTE_FAST_MAX_TOKENS token đi tuyến fast, còn lại đi tuyến pro.
+"""
+import asyncio
+import logging
+import os
+import random
+import re
+import time
+from collections import namedtuple
+
+from . import metrics
+from .context import count_tokens
+from .llm import LLMGateway
+
+logger = logging.getLogger(__name__)
+
+# -- configuration --
+LLM_PROVIDERS = ("gemini", "stub")
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")
+LLM_PRO_MODEL = os.getenv("LLM_PRO_MODEL", "gemini-2.5-pro")
+LLM_FAST_MODEL = os.getenv("LLM_FAST_MODEL", "gemini-2.5-flash")
+# 0 = không định tuyến, mọi câu hỏi dùng LLM_PRO_MODEL.
+LLM_ROUTE_FAST_MAX_TOKENS = int(os.getenv("LLM_ROUTE_FAST_MAX_TOKENS", 0))
+LLM_TRANSPORT_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 30))
+LLM_STUB_MODE = os.getenv("LLM_STUB_MODE", "echo")
+LLM_STUB_LATENCY_MS = float(os.getenv("LLM_STUB_LATENCY_MS", 800))
+LLM_STUB_JITTER_MS = float(os.getenv("LLM_STUB_JITTER_MS", 0))
+LLM_STUB_FAILURE_RATE = float(os.getenv("LLM_STUB_FAILURE_RATE", 0))
+
+# -- metrics --
+PROVIDER_SECONDS = metrics.histogram(
+    "chatbot_llm_provider_seconds", "Thời gian một lượt gọi nhà cung cấp LLM thành công.", ["provider", "model"]
+)
+PROVIDER_TOKENS = metrics.counter(
+    "chatbot_llm_tokens_total", "Số token đã dùng theo nhà cung cấp, mô hình và loại (prompt/output).",
+    ["provider", "model", "kind"]
+)
+PROVIDER_ERRORS = metrics.counter(
+    "chatbot_llm_provider_errors_total", "Số lượt gọi nhà cung cấp LLM bị lỗi.", ["provider", "model"]
+)
+ROUTED_REQUESTS = metrics.counter("chatbot_llm_routed_total", "Số câu hỏi theo tuyến mô hình.", ["route"])
+
+Completion = namedtuple("Completion", ["text", "prompt_tokens", "output_tokens"])
+
+
+class LLMProvider:
+    name = None
+
+    def __init__(self, model):
+        self.model = model
+
+    @property
+    def label(self):
+        return f"{self.name}:{self.model}"
+
+    def _record(self, started, prompt_tokens, output_tokens):
+        labels = {"provider": self.name, "model": self.model}
+        PROVIDER_SECONDS.observe(time.perf_counter() - started, **labels)
+        PROVIDER_TOKENS.inc(prompt_tokens or 0, kind="prompt", **labels)
+        PROVIDER_TOKENS.inc(output_tokens or 0, kind="output", **labels)
+
+    def _error(self):
+        PROVIDER_ERRORS.inc(provider=self.name, model=self.model)
+
+    def generate(self, prompt):
+        started = time.perf_counter()
+        try:
+            completion = self._complete(prompt)
+        except Exception:
+            self._error()
+            raise
+        self._record(started, completion.prompt_tokens, completion.output_tokens)
+        return completion.text
+
+    async def agenerate(self, prompt):
+        started = time.perf_counter()
+        try:
+            completion = await self._acomplete(prompt)
+        except Exception:
+            self._error()
+            raise
+        self._record(started, completion.prompt_tokens, completion.output_tokens)
+        return completion.text
+
+    async def astream(self, prompt):
+        started = time.perf_counter()
+        usage = Completion("", None, None)
+        try:
+            async for text, chunk_usage in self._astream(prompt):
+                if chunk_usage is not None:
+                    usage = chunk_usage
+                if text:
+                    yield text
+        except Exception:
+            self._error()
+            raise
+        self._record(started, usage.prompt_tokens, usage.output_tokens)
+
+    def _complete(self, prompt):
+        raise NotImplementedError
+
+    async def _acomplete(self, prompt):
+        return await asyncio.to_thread(self._complete, prompt)
+
+    async def _astream(self, prompt):
+        """Sinh (đoạn văn bản, Completion có số token hoặc None); lớp con nên ghi đè."""
+        completion = await self._acomplete(prompt)
+        yield completion.text, completion
+
+
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+
+    def __init__(self, model, api_key=None, timeout=LLM_TRANSPORT_TIMEOUT):
+        import google.generativeai as genai
+        super().__init__(model)
+        api_key = api_key or os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise ValueError("Không tìm thấy GEMINI_API_KEY trong biến môi trường.")
+        genai.configure(api_key=api_key)
+        self.client = genai.GenerativeModel(model)
+        self.request_options = {"timeout": timeout}
+
+    @staticmethod
+    def _usage(response):
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None:
+            return None, None
+        return getattr(usage, "prompt_token_count", None), getattr(usage, "candidates_token_count", None)
+
+    def _complete(self, prompt):
+        response = self.client.generate_content(prompt, request_options=self.request_options)
+        return Completion(response.text, *self._usage(response))
+
+    async def _acomplete(self, prompt):
+        response = await self.client.generate_content_async(prompt, request_options=self.request_options)
+        return Completion(response.text, *self._usage(response))
+
+    async def _astream(self, prompt):
+        response = await self.client.generate_content_async(prompt, stream=True, request_options=self.request_options)
+        async for chunk in response:
+            prompt_tokens, output_tokens = self._usage(chunk)
+            usage = Completion("", prompt_tokens, output_tokens) if prompt_tokens is not None else None
+            yield chunk.text, usage
+
+
+_QUESTION_RE = re.compile(r'.*Câu hỏi: "(.*)"', re.S)
+
+
+class StubProvider(LLMProvider):
+    """Trả lời tất định không cần mạng.
+
+    mode="echo": nhắc lại câu hỏi trong prompt; mode="template": `template` với {question}
+    và {prompt_tokens}. Độ trễ latency_ms ± jitter_ms; với xác suất failure_rate ném lỗi
+    tạm thời (ServiceUnavailable) để thử retry và bộ ngắt mạch.
+    """
+
+    name = "stub"
+
+    class ServiceUnavailable(Exception):
+        pass
+
+    def __init__(self, model="stub", mode=LLM_STUB_MODE, template=None, latency_ms=LLM_STUB_LATENCY_MS,
+                 jitter_ms=LLM_STUB_JITTER_MS, failure_rate=LLM_STUB_FAILURE_RATE, chunks=4):
+        super().__init__(model)
+        self.mode = mode
+        self.template = template or "Trả lời mẫu cho câu hỏi \"{question}\" ({prompt_tokens} token ngữ cảnh)."
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.chunks = chunks
+        self.calls = 0
+
+    def _delay(self):
+        return max(0.0, self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000.0
+
+    def _answer(self, prompt):
+        self.calls += 1
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise self.ServiceUnavailable("Lỗi giả lập từ StubProvider.")
+        match = _QUESTION_RE.search(prompt)
+        question = match.group(1) if match else prompt[-200:]
+        prompt_tokens = count_tokens(prompt)
+        if self.mode == "template":
+            text = self.template.format(question=question, prompt_tokens=prompt_tokens)
+        else:
+            text = f"(Trả lời giả lập từ {self.model}) {question}"
+        return Completion(text, prompt_tokens, count_tokens(text))
+
+    def _complete(self, prompt):
+        time.sleep(self._delay())
+        return self._answer(prompt)
+
+    async def _acomplete(self, prompt):
+        await asyncio.sleep(self._delay())
+        return self._answer(prompt)
+
+    async def _astream(self, prompt):
+        completion = self._answer(prompt)
+        text = completion.text
+        size = max(1, len(text) // self.chunks + 1)
+        for start in range(0, len(text), size):
+            await asyncio.sleep(self._delay() / self.chunks)
+            yield text[start:start + size], None
+        yield "", completion
+
+
+class LLMRouter:
+    """Chọn tuyến mô hình theo loại câu hỏi và kích thước prompt."""
+
+    def __init__(self, routes, fast_max_tokens=LLM_ROUTE_FAST_MAX_TOKENS):
+        self.routes = routes
+        self.fast_max_tokens = fast_max_tokens
+
+    def route(self, prompt_tokens=None, question_class=None):
+        name = "pro"
+        if "fast" in self.routes and self.fast_max_tokens > 0:
+            if question_class == "lookup" or (prompt_tokens is not None and prompt_tokens <= self.fast_max_tokens):
+                name = "fast"
+        ROUTED_REQUESTS.inc(route=name)
+        return self.routes[name]
+
+
+def make_provider(model, provider=LLM_PROVIDER):
+    if provider not in LLM_PROVIDERS:
+        raise ValueError(f"LLM_PROVIDER phải là một trong {LLM_PROVIDERS}, nhận được '{provider}'.")
+    if provider == "stub":
+        return StubProvider(model)
+    return GeminiProvider(model)
+
+
+def make_router(provider=LLM_PROVIDER):
+    routes = {"pro": LLMGateway(make_provider(LLM_PRO_MODEL, provider))}
+    if LLM_ROUTE_FAST_MAX_TOKENS > 0 and LLM_FAST_MODEL != LLM_PRO_MODEL:
+        routes["fast"] = LLMGateway(make_provider(LLM_FAST_MODEL, provider))
+    logger.info(f"Nhà cung cấp LLM: {', '.join(f'{name}={gw.provider.label}' for name, gw in routes.items())}.")
+    return LLMRouter(routes)
@@ -0,0 +1,79 @@
+# src/chatbot/rag.py
+"""Các bước dựng prompt và nguồn trích dẫn dùng chung cho các view RAG."""
+from collections import namedtuple
+
+from . import metrics
+from .context import context_builder
+from .indexing import payload_status, provision_from_payload
+from .models import LawProvision
+
+# Kết quả tìm kiếm vector đã tách khỏi kiểu dữ liệu của client (có thể lưu cache/pickle).
+SearchHit = namedtuple("SearchHit", ["id", "score", "payload"], defaults=[None])
+
+PAYLOAD_FALLBACKS = metrics.counter(
+    "chatbot_payload_fallback_total", "Số hit phải lấy nội dung từ PostgreSQL vì payload thiếu hoặc cũ.", ["reason"]
+)
+
+NO_PROVISIONS_ANSWER = "Tôi không tìm thấy điều khoản luật nào liên quan trực tiếp đến câu hỏi của bạn."
+
+
+def _hydration_queryset(hits):
+    return LawProvision.objects.filter(id__in=[hit.id for hit in hits]).select_related('document')
+
+
+def _from_payloads(hits):
+    """Tách các hit có payload đầy đủ khỏi các hit phải lấy từ PostgreSQL."""
+    resolved, missing = {}, []
+    for hit in hits:
+        status = payload_status(hit.payload)
+        if status == "full":
+            resolved[hit.id] = provision_from_payload(hit.id, hit.payload)
+        else:
+            PAYLOAD_FALLBACKS.inc(reason=status)
+            missing.append(hit)
+    return resolved, missing
+
+
+def _in_rank_order(hits, provisions):
+    by_id = {str(p.id): p for p in provisions}
+    return [by_id[hit.id] for hit in hits if hit.id in by_id]
+
+
+def hydrate_provisions(hits):
+    """Dựng các điều khoản cho danh sách hit theo thứ tự xếp hạng.
+
+    Hit có payload `full` được dựng trực tiếp; phần còn lại được lấy (kèm văn bản) bằng
+    đúng một truy vấn PostgreSQL.
+    """
+    resolved, missing = _from_payloads(hits)
+    if missing:
+        resolved.update((str(p.id), p) for p in _hydration_queryset(missing))
+    return _in_rank_order(hits, resolved.values())
+
+
+async def ahydrate_provisions(hits):
+    resolved, missing = _from_payloads(hits)
+    if missing:
+        resolved.update([(str(p.id), p) async for p in _hydration_queryset(missing)])
+    return _in_rank_order(hits, resolved.values())
+
+
+def build_prompt(query, provisions):
+    """Prompt cho Gemini trong ngân sách token; trả về PackedPrompt(text, tokens, provisions đã dùng)."""
+    return context_builder.build(query, provisions)
+
+
+def fallback_answer(provisions):
+    return "Xin lỗi, tôi gặp sự cố khi tạo câu trả lời. Tuy nhiên, tôi tìm thấy các điều khoản sau có liên quan:\n" + "\n".join([f"- Điều {p.article_number}, Khoản {p.provision_id or 'chung'}" for p in provisions])
+
+
+def source_entry(p, score):
+    return {
+        "id": str(p.id),
+        "document": p.document.title,
+        "chapter": p.chapter_info or "N/A",
+        "section": p.section_info or "N/A",
+        "article": p.article_number,
+        "provision": p.provision_id or "N/A",
+        "score": score
+    }
@@ -0,0 +1,182 @@
+# src/chatbot/rerank.py
+"""Bước xếp hạng lại (rerank) bằng cross-encoder sau khi truy xuất.
+
+Truy xuất lấy RERANK_CANDIDATES ứng viên thay vì SEARCH_LIMIT. Cross-encoder (lượng tử
+hoá int8 động) chấm điểm từng cặp (câu hỏi, điều khoản) theo lô, rồi chỉ giữ
+RERANK_TOP_K điều khoản tốt nhất cho prompt. Nhờ đó prompt gửi Gemini ngắn hơn nhưng
+chính xác hơn.
+
+Độ trễ bị chặn cứng: việc chấm điểm chạy trên một luồng riêng và view chỉ chờ tối đa
+RERANK_BUDGET_MS, kể cả thời gian xếp hàng sau các yêu cầu khác. Nếu quá hạn, hoặc đã có
+RERANK_MAX_QUEUE lượt đang chờ/chạy, view dùng thứ tự của bi-encoder. Lượt đã bắt đầu chấm
+vẫn chạy tiếp và ghi vào cache điểm, khoá theo (hash câu hỏi đã chuẩn hoá, id điều khoản),
+để lần hỏi lại không phải chấm lại; lượt tới phiên khi người gọi đã hết ngân sách thì bị bỏ
+qua, nên hàng đợi không dồn việc không ai chờ.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from . import metrics
+from .cache import CHATBOT_CACHE_TTL, LocalLRUCache, normalize_question
+from .indexing import embedding_text
+
+logger = logging.getLogger(__name__)
+
+# -- configuration --
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "0") == "1"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", 20))
+RERANK_TOP_K = int(os.getenv("RERANK_TOP_K", os.getenv("SEARCH_LIMIT", 5)))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", 150))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", 16))
+RERANK_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", 256))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", 4096))
+RERANK_MAX_QUEUE = int(os.getenv("RERANK_MAX_QUEUE", 8))
+
+# -- metrics --
+RERANK_REQUESTS = metrics.counter(
+    "chatbot_rerank_total",
+    "Số lần rerank theo kết quả: ok, timeout, busy (hàng đợi đầy) hoặc error.", ["result"]
+)
+RERANK_SECONDS = metrics.histogram("chatbot_rerank_seconds", "Thời gian chấm điểm cross-encoder cho một câu hỏi.")
+RERANK_CACHED_PAIRS = metrics.counter(
+    "chatbot_rerank_cache_total", "Số cặp (câu hỏi, điều khoản) tra trong cache điểm rerank.", ["result"]
+)
+
+
+def load_cross_encoder(model_name=RERANK_MODEL, max_length=RERANK_MAX_LENGTH):
+    from sentence_transformers import CrossEncoder
+    import torch
+
+    logger.info(f"Đang tải cross-encoder '{model_name}'...")
+    model = CrossEncoder(model_name, device="cpu", max_length=max_length)
+    try:
+        model.model = torch.quantization.quantize_dynamic(model.model, {torch.nn.Linear}, dtype=torch.qint8)
+        logger.info("Đã lượng tử hoá động (int8) cross-encoder.")
+    except Exception as e:
+        logger.warning(f"Không thể lượng tử hoá cross-encoder: {e}. Sử dụng mô hình gốc.")
+    return model
+
+
+class Reranker:
+    def __init__(self, model, top_k=RERANK_TOP_K, budget_ms=RERANK_BUDGET_MS, batch_size=RERANK_BATCH_SIZE,
+                 cache_size=RERANK_CACHE_SIZE, cache_ttl=CHATBOT_CACHE_TTL, max_queue=RERANK_MAX_QUEUE):
+        self.model = model
+        self.top_k = top_k
+        self.budget = budget_ms / 1000.0
+        self.batch_size = batch_size
+        self.scores = LocalLRUCache(cache_size, cache_ttl)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+        # Một lượt chấm điểm tại một thời điểm; tối đa max_queue lượt đang chờ hoặc đang chạy.
+        self._queue_slots = threading.Semaphore(max(1, max_queue))
+
+    @staticmethod
+    def _key(question_hash, provision):
+        return f"{question_hash}:{provision.id}"
+
+    def _score(self, requests, deadline):
+        """Chấm điểm các cặp chưa có trong cache của mọi câu hỏi trong một lần predict; trả về {id: điểm} cho từng câu hỏi.
+
+        None nếu tới phiên khi người gọi đã hết ngân sách (họ đã dùng thứ tự bi-encoder).
+        """
+        started = time.perf_counter()
+        try:
+            if time.monotonic() >= deadline:
+                return None
+            results, missing = [], []
+            for question, question_hash, provisions in requests:
+                scores = {}
+                for p in provisions:
+                    score = self.scores.get(self._key(question_hash, p))
+                    RERANK_CACHED_PAIRS.inc(result="miss" if score is None else "hit")
+                    if score is None:
+                        missing.append((question, question_hash, p, scores))
+                    else:
+                        scores[p.id] = score
+                results.append(scores)
+            if missing:
+                pairs = [(question, embedding_text(p)) for question, _, p, _ in missing]
+                predicted = self.model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+                for (_, question_hash, p, scores), score in zip(missing, predicted):
+                    scores[p.id] = float(score)
+                    self.scores.set(self._key(question_hash, p), float(score))
+            RERANK_SECONDS.observe(time.perf_counter() - started)
+            return results
+        finally:
+            self._queue_slots.release()
+
+    def _submit(self, requests, budget):
+        if not self._queue_slots.acquire(blocking=False):
+            return None
+        deadline = time.monotonic() + budget
+        requests = [
+            (question, hashlib.sha1(normalize_question(question).encode("utf-8")).hexdigest(), provisions)
+            for question, provisions in requests
+        ]
+        try:
+            return self._executor.submit(self._score, requests, deadline)
+        except Exception:
+            self._queue_slots.release()
+            raise
+
+    def _order(self, provisions, scores):
+        ranked = sorted(provisions, key=lambda p: scores[p.id], reverse=True)
+        return ranked[:self.top_k]
+
+    def _fallback(self, provisions, result):
+        RERANK_REQUESTS.inc(result=result)
+        return provisions[:self.top_k]
+
+    def rerank(self, question, provisions):
+        """Giữ top_k điều khoản theo cross-encoder; dùng thứ tự bi-encoder nếu vượt ngân sách thời gian."""
+        if len(provisions) <= 1:
+            return provisions[:self.top_k]
+        future = self._submit([(question, provisions)], self.budget)
+        if future is None:
+            return self._fallback(provisions, "busy")
+        try:
+            scores = future.result(timeout=self.budget)[0]
+        except FutureTimeoutError:
+            logger.warning(f"Rerank vượt ngân sách {self.budget * 1000:.0f}ms, dùng thứ tự bi-encoder.")
+            return self._fallback(provisions, "timeout")
+        except Exception as e:
+            logger.exception(f"Lỗi khi rerank: {e}")
+            return self._fallback(provisions, "error")
+        RERANK_REQUESTS.inc(result="ok")
+        return self._order(provisions, scores)
+
+    async def arerank(self, question, provisions):
+        return (await self.arerank_many([(question, provisions)]))[0]
+
+    async def arerank_many(self, requests):
+        """Rerank nhiều (câu hỏi, điều khoản) cùng lúc (endpoint batch): mọi cặp được chấm trong một lượt
+        predict, ngân sách thời gian nhân theo số câu hỏi. Quá hạn hoặc lỗi thì cả lô dùng thứ tự bi-encoder."""
+        ranked = [provisions[:self.top_k] for _, provisions in requests]
+        pending = [i for i, (_, provisions) in enumerate(requests) if len(provisions) > 1]
+        if not pending:
+            return ranked
+        budget = self.budget * len(pending)
+        future = self._submit([requests[i] for i in pending], budget)
+        if future is None:
+            RERANK_REQUESTS.inc(len(pending), result="busy")
+            return ranked
+        try:
+            # shield: hết giờ chỉ ngừng chờ, lượt chấm điểm vẫn chạy xong để điền cache.
+            scores = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), budget)
+        except asyncio.TimeoutError:
+            logger.warning(f"Rerank vượt ngân sách {budget * 1000:.0f}ms, dùng thứ tự bi-encoder.")
+            RERANK_REQUESTS.inc(len(pending), result="timeout")
+            return ranked
+        except Exception as e:
+            logger.exception(f"Lỗi khi rerank: {e}")
+            RERANK_REQUESTS.inc(len(pending), result="error")
+            return ranked
+        RERANK_REQUESTS.inc(len(pending), result="ok")
+        for i, question_scores in zip(pending, scores):
+            ranked[i] = self._order(requests[i][1], question_scores)
+        return ranked
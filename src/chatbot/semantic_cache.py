@@ -0,0 +1,204 @@
+# src/chatbot/semantic_cache.py
+"""Cache câu trả lời theo độ tương đồng ngữ nghĩa của câu hỏi.
+
+Một câu hỏi mới dùng lại câu trả lời đã lưu khi vector của nó có cosine >=
+SEMANTIC_CACHE_THRESHOLD với một câu hỏi cũ VÀ truy xuất đúng cùng tập điều khoản.
+Chỉ mục là một ma trận NumPy nhỏ (đã chuẩn hoá) trong tiến trình, giới hạn
+SEMANTIC_CACHE_SIZE mục, loại bỏ mục lâu không dùng nhất khi đầy.
+
+`purge_document_answers()` được ingest_law_data gọi khi điều khoản của một văn bản thay
+đổi. ingest_law_data chạy trong tiến trình riêng, nên ngoài việc xoá trong tiến trình hiện
+tại, nó tăng số thế hệ `answers:<id văn bản>` trong PostgreSQL (chatbot.generations; cột
+updated_at là mốc xoá). `answer_cache` của mỗi worker đọc các mốc mới tối đa mỗi
+SEMANTIC_CACHE_PURGE_CHECK_SECONDS giây và bỏ các câu trả lời tạo trước mốc của văn bản
+tương ứng. Trong async view dùng `alookup()` để việc đọc đó không chặn event loop.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# -- configuration --
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "1") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.92))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", 512))
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", 24 * 3600))
+SEMANTIC_CACHE_PURGE_CHECK_SECONDS = float(os.getenv("SEMANTIC_CACHE_PURGE_CHECK_SECONDS", 5))
+
+PURGE_GENERATION_PREFIX = "answers:"
+
+# -- metrics --
+SEMANTIC_CACHE_REQUESTS = metrics.counter(
+    "chatbot_semantic_cache_requests_total",
+    "Số lần tra cache câu trả lời: hit, miss (không đủ gần) hoặc mismatch (gần nhưng khác tập điều khoản).",
+    ["result"],
+)
+SEMANTIC_CACHE_SIMILARITY = metrics.histogram(
+    "chatbot_semantic_cache_best_similarity", "Cosine cao nhất tìm được cho mỗi lần tra cache.",
+    buckets=(0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.92, 0.94, 0.96, 0.98, 0.99, 1.0),
+)
+SEMANTIC_CACHE_ENTRIES = metrics.gauge("chatbot_semantic_cache_entries", "Số câu trả lời đang được cache.")
+
+
+def _purge_generation(document_id):
+    return f"{PURGE_GENERATION_PREFIX}{document_id}"
+
+
+def _normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticAnswerCache:
+    """shared_purges: theo dõi mốc xoá do tiến trình khác ghi trong PostgreSQL (chỉ bật cho
+    `answer_cache` của worker); tắt thì chỉ `purge_document()` gọi trực tiếp mới xoá."""
+
+    def __init__(self, capacity=SEMANTIC_CACHE_SIZE, threshold=SEMANTIC_CACHE_THRESHOLD, ttl=SEMANTIC_CACHE_TTL,
+                 shared_purges=False, purge_check_seconds=SEMANTIC_CACHE_PURGE_CHECK_SECONDS):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl = ttl
+        self.shared_purges = shared_purges
+        self.purge_check_seconds = purge_check_seconds
+        self._purges_checked_at = None
+        self._purges_seen_until = time.time()
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._entries = [None] * capacity
+        self._last_used = np.zeros(capacity, dtype=np.float64)
+        self._valid = np.zeros(capacity, dtype=bool)
+
+    def __len__(self):
+        return int(self._valid.sum())
+
+    def _evict(self, slot):
+        self._entries[slot] = None
+        self._valid[slot] = False
+
+    def lookup(self, vector, provision_ids):
+        self.refresh_purges()
+        return self._lookup(vector, provision_ids)
+
+    async def alookup(self, vector, provision_ids):
+        await self.arefresh_purges()
+        return self._lookup(vector, provision_ids)
+
+    def _lookup(self, vector, provision_ids):
+        if self._vectors is None or not self._valid.any():
+            SEMANTIC_CACHE_REQUESTS.inc(result="miss")
+            return None
+        query = _normalize(vector)
+        wanted = frozenset(str(i) for i in provision_ids)
+        now = time.time()
+        with self._lock:
+            similarities = np.where(self._valid, self._vectors @ query, -1.0)
+            SEMANTIC_CACHE_SIMILARITY.observe(float(similarities.max()))
+            candidates = np.flatnonzero(similarities >= self.threshold)
+            result = "miss" if candidates.size == 0 else "mismatch"
+            for slot in candidates[np.argsort(-similarities[candidates])]:
+                entry = self._entries[slot]
+                if entry["created_at"] + self.ttl < now:
+                    self._evict(slot)
+                    continue
+                if entry["provision_ids"] != wanted:
+                    continue
+                self._last_used[slot] = now
+                SEMANTIC_CACHE_REQUESTS.inc(result="hit")
+                return entry["answer"]
+        SEMANTIC_CACHE_REQUESTS.inc(result=result)
+        return None
+
+    def store(self, vector, provision_ids, document_ids, answer):
+        vector = _normalize(vector)
+        now = time.time()
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+                self._vectors = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+                self._valid[:] = False
+            free = np.flatnonzero(~self._valid)
+            slot = free[0] if free.size else int(np.argmin(self._last_used))
+            self._vectors[slot] = vector
+            self._entries[slot] = {
+                "provision_ids": frozenset(str(i) for i in provision_ids),
+                "document_ids": frozenset(str(i) for i in document_ids),
+                "answer": answer,
+                "created_at": now,
+            }
+            self._last_used[slot] = now
+            self._valid[slot] = True
+            SEMANTIC_CACHE_ENTRIES.set(len(self))
+
+    def purge_document(self, document_id, before=None):
+        """Xoá câu trả lời dựa trên văn bản; `before` (epoch): chỉ các câu trả lời tạo trước mốc đó."""
+        document_id = str(document_id)
+        with self._lock:
+            for slot in np.flatnonzero(self._valid):
+                entry = self._entries[slot]
+                if document_id in entry["document_ids"] and (before is None or entry["created_at"] <= before):
+                    self._evict(slot)
+            SEMANTIC_CACHE_ENTRIES.set(len(self))
+
+    def clear(self):
+        with self._lock:
+            self._entries = [None] * self.capacity
+            self._valid[:] = False
+            SEMANTIC_CACHE_ENTRIES.set(0)
+
+    def _purges_due(self):
+        if not self.shared_purges:
+            return False
+        now = time.monotonic()
+        if self._purges_checked_at is not None and now - self._purges_checked_at < self.purge_check_seconds:
+            return False
+        # Đánh dấu trước khi đọc để các request đồng thời không cùng truy vấn PostgreSQL.
+        self._purges_checked_at = now
+        return True
+
+    def _purges_query(self):
+        from .models import IndexGeneration
+        since = datetime.fromtimestamp(self._purges_seen_until, tz=timezone.utc)
+        return IndexGeneration.objects.filter(
+            name__startswith=PURGE_GENERATION_PREFIX, updated_at__gt=since
+        ).values_list("name", "updated_at")
+
+    def _apply_purges(self, markers):
+        for name, purged_at in markers:
+            purged_at = purged_at.timestamp()
+            self.purge_document(name[len(PURGE_GENERATION_PREFIX):], before=purged_at)
+            self._purges_seen_until = max(self._purges_seen_until, purged_at)
+
+    def refresh_purges(self):
+        """Áp dụng các mốc xoá mà tiến trình khác (ingest_law_data) đã ghi vào PostgreSQL."""
+        if not self._purges_due():
+            return
+        try:
+            self._apply_purges(list(self._purges_query()))
+        except Exception as e:
+            logger.warning(f"Không đọc được mốc xoá cache câu trả lời: {e}")
+
+    async def arefresh_purges(self):
+        if not self._purges_due():
+            return
+        try:
+            self._apply_purges([marker async for marker in self._purges_query()])
+        except Exception as e:
+            logger.warning(f"Không đọc được mốc xoá cache câu trả lời: {e}")
+
+
+answer_cache = SemanticAnswerCache(shared_purges=True) if SEMANTIC_CACHE_ENABLED else None
+
+
+def purge_document_answers(document_id):
+    """Gọi khi điều khoản của một văn bản được nạp lại (kể cả từ tiến trình khác worker)."""
+    from .generations import bump_generation
+    if answer_cache is not None:
+        answer_cache.purge_document(document_id)
+    bump_generation(_purge_generation(document_id))
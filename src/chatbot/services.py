@@ -0,0 +1,230 @@
+# src/chatbot/services.py
+"""Khởi tạo lười các thành phần nặng (backend vector, mô hình embedding, LLM...).
+
+Không thành phần nào được tạo lúc import, nên `manage.py migrate`, trang admin và các
+lệnh quản trị khởi động ngay. Mỗi thành phần được tạo ở lần `services.get()` đầu tiên
+hoặc bởi luồng warm-up nền (`services.warm_up()`, được config/wsgi.py và config/asgi.py
+gọi khi CHATBOT_WARMUP=1).
+
+Khi khởi tạo lỗi, thành phần đó không bị đánh dấu hỏng vĩnh viễn. Nó được thử lại
+sau một khoảng chờ tăng dần (SERVICE_RETRY_BASE, nhân đôi mỗi lần, tối đa
+SERVICE_RETRY_MAX giây). Thành phần bắt buộc chưa sẵn sàng làm `get()` ném
+ServiceUnavailable (view trả 503). Thành phần tuỳ chọn (batcher, rerank, chỉ mục BM25/Điều)
+lỗi thì trả None để pipeline chạy ở chế độ giảm cấp.
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# -- configuration --
+CHATBOT_WARMUP = os.getenv("CHATBOT_WARMUP", "1") == "1"
+SERVICE_RETRY_BASE = float(os.getenv("SERVICE_RETRY_BASE", 1.0))
+SERVICE_RETRY_MAX = float(os.getenv("SERVICE_RETRY_MAX", 60.0))
+
+# -- metrics --
+SERVICE_READY = metrics.gauge("chatbot_service_ready", "1 nếu thành phần đã sẵn sàng.", ["service"])
+SERVICE_LOAD_SECONDS = metrics.gauge("chatbot_service_load_seconds", "Thời gian khởi tạo thành phần.", ["service"])
+SERVICE_FAILURES = metrics.counter("chatbot_service_failures_total", "Số lần khởi tạo thành phần thất bại.", ["service"])
+
+
+class ServiceUnavailable(Exception):
+    def __init__(self, name, error):
+        super().__init__(f"{name}: {error}")
+        self.name = name
+        self.error = error
+
+
+class Service:
+    def __init__(self, name, factory, required=True, retry_base=SERVICE_RETRY_BASE, retry_max=SERVICE_RETRY_MAX):
+        self.name = name
+        self.factory = factory
+        self.required = required
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.state = "pending"
+        self.value = None
+        self.error = None
+        self.attempts = 0
+        self.load_seconds = None
+        self.next_retry_at = 0.0
+        self._lock = threading.Lock()
+
+    def _unavailable(self):
+        if self.required:
+            raise ServiceUnavailable(self.name, self.error or "đang khởi tạo")
+        return None
+
+    def load(self):
+        """Khởi tạo (hoặc thử lại) nếu cần; trả về True khi đã sẵn sàng."""
+        with self._lock:
+            if self.state == "ready":
+                return True
+            if self.state == "failed" and time.monotonic() < self.next_retry_at:
+                return False
+            self.state = "loading"
+            self.attempts += 1
+            started = time.perf_counter()
+            try:
+                self.value = self.factory()
+            except Exception as e:
+                self.state, self.error = "failed", str(e)
+                delay = min(self.retry_max, self.retry_base * 2 ** (self.attempts - 1))
+                self.next_retry_at = time.monotonic() + delay * random.uniform(0.8, 1.2)
+                SERVICE_FAILURES.inc(service=self.name)
+                logger.exception(f"Khởi tạo '{self.name}' thất bại (lần {self.attempts}), thử lại sau ~{delay:.0f}s: {e}")
+                return False
+            self.load_seconds = time.perf_counter() - started
+            self.state, self.error = "ready", None
+            SERVICE_READY.set(1, service=self.name)
+            SERVICE_LOAD_SECONDS.set(self.load_seconds, service=self.name)
+            logger.info(f"Đã khởi tạo '{self.name}' trong {self.load_seconds:.2f}s.")
+            return True
+
+    def get(self):
+        if self.state == "ready" or self.load():
+            return self.value
+        return self._unavailable()
+
+    def status(self):
+        return {
+            "state": self.state,
+            "required": self.required,
+            "attempts": self.attempts,
+            "load_seconds": None if self.load_seconds is None else round(self.load_seconds, 3),
+            "error": self.error,
+        }
+
+
+class ServiceRegistry:
+    def __init__(self):
+        self._services = {}
+        self._warmup_thread = None
+
+    def register(self, name, factory, required=True):
+        self._services[name] = Service(name, factory, required)
+        return self._services[name]
+
+    def get(self, name):
+        return self._services[name].get()
+
+    async def aget(self, name):
+        service = self._services[name]
+        if service.state == "ready":
+            return service.value
+        # Khởi tạo có thể mất vài giây (tải mô hình): không chặn event loop.
+        return await asyncio.to_thread(service.get)
+
+    def status(self):
+        return {name: service.status() for name, service in self._services.items()}
+
+    @property
+    def ready(self):
+        return all(s.state == "ready" for s in self._services.values() if s.required)
+
+    def warm_up(self):
+        """Khởi tạo mọi thành phần trên một luồng nền, thử lại theo backoff tới khi các thành phần bắt buộc sẵn sàng."""
+        if self._warmup_thread is not None and self._warmup_thread.is_alive():
+            return self._warmup_thread
+        self._warmup_thread = threading.Thread(target=self._warm_up, name="chatbot-warmup", daemon=True)
+        self._warmup_thread.start()
+        return self._warmup_thread
+
+    def preload(self, *names):
+        """Khởi tạo đồng bộ các thành phần cho trước trên luồng hiện tại.
+
+        Dùng trong process master của gunicorn trước khi fork: trọng số mô hình nằm sẵn
+        trong RAM và được các worker dùng chung theo copy-on-write. Chỉ nên preload thành
+        phần không giữ luồng hay kết nối mạng, vì chúng không còn dùng được sau fork.
+        """
+        return all(self._services[name].load() for name in names)
+
+    def _warm_up(self):
+        from django.db import connection
+        try:
+            while True:
+                for service in self._services.values():
+                    service.load()
+                pending = [s for s in self._services.values() if s.state != "ready"]
+                if not pending:
+                    logger.info("Warm-up hoàn tất: mọi thành phần đã sẵn sàng.")
+                    return
+                time.sleep(max(0.05, min(s.next_retry_at for s in pending) - time.monotonic()))
+        finally:
+            connection.close()  # kết nối DB của luồng warm-up (chỉ mục BM25)
+
+    @contextmanager
+    def override(self, **values):
+        """Thay tạm các thành phần bằng giá trị cho sẵn (dùng trong test và lệnh benchmark)."""
+        saved = dict(self._services)
+        try:
+            for name, value in values.items():
+                service = Service(name, lambda value=value: value, saved[name].required if name in saved else True)
+                service.load()
+                self._services[name] = service
+            yield self
+        finally:
+            self._services = saved
+
+
+# -- chatbot components --
+def _vector_store():
+    from .vectorstore import make_vector_store
+    store = make_vector_store()
+    store.ping()
+    return store
+
+
+def _embedding_model():
+    from .embedding import get_embedding_model
+    return get_embedding_model()
+
+
+def _embedding_batcher():
+    from .batching import EMBEDDING_BATCH_ENABLED, EmbeddingBatcher
+    return EmbeddingBatcher(services.get("embedding_model")) if EMBEDDING_BATCH_ENABLED else None
+
+
+def _reranker():
+    from .rerank import RERANK_ENABLED, Reranker, load_cross_encoder
+    return Reranker(load_cross_encoder()) if RERANK_ENABLED else None
+
+
+def _lexical_index():
+    from .lexical import HYBRID_SEARCH_ENABLED, LexicalIndex
+    if not HYBRID_SEARCH_ENABLED:
+        return None
+    index = LexicalIndex()
+    index.snapshot()
+    return index
+
+
+def _article_index():
+    from .hierarchy import CONTEXT_EXPANSION, ArticleIndex
+    if CONTEXT_EXPANSION == "none":
+        return None
+    index = ArticleIndex()
+    index.snapshot()
+    return index
+
+
+def _llm():
+    from .providers import make_router
+    return make_router()
+
+
+services = ServiceRegistry()
+services.register("vector_store", _vector_store)
+services.register("embedding_model", _embedding_model)
+services.register("llm", _llm)
+services.register("embedding_batcher", _embedding_batcher, required=False)
+services.register("lexical_index", _lexical_index, required=False)
+services.register("article_index", _article_index, required=False)
+services.register("reranker", _reranker, required=False)
@@ -1,3 +1,1447 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from qdrant_client import AsyncQdrantClient, QdrantClient, models as qdrant_models
+
+from .batching import EmbeddingBatcher
+from .cache import RAG_CACHE_GENERATION, LocalLRUCache, RAGCache, normalize_question
+from .coalesce import COALESCE_REQUESTS, SharedFlightLock, SingleFlight, StreamFlight, flight_key
+from .context import ContextBuilder, count_tokens
+from .embedding import ArtifactEmbeddingModel
+from .evaluation import (
+    GoldenQuestion, HashingEncoder, compare_reports, load_golden_set, parse_server_timing, retrieval_metrics,
+)
+from .generations import bump_generation
+from .hierarchy import ArticleIndex, _Snapshot
+from .indexing import PAYLOAD_VERSION, provision_payload
+from .law_parser import parse_law_file, parse_law_lines
+from .lexical import LexicalIndex, bump_lexical_generation, parse_reference, reciprocal_rank_fusion
+from .llm import CircuitBreaker, CircuitOpen, LLMGateway, LLMTimeout
+from .management.commands.benchmark_rag import BENCHMARK_DATA_DIR, GOLDEN_SET
+from .rag import SearchHit
+from .rerank import RERANK_REQUESTS, Reranker
+from .services import Service, ServiceRegistry, ServiceUnavailable, services
+from .semantic_cache import SemanticAnswerCache, purge_document_answers
+from .vectorstore import LocalVectorStore, QdrantVectorStore, VectorPoint
+from . import metrics, views
+from .models import IndexGeneration, LawDocument, LawProvision
+from .providers import PROVIDER_TOKENS, Completion, LLMProvider, LLMRouter, StubProvider
+
+
+class FakeEncoder:
+    def __init__(self, dim=4):
+        self.dim = dim
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def encode(self, texts, **kwargs):
+        single = isinstance(texts, str)
+        batch = [texts] if single else list(texts)
+        with self.lock:
+            self.calls.append(len(batch))
+        vectors = np.array([[float(len(t))] * self.dim for t in batch], dtype=np.float32)
+        return vectors[0] if single else vectors
+
+
+class EmbeddingBatcherTests(SimpleTestCase):
+    def test_concurrent_queries_share_one_forward_pass(self):
+        encoder = FakeEncoder()
+        batcher = EmbeddingBatcher(encoder, max_batch_size=8, max_wait_ms=200)
+        texts = ["a" * (i + 1) for i in range(8)]
+        futures = [batcher.submit(t) for t in texts]
+        results = [f.result(timeout=5) for f in futures]
+
+        self.assertEqual(encoder.calls, [8])
+        for text, vector in zip(texts, results):
+            self.assertEqual(vector[0], len(text))
+
+    def test_encode_errors_propagate_to_every_caller(self):
+        class Broken:
+            def encode(self, texts, **kwargs):
+                raise RuntimeError("boom")
+
+        batcher = EmbeddingBatcher(Broken(), max_batch_size=2, max_wait_ms=50)
+        futures = [batcher.submit("x"), batcher.submit("y")]
+        for f in futures:
+            with self.assertRaises(RuntimeError):
+                f.result(timeout=5)
+
+
+    def test_cancelled_caller_is_skipped_and_batcher_keeps_running(self):
+        encoder = FakeEncoder()
+        batcher = EmbeddingBatcher(encoder, max_batch_size=8, max_wait_ms=100)
+        cancelled, kept = batcher.submit("aa"), batcher.submit("bbb")
+        cancelled.cancel()
+        self.assertEqual(kept.result(timeout=5)[0], 3)
+        self.assertEqual(batcher.encode("c", timeout=5)[0], 1)
+        self.assertEqual(encoder.calls, [1, 1])
+        self.assertTrue(batcher._thread.is_alive())
+
+    def test_full_queue_encodes_directly_without_blocking_the_loop(self):
+        release, started = threading.Event(), threading.Event()
+
+        class SlowBatches(FakeEncoder):
+            def encode(self, texts, **kwargs):
+                if not isinstance(texts, str):
+                    started.set()
+                    release.wait(5)
+                return super().encode(texts, **kwargs)
+
+        encoder = SlowBatches()
+        batcher = EmbeddingBatcher(encoder, max_batch_size=1, max_wait_ms=0, max_queue_size=1)
+        running = batcher.submit("a")
+        self.assertTrue(started.wait(5))
+        queued = batcher.submit("bb")
+        with self.assertRaises(queue.Full):
+            batcher.submit("x")
+
+        async def main():
+            return await asyncio.wait_for(batcher.aencode("cccc"), timeout=1)
+
+        try:
+            self.assertEqual(asyncio.run(main())[0], 4)
+            self.assertEqual(batcher.encode("ddd")[0], 3)
+        finally:
+            release.set()
+        self.assertEqual(running.result(timeout=5)[0], 1)
+        self.assertEqual(queued.result(timeout=5)[0], 2)
+
+
+class MetricsTests(SimpleTestCase):
+    def test_render_prometheus_text(self):
+        registry = metrics.Registry()
+        registry.counter("test_requests_total", "Requests.", ["status"]).inc(status="ok")
+        registry.histogram("test_latency_seconds", "Latency.", buckets=(0.1, 1.0)).observe(0.5)
+        text = registry.render()
+        self.assertIn('test_requests_total{status="ok"} 1', text)
+        self.assertIn('test_latency_seconds_bucket{le="0.1"} 0', text)
+        self.assertIn('test_latency_seconds_bucket{le="1.0"} 1', text)
+        self.assertIn('test_latency_seconds_bucket{le="+Inf"} 1', text)
+        self.assertIn("test_latency_seconds_count 1", text)
+
+
+class RAGCacheTests(SimpleTestCase):
+    def test_normalize_question(self):
+        self.assertEqual(normalize_question("  Vốn  ĐIỀU lệ là gì?? "), "vốn điều lệ là gì")
+
+    def test_lru_eviction_and_ttl(self):
+        cache = LocalLRUCache(maxsize=2, ttl=0.05)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        time.sleep(0.06)
+        self.assertIsNone(cache.get("a"))
+
+    def test_invalidate_clears_both_layers(self):
+        for backend in ("local", "django"):
+            with self.subTest(backend=backend):
+                cache = RAGCache(backend=backend)
+                cache.set_embedding("Vốn điều lệ?", [0.1, 0.2])
+                cache.set_hits("vốn điều lệ", 5, [("id-1", 0.9)])
+                self.assertEqual(cache.get_embedding("vốn điều lệ"), [0.1, 0.2])
+                self.assertEqual(cache.get_hits("Vốn điều lệ?", 5), [("id-1", 0.9)])
+                cache.invalidate()
+                self.assertIsNone(cache.get_embedding("vốn điều lệ"))
+                self.assertIsNone(cache.get_hits("vốn điều lệ", 5))
+
+
+class SharedRAGCacheInvalidationTests(TestCase):
+    def test_generation_bumped_by_another_process_clears_local_cache(self):
+        cache = RAGCache(backend="local", generation=RAG_CACHE_GENERATION, check_seconds=0)
+        self.assertIsNone(cache.get_embedding("vốn điều lệ"))
+        cache.set_embedding("vốn điều lệ", [0.1, 0.2])
+        self.assertEqual(cache.get_embedding("vốn điều lệ"), [0.1, 0.2])
+        # create_embeddings chạy trong tiến trình khác: chỉ số thế hệ trong PostgreSQL tới được worker này.
+        bump_generation(RAG_CACHE_GENERATION)
+        self.assertIsNone(cache.get_embedding("vốn điều lệ"))
+
+    async def test_async_lookups_check_the_generation_at_most_every_interval(self):
+        cache = RAGCache(backend="local", generation=RAG_CACHE_GENERATION, check_seconds=60)
+        await cache.aset_hits("vốn điều lệ", 5, [("id-1", 0.9)])
+        self.assertEqual(await cache.aget_hits("vốn điều lệ", 5), [("id-1", 0.9)])
+        await sync_to_async(bump_generation)(RAG_CACHE_GENERATION)
+        self.assertEqual(await cache.aget_hits("vốn điều lệ", 5), [("id-1", 0.9)])
+        cache.check_seconds = 0
+        self.assertIsNone(await cache.aget_hits("vốn điều lệ", 5))
+
+
+class SemanticAnswerCacheTests(SimpleTestCase):
+    def test_near_duplicate_question_with_same_provisions_hits(self):
+        cache = SemanticAnswerCache(capacity=4, threshold=0.95)
+        cache.store([1.0, 0.0, 0.0], ["p1", "p2"], ["doc"], "Vốn điều lệ là ...")
+        self.assertEqual(cache.lookup([0.99, 0.05, 0.0], ["p2", "p1"]), "Vốn điều lệ là ...")
+        self.assertIsNone(cache.lookup([0.99, 0.05, 0.0], ["p1", "p3"]))
+        self.assertIsNone(cache.lookup([0.0, 1.0, 0.0], ["p1", "p2"]))
+
+    def test_evicts_least_recently_used_when_full(self):
+        cache = SemanticAnswerCache(capacity=2, threshold=0.99)
+        cache.store([1.0, 0.0], ["a"], ["doc"], "A")
+        cache.store([0.0, 1.0], ["b"], ["doc"], "B")
+        cache.lookup([1.0, 0.0], ["a"])
+        cache.store([-1.0, 0.0], ["c"], ["doc"], "C")
+        self.assertEqual(cache.lookup([1.0, 0.0], ["a"]), "A")
+        self.assertIsNone(cache.lookup([0.0, 1.0], ["b"]))
+        self.assertEqual(len(cache), 2)
+
+    def test_purge_by_document(self):
+        cache = SemanticAnswerCache(capacity=4, threshold=0.99)
+        cache.store([1.0, 0.0], ["a"], ["doc-1"], "A")
+        cache.store([0.0, 1.0], ["b"], ["doc-2"], "B")
+        cache.purge_document("doc-1")
+        self.assertIsNone(cache.lookup([1.0, 0.0], ["a"]))
+        self.assertEqual(cache.lookup([0.0, 1.0], ["b"]), "B")
+
+
+class SharedAnswerCachePurgeTests(TestCase):
+    def test_purge_published_by_another_process_is_applied(self):
+        cache = SemanticAnswerCache(capacity=4, threshold=0.99, shared_purges=True, purge_check_seconds=0)
+        cache.store([1.0, 0.0], ["a"], ["doc-1"], "A")
+        cache.store([0.0, 1.0], ["b"], ["doc-2"], "B")
+        # ingest_law_data chạy trong tiến trình khác: chỉ mốc xoá trong PostgreSQL tới được worker này.
+        purge_document_answers("doc-2")
+        self.assertIsNone(cache.lookup([0.0, 1.0], ["b"]))
+        self.assertEqual(cache.lookup([1.0, 0.0], ["a"]), "A")
+        # Câu trả lời tạo sau mốc xoá (dữ liệu mới) vẫn được dùng.
+        cache.store([0.0, 1.0], ["b"], ["doc-2"], "B mới")
+        self.assertEqual(cache.lookup([0.0, 1.0], ["b"]), "B mới")
+
+    async def test_async_lookup_reads_purges_without_blocking_the_loop(self):
+        cache = SemanticAnswerCache(capacity=4, threshold=0.99, shared_purges=True, purge_check_seconds=0)
+        cache.store([1.0, 0.0], ["a"], ["doc-1"], "A")
+        self.assertEqual(await cache.alookup([1.0, 0.0], ["a"]), "A")
+        await sync_to_async(purge_document_answers)("doc-1")
+        self.assertIsNone(await cache.alookup([1.0, 0.0], ["a"]))
+
+
+class FakeCrossEncoder:
+    """Điểm = số lần từ "vốn" xuất hiện trong nội dung; có thể chậm để thử ngân sách thời gian."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.pairs = 0
+
+    def predict(self, pairs, batch_size=32, show_progress_bar=False):
+        time.sleep(self.delay)
+        self.pairs += len(pairs)
+        return [text.count("vốn") for _, text in pairs]
+
+
+class FakeArtifactModel(ArtifactEmbeddingModel):
+    """Token = độ dài từng từ; hidden state = token id lặp lại trên 2 chiều."""
+
+    def __init__(self, pooling="mean", normalize=False):
+        self.config = {"pooling": pooling, "normalize": normalize, "dimension": 2, "max_seq_length": 8}
+        self.batches = []
+
+    def _tokenize(self, texts):
+        rows = [[len(word) for word in text.split()] for text in texts]
+        width = max(len(row) for row in rows)
+        ids = np.array([row + [0] * (width - len(row)) for row in rows], dtype=np.int64)
+        return ids, (ids > 0).astype(np.int64)
+
+    def _forward(self, input_ids, attention_mask):
+        self.batches.append(len(input_ids))
+        return np.repeat(input_ids[..., None].astype(np.float32), 2, axis=2)
+
+
+class ArtifactEmbeddingModelTests(SimpleTestCase):
+    def test_mean_pooling_ignores_padding_and_keeps_input_order(self):
+        model = FakeArtifactModel()
+        vectors = model.encode(["a bbb", "cc", "dddd e ff"], batch_size=2)
+        np.testing.assert_allclose(vectors[:, 0], [2.0, 2.0, 7 / 3], rtol=1e-6)
+        self.assertEqual(model.batches, [2, 1])
+        self.assertEqual(model.encode("cc").shape, (2,))
+
+    def test_cls_pooling_with_normalization(self):
+        vector = FakeArtifactModel("cls", normalize=True).encode("ccc d")
+        np.testing.assert_allclose(vector, [2 ** -0.5, 2 ** -0.5], rtol=1e-6)
+
+
+class RerankerTests(SimpleTestCase):
+    def provisions(self):
+        contents = ["Phạm vi điều chỉnh.", "Vốn điều lệ; vốn góp; vốn pháp định.", "Góp vốn."]
+        return [
+            SimpleNamespace(id=i, article_number=i, article_title="", provision_id=None, content=content)
+            for i, content in enumerate(contents)
+        ]
+
+    def test_keeps_top_k_by_cross_encoder_score_and_caches_pairs(self):
+        model = FakeCrossEncoder()
+        reranker = Reranker(model, top_k=2, budget_ms=1000)
+        self.assertEqual([p.id for p in reranker.rerank("Vốn là gì?", self.provisions())], [1, 2])
+        self.assertEqual([p.id for p in reranker.rerank("vốn là gì", self.provisions())], [1, 2])
+        self.assertEqual(model.pairs, 3)
+
+    def test_falls_back_to_retrieval_order_when_over_budget(self):
+        reranker = Reranker(FakeCrossEncoder(delay=0.2), top_k=2, budget_ms=10)
+        timeouts = RERANK_REQUESTS.value(result="timeout")
+        self.assertEqual([p.id for p in reranker.rerank("Vốn là gì?", self.provisions())], [0, 1])
+        self.assertEqual(RERANK_REQUESTS.value(result="timeout"), timeouts + 1)
+
+    def test_concurrent_requests_queue_for_the_scorer_within_budget(self):
+        model = FakeCrossEncoder(delay=0.05)
+        reranker = Reranker(model, top_k=2, budget_ms=1000)
+        busy = RERANK_REQUESTS.value(result="busy")
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            results = list(pool.map(lambda q: reranker.rerank(q, self.provisions()), ["Vốn?", "Góp vốn?", "Vốn góp?"]))
+        self.assertEqual([[p.id for p in ranked] for ranked in results], [[1, 2]] * 3)
+        self.assertEqual(RERANK_REQUESTS.value(result="busy"), busy)
+
+    def test_queued_request_past_its_budget_is_skipped(self):
+        model = FakeCrossEncoder(delay=0.1)
+        reranker = Reranker(model, top_k=2, budget_ms=30, max_queue=1)
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            first = pool.submit(reranker.rerank, "Vốn?", self.provisions())
+            time.sleep(0.01)
+            busy = RERANK_REQUESTS.value(result="busy")
+            self.assertEqual([p.id for p in reranker.rerank("Góp vốn?", self.provisions())], [0, 1])
+            self.assertEqual(RERANK_REQUESTS.value(result="busy"), busy + 1)
+            first.result()
+        reranker = Reranker(model, top_k=2, budget_ms=30)
+        reranker.rerank("Vốn?", self.provisions())
+        reranker.rerank("Góp vốn?", self.provisions())
+        time.sleep(0.25)
+        # Lượt thứ hai tới phiên sau khi người gọi đã hết ngân sách nên không được chấm.
+        self.assertEqual(model.pairs, 6)
+
+
+class ContextBuilderTests(SimpleTestCase):
+    def provision(self, article, provision_id, content):
+        return SimpleNamespace(
+            id=f"{article}-{provision_id}", document_id="doc", chapter_info="Chương I", section_info=None,
+            article_number=article, article_title=f"Tiêu đề {article}", provision_id=provision_id, content=content,
+        )
+
+    def test_merges_siblings_and_drops_duplicates(self):
+        provisions = [
+            self.provision(4, "3", "Khoản ba. a) Điểm a."),
+            self.provision(7, "1", "Điều khác."),
+            self.provision(4, "1", "Khoản một."),
+            self.provision(4, "3.a", "Điểm a."),
+            self.provision(4, "1", "Khoản một."),
+        ]
+        prompt = ContextBuilder(token_budget=10000).build("Câu hỏi?", provisions)
+
+        self.assertEqual([p.id for p in prompt.provisions], ["4-3", "7-1", "4-1"])
+        self.assertEqual(prompt.text.count("[Điều 4. Tiêu đề 4 (Chương I)]"), 1)
+        self.assertLess(prompt.text.index("Khoản 1: Khoản một."), prompt.text.index("[Điều 7."))
+        self.assertEqual(prompt.tokens, count_tokens(prompt.text))
+
+    def test_trims_lowest_ranked_chunks_to_fit_budget(self):
+        provisions = [self.provision(i, "1", " ".join(["từ"] * 50)) for i in range(1, 6)]
+        builder = ContextBuilder(token_budget=10000)
+        full = builder.build("Câu hỏi?", provisions)
+
+        builder.token_budget = full.tokens - 10
+        trimmed = builder.build("Câu hỏi?", provisions)
+        self.assertEqual([p.article_number for p in trimmed.provisions], [1, 2, 3, 4])
+        self.assertLessEqual(trimmed.tokens, builder.token_budget)
+
+        builder.token_budget = 0
+        self.assertEqual([p.article_number for p in builder.build("Câu hỏi?", provisions).provisions], [1])
+
+
+class LLMGatewayTests(SimpleTestCase):
+    def test_retries_transient_errors_then_opens_breaker(self):
+        client = StubProvider(latency_ms=0, failure_rate=1.0)
+        gateway = LLMGateway(client, retries=1, retry_base=0.001, breaker=CircuitBreaker(failure_threshold=2, reset_seconds=60))
+        with self.assertRaises(StubProvider.ServiceUnavailable):
+            gateway.generate("câu hỏi")
+        self.assertEqual(client.calls, 2)
+        self.assertEqual(gateway.breaker.state, "open")
+        with self.assertRaises(CircuitOpen):
+            gateway.generate("câu hỏi")
+        self.assertEqual(client.calls, 2)
+
+    def test_half_open_breaker_closes_after_a_successful_trial(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0.01)
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        time.sleep(0.02)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+
+    def test_call_over_deadline_times_out(self):
+        gateway = LLMGateway(StubProvider(latency_ms=200), timeout=0.05, deadline=0.05, retries=0)
+        with self.assertRaises(LLMTimeout):
+            gateway.generate("câu hỏi")
+
+    def test_hedged_request_wins_over_slow_primary(self):
+        client = StubProvider(latency_ms=0)
+        gateway = LLMGateway(client, hedge=True, hedge_min_ms=20, timeout=5)
+        for _ in range(20):
+            gateway.latencies.observe(0.001)
+        delays = iter([0.5, 0.0])
+        with mock.patch.object(client, "_delay", lambda: next(delays)):
+            started = time.perf_counter()
+            self.assertEqual(gateway.generate('Câu hỏi: "Vốn là gì?"'), "(Trả lời giả lập từ stub) Vốn là gì?")
+        self.assertLess(time.perf_counter() - started, 0.4)
+        self.assertEqual(client.calls, 1)
+
+    def test_cancelled_waiter_does_not_leak_a_slot(self):
+        gateway = LLMGateway(StubProvider(latency_ms=0), max_concurrency=1, timeout=5)
+        gateway._slots.acquire()
+
+        async def run():
+            waiter = asyncio.ensure_future(gateway.agenerate("câu hỏi"))
+            await asyncio.sleep(0.05)
+            waiter.cancel()
+            gateway._slots.release()
+            await asyncio.sleep(0.1)
+            return await gateway.agenerate('Câu hỏi: "Vốn?"')
+
+        self.assertEqual(asyncio.run(run()), "(Trả lời giả lập từ stub) Vốn?")
+        self.assertEqual(gateway._slots._value, 1)
+
+    def test_queued_async_calls_do_not_occupy_the_default_executor(self):
+        gateway = LLMGateway(StubProvider(latency_ms=100, jitter_ms=0), max_concurrency=2, timeout=5)
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            executor = ThreadPoolExecutor(max_workers=2)
+            loop.set_default_executor(executor)
+            calls = [asyncio.ensure_future(gateway.agenerate(f'Câu hỏi: "{i}"')) for i in range(8)]
+            await asyncio.sleep(0.02)
+            started = time.perf_counter()
+            await asyncio.gather(*(asyncio.to_thread(lambda: None) for _ in range(4)))
+            unblocked = time.perf_counter() - started
+            answers = await asyncio.gather(*calls)
+            executor.shutdown()
+            return unblocked, answers
+
+        unblocked, answers = asyncio.run(run())
+        self.assertLess(unblocked, 0.1)
+        self.assertEqual(len(answers), 8)
+        self.assertEqual(gateway._slots._value, 2)
+
+    def test_stream_yields_all_chunks_and_records_tokens(self):
+        provider = StubProvider(model="stub-stream", mode="template", template="{question}: {prompt_tokens}", latency_ms=0)
+        async def collect():
+            return [text async for text in LLMGateway(provider).astream('Ngữ cảnh. Câu hỏi: "Vốn?"')]
+        self.assertEqual("".join(asyncio.run(collect())), "Vốn?: 10")
+        self.assertEqual(PROVIDER_TOKENS.value(provider="stub", model="stub-stream", kind="prompt"), 10)
+
+    def test_router_sends_lookups_and_short_prompts_to_fast_model(self):
+        router = LLMRouter({"pro": "pro", "fast": "fast"}, fast_max_tokens=100)
+        self.assertEqual(router.route(50, "general"), "fast")
+        self.assertEqual(router.route(500, "general"), "pro")
+        self.assertEqual(router.route(500, "lookup"), "fast")
+        self.assertEqual(LLMRouter({"pro": "pro"}, fast_max_tokens=100).route(50, "lookup"), "pro")
+
+
+class FakeQdrant:
+    def __init__(self, hits, payloads=None):
+        self.hits = hits
+        self.payloads = payloads or {}
+        self.calls = 0
+
+    def query_points(self, **kwargs):
+        self.calls += 1
+        return SimpleNamespace(points=[
+            SimpleNamespace(id=hit_id, score=score, payload=self.payloads.get(hit_id))
+            for hit_id, score in self.hits
+        ])
+
+
+class FakeGemini(LLMProvider):
+    name = "fake"
+
+    def __init__(self, text="Câu trả lời."):
+        super().__init__("gemini-test")
+        self.text = text
+        self.prompts = []
+
+    def _complete(self, prompt):
+        self.prompts.append(prompt)
+        return Completion(self.text, 10, 3)
+
+
+class ChatbotAPIViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.document = LawDocument.objects.create(title="Luật Doanh nghiệp", source_file="luat.txt")
+        cls.provisions = [
+            LawProvision.objects.create(
+                document=cls.document, chapter_info="Chương I QUY ĐỊNH CHUNG", article_number=4,
+                article_title="Giải thích từ ngữ", provision_id=str(i), content=f"Nội dung khoản {i}."
+            )
+            for i in range(1, 4)
+        ]
+
+    def setUp(self):
+        # Qdrant ranks clause 3 above clause 1; Postgres would return them in the opposite order.
+        self.qdrant = FakeQdrant([(str(self.provisions[2].id), 0.9), (str(self.provisions[0].id), 0.7)])
+        self.gemini = FakeGemini()
+        self.enterContext(services.override(
+            vector_store=QdrantVectorStore(client=self.qdrant), llm=LLMRouter({"pro": LLMGateway(self.gemini)}),
+            embedding_model=FakeEncoder(), embedding_batcher=None, lexical_index=None, article_index=None, reranker=None,
+        ))
+        patches = [
+            mock.patch.object(views, "rag_cache", RAGCache(backend="local")),
+            mock.patch.object(views, "answer_cache", None),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def ask(self, question):
+        return self.client.post(
+            reverse("chatbot_ask"), data=json.dumps({"question": question}), content_type="application/json"
+        )
+
+    def test_hydrates_sources_in_one_query_and_rank_order(self):
+        with self.assertNumQueries(1):
+            response = self.ask("Vốn điều lệ là gì?")
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["answer"], "Câu trả lời.")
+        self.assertEqual([s["provision"] for s in data["sources"]], ["3", "1"])
+        self.assertEqual([s["score"] for s in data["sources"]], [0.9, 0.7])
+        self.assertEqual(data["sources"][0]["document"], "Luật Doanh nghiệp")
+        self.assertEqual(data["metadata"]["context_provisions"], 2)
+        self.assertGreater(data["metadata"]["prompt_tokens"], 0)
+        self.assertEqual(data["metadata"]["model"], "fake:gemini-test")
+
+        prompt = self.gemini.prompts[0]
+        self.assertLess(prompt.index("Nội dung khoản 3."), prompt.index("Nội dung khoản 1."))
+
+    def test_stage_timings_in_server_timing_header_and_metrics(self):
+        response = self.ask("Vốn điều lệ là gì?")
+        stages = [part.split(";")[0] for part in response["Server-Timing"].split(", ")]
+        self.assertEqual(stages, ["parse", "embed", "vector_search", "expand", "hydrate", "prompt", "llm", "serialize", "total"])
+
+        text = self.client.get("/metrics").content.decode()
+        self.assertIn('chatbot_stage_seconds_count{stage="llm"}', text)
+        self.assertIn('chatbot_requests_total{view="ask",status="200"}', text)
+
+    def test_full_payloads_skip_postgres(self):
+        self.qdrant.payloads = {
+            str(p.id): provision_payload(p, "full") for p in [self.provisions[2], self.provisions[0]]
+        }
+        with self.assertNumQueries(0):
+            response = self.ask("Vốn điều lệ là gì?")
+
+        data = response.json()
+        self.assertEqual([s["provision"] for s in data["sources"]], ["3", "1"])
+        self.assertEqual(data["sources"][0]["document"], "Luật Doanh nghiệp")
+        self.assertIn("Nội dung khoản 3.", self.gemini.prompts[0])
+
+    def test_stale_payloads_fall_back_to_postgres(self):
+        stale = provision_payload(self.provisions[2], "full")
+        stale["payload_version"] = PAYLOAD_VERSION - 1
+        self.qdrant.payloads = {str(self.provisions[2].id): stale}
+        with self.assertNumQueries(1):
+            response = self.ask("Vốn điều lệ là gì?")
+        self.assertEqual([s["provision"] for s in response.json()["sources"]], ["3", "1"])
+
+    def test_expanded_article_is_hydrated_in_the_same_query(self):
+        index = ArticleIndex(mode="article")
+        index.snapshot()
+        with services.override(article_index=index), self.assertNumQueries(1):
+            response = self.ask("Vốn điều lệ là gì?")
+        self.assertEqual([s["provision"] for s in response.json()["sources"]], ["3", "1", "2"])
+        self.assertEqual(response.json()["sources"][2]["score"], None)
+
+    def test_article_reference_is_answered_without_embedding(self):
+        index = LexicalIndex()
+        index.snapshot()
+        with services.override(lexical_index=index, embedding_model=None):
+            response = self.ask("Khoản 2 Điều 4 quy định gì?")
+        self.assertEqual([s["provision"] for s in response.json()["sources"]], ["2"])
+        self.assertEqual(self.qdrant.calls, 0)
+
+    def test_open_breaker_returns_sources_only_answer(self):
+        gateway = LLMGateway(self.gemini, breaker=CircuitBreaker(failure_threshold=1))
+        gateway.breaker.record_failure()
+        with services.override(llm=LLMRouter({"pro": gateway})):
+            data = self.ask("Vốn điều lệ là gì?").json()
+        self.assertEqual(self.gemini.prompts, [])
+        self.assertIn("Điều 4, Khoản 3", data["answer"])
+        self.assertEqual(len(data["sources"]), 2)
+
+    def test_batch_shares_one_encode_and_one_hydration_query(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        store = LocalVectorStore(tmp.name)
+        store.ensure_collection(4)
+        store.upsert([
+            VectorPoint(str(self.provisions[2].id), [1.0, 1.0, 1.0, 1.0], {}),
+            VectorPoint(str(self.provisions[0].id), [1.0, 0.0, 0.0, 0.0], {}),
+        ])
+        store.commit()
+        encoder = FakeEncoder()
+        questions = ["Vốn điều lệ là gì?", "", "Bản sao là gì?"]
+        with services.override(vector_store=store, embedding_model=encoder), self.assertNumQueries(1):
+            response = self.client.post(
+                reverse("chatbot_ask_batch"), data=json.dumps({"questions": questions}), content_type="application/json"
+            )
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(encoder.calls, [2])
+        self.assertEqual([r["index"] for r in data["results"]], [0, 1, 2])
+        self.assertIn("error", data["results"][1])
+        self.assertEqual(data["results"][2]["question"], "Bản sao là gì?")
+        self.assertEqual([s["provision"] for s in data["results"][2]["sources"]], ["3", "1"])
+        self.assertEqual(data["metadata"], {"questions": 3, "errors": 1})
+        self.assertEqual(len(self.gemini.prompts), 2)
+
+        too_many = {"questions": ["x"] * (views.BATCH_MAX_QUESTIONS + 1)}
+        response = self.client.post(reverse("chatbot_ask_batch"), data=json.dumps(too_many), content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_on_qdrant_reranks_in_one_pass_and_fills_answer_cache(self):
+        store = QdrantVectorStore(client=QdrantClient(":memory:"), collection="test")
+        store.ensure_collection(4)
+        store.upsert([
+            VectorPoint(self.provisions[2].id, [1.0, 1.0, 1.0, 1.0], {}),
+            VectorPoint(self.provisions[0].id, [1.0, 0.0, 0.0, 0.0], {}),
+        ])
+        cross_encoder = FakeCrossEncoder()
+        cache = SemanticAnswerCache(capacity=8)
+        reranked = RERANK_REQUESTS.value(result="ok")
+        questions = {"questions": ["Vốn điều lệ là gì?", "Bản sao là gì?"]}
+
+        def ask_batch():
+            return self.client.post(reverse("chatbot_ask_batch"), data=json.dumps(questions), content_type="application/json")
+
+        with services.override(vector_store=store, reranker=Reranker(cross_encoder, top_k=2, budget_ms=1000)), \
+                mock.patch.object(views, "answer_cache", cache):
+            data = ask_batch().json()
+            self.assertEqual([[s["provision"] for s in r["sources"]] for r in data["results"]], [["3", "1"]] * 2)
+            self.assertEqual(cross_encoder.pairs, 4)
+            self.assertEqual(RERANK_REQUESTS.value(result="ok"), reranked + 2)
+            self.assertEqual(len(self.gemini.prompts), 2)
+            self.assertGreater(len(cache), 0)
+
+            ask_batch()
+        self.assertEqual(len(self.gemini.prompts), 2)
+
+    def test_missing_question_is_rejected(self):
+        response = self.client.post(reverse("chatbot_ask"), data="{}", content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_unavailable_service_returns_503(self):
+        broken = ServiceRegistry()
+        broken.register("llm", mock.Mock(side_effect=ValueError("thiếu khoá")))
+        broken.register("reranker", lambda: None, required=False)
+        with mock.patch.object(views, "services", broken):
+            response = self.ask("Vốn điều lệ là gì?")
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("llm", response.json()["error"])
+
+
+class FakeStreamingProvider(LLMProvider):
+    name = "fake"
+
+    def __init__(self, chunks=("Câu ", "trả lời."), error=None):
+        super().__init__("gemini-test")
+        self.chunks = chunks
+        self.error = error
+
+    async def _astream(self, prompt):
+        for chunk in self.chunks:
+            yield chunk, None
+        if self.error is not None:
+            raise self.error
+        yield "", Completion("", 10, 3)
+
+
+class ChatbotStreamAPIViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        document = LawDocument.objects.create(title="Luật Doanh nghiệp", source_file="luat.txt")
+        cls.provisions = [
+            LawProvision.objects.create(
+                document=document, article_number=4, article_title="Giải thích từ ngữ", provision_id=str(i),
+                content=f"Nội dung khoản {i}."
+            )
+            for i in range(1, 3)
+        ]
+
+    def setUp(self):
+        self.enterContext(services.override(
+            vector_store=QdrantVectorStore(client=FakeQdrant([(str(p.id), 0.9) for p in self.provisions])),
+            llm=LLMRouter({"pro": LLMGateway(FakeStreamingProvider())}), embedding_model=FakeEncoder(),
+            embedding_batcher=None, lexical_index=None, article_index=None, reranker=None,
+        ))
+        patches = [
+            mock.patch.object(views, "rag_cache", RAGCache(backend="local")),
+            mock.patch.object(views, "answer_cache", None),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def ask_stream(self, body):
+        response = await self.async_client.post(
+            reverse("chatbot_ask_stream"), data=json.dumps(body), content_type="application/json"
+        )
+        if not response.streaming:
+            return response, []
+        text = "".join([chunk.decode() async for chunk in response.streaming_content])
+        events = []
+        for block in text.strip().split("\n\n"):
+            event, data = block.split("\n")
+            events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+        return response, events
+
+    async def test_streams_sources_then_tokens_then_done(self):
+        response, events = await self.ask_stream({"question": "Vốn điều lệ là gì?"})
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertEqual([event for event, _ in events], ["sources", "token", "token", "done"])
+        self.assertEqual([s["provision"] for s in events[0][1]["sources"]], ["1", "2"])
+        self.assertEqual("".join(data["text"] for event, data in events if event == "token"), "Câu trả lời.")
+        self.assertEqual(events[-1][1]["answer"], "Câu trả lời.")
+        self.assertEqual(events[-1][1]["metadata"]["model"], "fake:gemini-test")
+
+    async def test_open_breaker_ends_with_sources_only_done(self):
+        gateway = LLMGateway(FakeStreamingProvider(), breaker=CircuitBreaker(failure_threshold=1))
+        gateway.breaker.record_failure()
+        with services.override(llm=LLMRouter({"pro": gateway})):
+            _, events = await self.ask_stream({"question": "Vốn điều lệ là gì?"})
+        self.assertEqual([event for event, _ in events], ["sources", "done"])
+        self.assertIn("Điều 4, Khoản 1", events[-1][1]["answer"])
+        self.assertNotIn("fallback", events[-1][1])
+
+    async def test_llm_error_after_partial_answer_ends_with_error_event(self):
+        provider = FakeStreamingProvider(chunks=("Câu ",), error=RuntimeError("boom"))
+        with services.override(llm=LLMRouter({"pro": LLMGateway(provider, retries=0)})):
+            _, events = await self.ask_stream({"question": "Vốn điều lệ là gì?"})
+        self.assertEqual([event for event, _ in events], ["sources", "token", "error"])
+        self.assertEqual(events[1][1], {"text": "Câu "})
+
+    async def test_missing_question_and_unavailable_service(self):
+        response, _ = await self.ask_stream({})
+        self.assertEqual(response.status_code, 400)
+
+        broken = ServiceRegistry()
+        broken.register("llm", mock.Mock(side_effect=ValueError("thiếu khoá")))
+        with mock.patch.object(views, "services", broken):
+            response, _ = await self.ask_stream({"question": "Vốn điều lệ là gì?"})
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("llm", json.loads(response.content)["error"])
+
+
+class CoalescingTests(SimpleTestCase):
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.005)
+
+    def test_identical_concurrent_calls_share_one_computation(self):
+        flight = SingleFlight()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.02)
+            return {"answer": "Một lần.", "metadata": {}}
+
+        key = flight_key("Vốn điều lệ là gì?", [3, 1], "general")
+        self.assertEqual(key, flight_key("  vốn điều lệ là gì ", [3, 1], "general"))
+
+        async def run():
+            leader = asyncio.ensure_future(flight.do(key, compute))
+            await asyncio.sleep(0)
+            leader.cancel()  # client của request dẫn đầu ngắt kết nối
+            return await asyncio.gather(*(flight.do(key, compute) for _ in range(3)))
+
+        results = asyncio.run(run())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([r["answer"] for r in results], ["Một lần."] * 3)
+
+    def test_stream_followers_replay_one_generation(self):
+        flight = StreamFlight()
+        calls = []
+
+        async def generate():
+            calls.append(1)
+            for text in ("Vốn ", "điều ", "lệ."):
+                await asyncio.sleep(0.01)
+                yield "token", {"text": text}
+            yield "done", {"answer": "Vốn điều lệ.", "metadata": {}}
+
+        async def consume(delay):
+            await asyncio.sleep(delay)
+            return [event async for event in flight.stream("k", generate)]
+
+        async def run():
+            return await asyncio.gather(consume(0), consume(0.015), consume(0.015))
+
+        first, *others = asyncio.run(run())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(first), 4)
+        self.assertEqual(others, [first, first])
+
+    def test_worker_without_the_shared_lock_waits_for_the_published_result(self):
+        shared = SharedFlightLock(wait=5, poll_ms=5)
+        key = flight_key("Bản sao là gì?", [1])
+        self.addCleanup(shared.cache.clear)
+
+        async def run():
+            acquired, token = await shared.aacquire(key)  # một worker khác đang sinh câu trả lời
+            self.assertTrue(acquired)
+            waiting = asyncio.ensure_future(SingleFlight(shared).do(key, self.fail))
+            await asyncio.sleep(0.02)
+            await shared.apublish(key, token, {"answer": "Từ worker khác.", "metadata": {}})
+            return await waiting, (await shared.aacquire(key))[0]
+
+        result, reacquired = asyncio.run(run())
+        self.assertEqual(result["answer"], "Từ worker khác.")
+        self.assertTrue(reacquired)
+
+    def test_stale_and_fallback_results_are_not_shared(self):
+        shared = SharedFlightLock(wait=5, poll_ms=5)
+        key = flight_key("Bản sao là gì?", [1])
+        self.addCleanup(shared.cache.clear)
+
+        async def compute():
+            return {"answer": "Tự tính.", "metadata": {}}
+
+        async def run():
+            _, previous = await shared.aacquire(key)
+            await shared.apublish(key, previous, {"answer": "Của lượt trước.", "metadata": {}})
+            _, token = await shared.aacquire(key)
+            waiting = asyncio.ensure_future(SingleFlight(shared).do(key, compute))
+            await asyncio.sleep(0.02)
+            self.assertFalse(waiting.done())
+            await shared.apublish(key, token, {"answer": "Dự phòng.", "metadata": {}, "fallback": True})
+            return await waiting
+
+        fallbacks = COALESCE_REQUESTS.value(mode="ask", role="fallback")
+        self.assertEqual(asyncio.run(run())["answer"], "Tự tính.")
+        self.assertEqual(COALESCE_REQUESTS.value(mode="ask", role="fallback"), fallbacks + 1)
+
+
+class ServiceRegistryTests(SimpleTestCase):
+    def test_failed_service_is_retried_after_backoff(self):
+        factory = mock.Mock(side_effect=[RuntimeError("boom"), "model"])
+        service = Service("model", factory, retry_base=0.05)
+
+        with self.assertRaises(ServiceUnavailable):
+            service.get()
+        self.assertEqual(service.status()["state"], "failed")
+        # Còn trong thời gian chờ: không gọi lại factory.
+        with self.assertRaises(ServiceUnavailable):
+            service.get()
+        self.assertEqual(factory.call_count, 1)
+
+        time.sleep(0.07)
+        self.assertEqual(service.get(), "model")
+        self.assertEqual(service.status()["attempts"], 2)
+
+    def test_optional_service_degrades_to_none(self):
+        registry = ServiceRegistry()
+        registry.register("reranker", mock.Mock(side_effect=RuntimeError("boom")), required=False)
+        self.assertIsNone(registry.get("reranker"))
+        self.assertTrue(registry.ready)
+
+    def test_preload_loads_only_named_services(self):
+        registry = ServiceRegistry()
+        model_factory, client_factory = mock.Mock(return_value="model"), mock.Mock(return_value="client")
+        registry.register("embedding_model", model_factory)
+        registry.register("llm", client_factory)
+
+        self.assertTrue(registry.preload("embedding_model"))
+        model_factory.assert_called_once()
+        client_factory.assert_not_called()
+        self.assertEqual(registry.status()["llm"]["state"], "pending")
+
+    def test_readiness_probe_reports_pending_services(self):
+        registry = ServiceRegistry()
+        registry.register("vector_store", lambda: object())
+        with mock.patch.object(views, "services", registry):
+            self.assertEqual(self.client.get("/healthz").status_code, 200)
+            response = self.client.get("/readyz")
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.json()["services"]["vector_store"]["state"], "pending")
+            registry.get("vector_store")
+            self.assertEqual(self.client.get("/readyz").status_code, 200)
+
+
+class InMemoryQdrant:
+    """Đủ API của QdrantClient cho create_embeddings."""
+
+    def __init__(self, *args, **kwargs):
+        self.points = {}
+        self.deleted = []
+
+    def get_collections(self):
+        return []
+
+    def get_collection(self, collection_name):
+        return {}
+
+    def scroll(self, collection_name, limit, offset=None, with_payload=True, with_vectors=False):
+        start = offset or 0
+        ids = sorted(self.points)[start:start + limit]
+        points = [SimpleNamespace(id=i, payload=self.points[i]["payload"]) for i in ids]
+        return points, (start + limit if start + limit < len(self.points) else None)
+
+    def upsert(self, collection_name, points, wait=True):
+        for point in points:
+            self.points[point.id] = {"vector": point.vector, "payload": point.payload}
+
+    def delete(self, collection_name, points_selector, wait=True):
+        for point_id in points_selector.points:
+            self.deleted.append(point_id)
+            self.points.pop(point_id, None)
+
+
+class CreateEmbeddingsTests(TestCase):
+    def setUp(self):
+        document = LawDocument.objects.create(title="Luật Doanh nghiệp", source_file="luat.txt")
+        self.provisions = [
+            LawProvision.objects.create(
+                document=document, article_number=i, article_title=f"Điều {i}", provision_id="1", content=f"Nội dung {i}."
+            )
+            for i in range(1, 4)
+        ]
+        self.qdrant = InMemoryQdrant()
+        self.encoder = FakeEncoder()
+        self.encoder.get_sentence_embedding_dimension = lambda: 4
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.index_dir = tmp.name
+        module = "chatbot.management.commands.create_embeddings"
+        for patcher in [
+            mock.patch("chatbot.vectorstore.QdrantClient", return_value=self.qdrant),
+            mock.patch("chatbot.vectorstore.AsyncQdrantClient"),
+            mock.patch("chatbot.vectorstore.LOCAL_INDEX_DIR", self.index_dir),
+            mock.patch(f"{module}.get_embedding_model", return_value=self.encoder),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def run_command(self, *args):
+        call_command("create_embeddings", *args, stdout=mock.MagicMock())
+
+    def test_only_new_or_changed_provisions_are_reencoded(self):
+        self.run_command("--batch-size", "2")
+        self.assertEqual(self.encoder.calls, [2, 1])
+        self.assertEqual(len(self.qdrant.points), 3)
+        self.assertTrue(all(p.embedding_hash for p in LawProvision.objects.all()))
+
+        self.run_command()
+        self.assertEqual(sum(self.encoder.calls), 3)
+
+        changed, removed = self.provisions[0], self.provisions[2]
+        changed.content = "Nội dung đã sửa đổi."
+        changed.save()
+        removed_id = str(removed.id)
+        removed.delete()
+        self.run_command()
+        self.assertEqual(sum(self.encoder.calls), 4)
+        self.assertEqual(self.qdrant.deleted, [removed_id])
+        self.assertEqual(sorted(self.qdrant.points), sorted(str(p.id) for p in LawProvision.objects.all()))
+
+        self.run_command("--full")
+        self.assertEqual(sum(self.encoder.calls), 6)
+
+    def test_switching_to_full_payloads_rewrites_points(self):
+        self.run_command()
+        self.run_command("--payload-mode", "full")
+        self.assertEqual(sum(self.encoder.calls), 6)
+        payload = next(iter(self.qdrant.points.values()))["payload"]
+        self.assertEqual(payload["payload_version"], PAYLOAD_VERSION)
+
+    def test_metadata_only_changes_rewrite_full_payloads(self):
+        self.run_command("--payload-mode", "full")
+        self.run_command("--payload-mode", "full")
+        self.assertEqual(sum(self.encoder.calls), 3)
+
+        # Tiêu đề văn bản và Chương không nằm trong đoạn văn bản đã encode nhưng có trong payload full.
+        LawDocument.objects.update(title="Luật Doanh nghiệp 2020")
+        LawProvision.objects.filter(id=self.provisions[0].id).update(chapter_info="Chương II")
+        self.run_command("--payload-mode", "full")
+        self.assertEqual(sum(self.encoder.calls), 6)
+        payload = self.qdrant.points[str(self.provisions[0].id)]["payload"]
+        self.assertEqual((payload["document_title"], payload["chapter_info"]), ("Luật Doanh nghiệp 2020", "Chương II"))
+
+    def test_switching_back_to_minimal_drops_full_payloads(self):
+        self.run_command("--payload-mode", "full")
+        self.run_command()
+        self.assertEqual(sum(self.encoder.calls), 6)
+        payload = self.qdrant.points[str(self.provisions[0].id)]["payload"]
+        self.assertNotIn("payload_version", payload)
+        self.assertNotIn("document_title", payload)
+
+        # Payload minimal không mang tiêu đề văn bản nên đổi tiêu đề không cần ghi lại.
+        LawDocument.objects.update(title="Luật Doanh nghiệp (sửa đổi)")
+        self.run_command()
+        self.assertEqual(sum(self.encoder.calls), 6)
+
+    def test_local_backend_indexes_incrementally(self):
+        self.run_command("--backend", "local")
+        self.provisions[2].delete()
+        self.run_command("--backend", "local")
+        self.assertEqual(sum(self.encoder.calls), 3)
+        store = LocalVectorStore(self.index_dir)
+        self.assertEqual(sorted(point_id for point_id, _ in store.scroll()),
+                         sorted(str(p.id) for p in self.provisions[:2]))
+
+
+class LocalVectorStoreTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+
+    def fill(self, dtype):
+        store = LocalVectorStore(self.dir, dtype)
+        store.ensure_collection(3)
+        store.upsert([
+            VectorPoint("a", [1.0, 0.0, 0.0], {"content_hash": "ha"}),
+            VectorPoint("b", [0.6, 0.8, 0.0], {"content_hash": "hb"}),
+            VectorPoint("c", [0.0, 0.0, 5.0], {"content_hash": "hc"}),
+        ])
+        store.commit()
+        return store
+
+    def test_search_returns_cosine_ranked_hits(self):
+        for dtype in ("float32", "int8"):
+            with self.subTest(dtype=dtype):
+                store = self.fill(dtype)
+                hits = store.search(np.array([2.0, 0.1, 0.0]), 2)
+                self.assertEqual([hit.id for hit in hits], ["a", "b"])
+                self.assertAlmostEqual(hits[0].score, 0.9988, places=2)
+                self.assertEqual(hits[1].payload, {"content_hash": "hb"})
+
+    def test_search_batch_matches_single_searches(self):
+        for dtype in ("float32", "int8"):
+            with self.subTest(dtype=dtype):
+                store = self.fill(dtype)
+                queries = [np.array([2.0, 0.1, 0.0]), np.array([0.0, 0.1, 1.0])]
+                batch = store.search_batch(queries, 2)
+                self.assertEqual(
+                    [[hit.id for hit in hits] for hits in batch],
+                    [[hit.id for hit in store.search(q, 2)] for q in queries],
+                )
+
+    def test_int8_search_in_chunks_matches_full_precision(self):
+        store = self.fill("int8")
+        queries = np.array([[2.0, 0.1, 0.0], [0.0, 0.1, 1.0]], dtype=np.float32)
+        snapshot = store.snapshot()
+        np.testing.assert_allclose(snapshot._scores(queries, chunk_rows=2), queries @ snapshot.dense().T, rtol=1e-6)
+
+    def test_int8_commits_keep_unchanged_vectors_bit_exact(self):
+        store = self.fill("int8")
+        before = np.array(store.snapshot().vectors), np.array(store.snapshot().scales)
+        for i in range(3):
+            store.upsert([VectorPoint(f"new-{i}", [0.3, 0.3, 0.9], {})])
+            store.commit()
+        after = store.snapshot()
+        np.testing.assert_array_equal(after.vectors[:3], before[0])
+        np.testing.assert_array_equal(after.scales[:3], before[1])
+
+    def test_commit_is_visible_to_other_readers(self):
+        reader = self.fill("float32")
+        self.assertEqual(len(reader.search([0, 0, 1], 5)), 3)
+        writer = LocalVectorStore(self.dir)
+        writer.delete(["c"])
+        writer.upsert([VectorPoint("a", [0.0, 1.0, 0.0], {"content_hash": "ha2"})])
+        writer.commit()
+        os.utime(reader.manifest_path, ns=(0, time.time_ns() + 1))
+        hits = reader.search([0, 1, 0], 5)
+        self.assertEqual([hit.id for hit in hits], ["a", "b"])
+        self.assertEqual(hits[0].payload, {"content_hash": "ha2"})
+
+
+class QdrantVectorStoreTests(SimpleTestCase):
+    """Chạy trên QdrantClient(":memory:") để bám đúng API của thư viện đã cài, không qua fake."""
+
+    points = [
+        VectorPoint(str(uuid.UUID(int=1)), [1.0, 0.0, 0.0], {"content_hash": "ha"}),
+        VectorPoint(str(uuid.UUID(int=2)), [0.6, 0.8, 0.0], {"content_hash": "hb"}),
+        VectorPoint(str(uuid.UUID(int=3)), [0.0, 0.0, 5.0], {"content_hash": "hc"}),
+    ]
+
+    def test_search_scroll_and_delete_on_the_real_client(self):
+        store = QdrantVectorStore(client=QdrantClient(":memory:"), collection="test")
+        self.assertTrue(store.ensure_collection(3))
+        self.assertFalse(store.ensure_collection(3))
+        store.upsert(self.points)
+
+        hits = store.search(np.array([2.0, 0.1, 0.0]), 2)
+        self.assertEqual([hit.id for hit in hits], [self.points[0].id, self.points[1].id])
+        self.assertAlmostEqual(hits[0].score, 0.9988, places=2)
+        self.assertEqual(hits[1].payload, {"content_hash": "hb"})
+
+        store.delete([self.points[2].id])
+        self.assertEqual(sorted(point_id for point_id, _ in store.scroll()), [self.points[0].id, self.points[1].id])
+
+    def test_batch_search_on_the_real_client(self):
+        client = QdrantClient(":memory:")
+        store = QdrantVectorStore(client=client, collection="test")
+        store.ensure_collection(3)
+        store.upsert(self.points)
+        queries = [np.array([2.0, 0.1, 0.0]), np.array([0.0, 0.1, 1.0])]
+        with mock.patch.object(client, "query_points", side_effect=AssertionError("một request cho cả lô")):
+            batch = store.search_batch(queries, 2)
+        self.assertEqual([[hit.id for hit in hits] for hits in batch], [
+            [self.points[0].id, self.points[1].id], [self.points[2].id, self.points[1].id],
+        ])
+
+    def test_async_search_on_the_real_client(self):
+        async def run():
+            client = AsyncQdrantClient(":memory:")
+            await client.create_collection(
+                "test", vectors_config=qdrant_models.VectorParams(size=3, distance=qdrant_models.Distance.COSINE)
+            )
+            await client.upsert("test", points=[
+                qdrant_models.PointStruct(id=p.id, vector=p.vector, payload=p.payload) for p in self.points
+            ])
+            store = QdrantVectorStore(client=QdrantClient(":memory:"), async_client=client, collection="test")
+            return await store.asearch([0.0, 0.1, 1.0], 1), await store.asearch_batch([[1.0, 0.0, 0.0]], 1)
+
+        hits, batch = asyncio.run(run())
+        self.assertEqual([hit.id for hit in hits], [self.points[2].id])
+        self.assertEqual([[hit.id for hit in hits] for hits in batch], [[self.points[0].id]])
+
+
+SAMPLE_LAW_TEXT = """QUỐC HỘI
+LUẬT DOANH NGHIỆP
+Chương I
+QUY ĐỊNH CHUNG
+Điều 1. Phạm vi điều chỉnh
+Luật này quy định về việc thành lập, tổ chức quản lý doanh nghiệp.
+Điều 4. Giải thích từ ngữ
+1. Bản sao là giấy tờ được sao từ sổ gốc.
+34. Vốn điều lệ là tổng giá trị tài sản do các thành viên công ty đã góp.
+Chương II
+THÀNH LẬP DOANH NGHIỆP
+Mục 1
+ĐĂNG KÝ DOANH NGHIỆP
+Điều 17. Quyền thành lập
+1. Tổ chức, cá nhân có quyền thành lập doanh nghiệp, trừ các trường hợp sau:
+a) Cơ quan nhà nước sử dụng tài sản nhà nước;
+b) Cán bộ, công chức, viên chức;
+2. Tổ chức, cá nhân có quyền góp vốn.
+"""
+
+
+class LawParserTests(SimpleTestCase):
+    def parse(self, text):
+        return {(p["article_number"], p["provision_id"]): p for p in parse_law_lines(text.splitlines(True))}
+
+    def test_parses_hierarchy_and_skips_document_header(self):
+        provisions = self.parse(SAMPLE_LAW_TEXT)
+        self.assertEqual(
+            list(provisions),
+            [(1, None), (4, "1"), (4, "34"), (17, "1"), (17, "1.a"), (17, "1.b"), (17, "2")],
+        )
+        self.assertEqual(provisions[(1, None)]["chapter_info"], "Chương I QUY ĐỊNH CHUNG")
+        self.assertEqual(provisions[(4, "1")]["section_info"], "")
+        self.assertEqual(provisions[(17, "1.b")]["section_info"], "Mục 1 ĐĂNG KÝ DOANH NGHIỆP")
+        self.assertEqual(provisions[(17, "1.b")]["content"], "Cán bộ, công chức, viên chức;")
+
+    def test_continuation_lines_join_the_open_provision(self):
+        provisions = self.parse("\ufeffĐiều 2. Đối tượng áp dụng\n1. Doanh nghiệp[1]\n   và tổ chức liên quan.\n")
+        self.assertEqual(list(provisions), [(2, "1")])
+        self.assertEqual(provisions[(2, "1")]["content"], "Doanh nghiệp và tổ chức liên quan.")
+
+
+class LexicalIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        document = LawDocument.objects.create(title="Luật Doanh nghiệp", source_file="luat.txt")
+        rows = [
+            (47, "2", "Công ty trách nhiệm hữu hạn hai thành viên trở lên có tư cách pháp nhân."),
+            (47, "1.a", "Doanh nghiệp có từ 02 đến không quá 50 thành viên."),
+            (47, "1", "Công ty trách nhiệm hữu hạn hai thành viên trở lên là doanh nghiệp, trong đó:"),
+            (47, None, "Công ty trách nhiệm hữu hạn hai thành viên trở lên."),
+            (74, "1", "Công ty trách nhiệm hữu hạn một thành viên do một tổ chức làm chủ sở hữu."),
+            (111, "1", "Công ty cổ phần là doanh nghiệp, trong đó vốn điều lệ được chia thành cổ phần."),
+        ]
+        cls.ids = {
+            (article, clause): str(LawProvision.objects.create(
+                document=document, article_number=article, article_title="", provision_id=clause, content=content
+            ).id)
+            for article, clause, content in rows
+        }
+
+    def test_bm25_prefers_exact_phrase(self):
+        hits = LexicalIndex().search("công ty cổ phần là gì", 3)
+        self.assertEqual(hits[0].id, self.ids[(111, "1")])
+        self.assertNotIn(self.ids[(47, "1.a")], [hit.id for hit in LexicalIndex().search("vốn điều lệ", 5)])
+
+    def test_direct_lookup_orders_clause_and_points(self):
+        index = LexicalIndex()
+        self.assertEqual(parse_reference("điểm a khoản 1 Điều 47"), (47, "1", "a"))
+        self.assertIsNone(parse_reference("So sánh Điều 47 và Điều 74"))
+        self.assertEqual([hit.id for hit in index.lookup("Khoản 1 Điều 47?")],
+                         [self.ids[(47, "1")], self.ids[(47, "1.a")]])
+        self.assertEqual(len(index.lookup("Điều 47 nói gì")), 4)
+        self.assertEqual(index.lookup("Điều 999"), [])
+        self.assertEqual(index.lookup("Công ty cổ phần"), [])
+
+    def test_direct_lookup_is_scoped_to_one_document(self):
+        decree = LawDocument.objects.create(title="Nghị định 01/2021/NĐ-CP", document_number="01/2021/NĐ-CP",
+                                            source_file="nghi_dinh.txt")
+        other = LawProvision.objects.create(document=decree, article_number=47, article_title="", provision_id="1",
+                                            content="Hồ sơ đăng ký doanh nghiệp.")
+        law_ids = [self.ids[(47, "1")], self.ids[(47, "1.a")]]
+        self.assertEqual([hit.id for hit in LexicalIndex().lookup("Khoản 1 Điều 47 Luật Doanh nghiệp")], law_ids)
+        self.assertEqual([hit.id for hit in LexicalIndex().lookup("Khoản 1 Điều 47 Nghị định 01/2021/NĐ-CP")],
+                         [str(other.id)])
+        # Hai văn bản cùng có Điều 47 và câu hỏi không nói rõ: không trộn, trừ khi có văn bản mặc định.
+        self.assertEqual(LexicalIndex().lookup("Khoản 1 Điều 47"), [])
+        snapshot = LexicalIndex(default_document="01/2021/NĐ-CP").rebuild()
+        self.assertEqual(snapshot.resolve_document("Khoản 1 Điều 47", 47), str(decree.id))
+        law = LawDocument.objects.get(title="Luật Doanh nghiệp")
+        self.assertEqual(snapshot.resolve_document("Điều 111", 111), str(law.id))
+
+    def test_generation_bump_is_seen_through_the_database(self):
+        index = LexicalIndex(refresh_seconds=0)
+        self.assertEqual(index.lookup("Điều 200"), [])
+        provision = LawProvision.objects.create(document=LawDocument.objects.get(), article_number=200,
+                                                article_title="", provision_id="1", content="Điều khoản mới.")
+        bump_lexical_generation()
+        # Số thế hệ nằm trong PostgreSQL nên worker khác (không chung cache LocMem) cũng thấy.
+        self.assertEqual(IndexGeneration.objects.get(name="lexical").value, 1)
+        self.assertEqual([hit.id for hit in index.lookup("Điều 200")], [str(provision.id)])
+
+    def test_reciprocal_rank_fusion_keeps_vector_scores(self):
+        vector = [SearchHit("a", 0.9, {"k": 1}), SearchHit("b", 0.8)]
+        lexical = [SearchHit("c", None), SearchHit("b", None)]
+        fused = reciprocal_rank_fusion([vector, lexical], 2)
+        self.assertEqual([hit.id for hit in fused], ["b", "a"])
+        self.assertEqual(fused[1], SearchHit("a", 0.9, {"k": 1}))
+
+
+class ArticleIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        law = LawDocument.objects.create(title="Luật Doanh nghiệp", source_file="luat.txt")
+        other = LawDocument.objects.create(title="Nghị định", source_file="nghi_dinh.txt")
+        rows = [
+            (law, "2", "Khoản 2."), (law, "1.b", "Điểm b."), (law, "1", "Khoản 1:"),
+            (law, None, "Phần dẫn."), (law, "1.a", "Điểm a."), (other, "1", "Khoản 1 của văn bản khác."),
+        ]
+        cls.law = law
+        cls.ids = {
+            (document.title, clause): str(LawProvision.objects.create(
+                document=document, article_number=47, article_title="", provision_id=clause, content=content
+            ).id)
+            for document, clause, content in rows
+        }
+
+    def test_orders_article_and_maps_points_to_clause(self):
+        snapshot = ArticleIndex().rebuild()
+        law = lambda clause: self.ids[("Luật Doanh nghiệp", clause)]
+        self.assertEqual(snapshot.article(self.law.id, 47), [law(None), law("1"), law("1.a"), law("1.b"), law("2")])
+        self.assertEqual(snapshot.parent(law("1.b")), law("1"))
+        self.assertEqual(snapshot.parent(law("2")), law(None))
+        self.assertEqual(snapshot.related(law("1.a"), "siblings"), [law("1"), law("1.b")])
+        self.assertEqual(snapshot.article(self.law.id, 48), [])
+
+    def test_expands_hits_without_queries_and_respects_limit(self):
+        index = ArticleIndex(mode="siblings", limit=1)
+        index.snapshot()
+        hits = [SearchHit(self.ids[("Luật Doanh nghiệp", "1.a")], 0.9)]
+        with self.assertNumQueries(0):
+            expansion = index.expand(hits)
+        self.assertEqual(expansion, {hits[0].id: [self.ids[("Luật Doanh nghiệp", "1")]]})
+
+    def test_long_article_groups_clauses_in_one_pass(self):
+        clauses = [None] + [c for k in range(1, 2001) for c in (str(k), f"{k}.a")]
+        rows = [(uuid.uuid4(), self.law.id, 1, clause) for clause in clauses]
+        started = time.perf_counter()
+        snapshot = _Snapshot.build(0, reversed(rows))
+        self.assertLess(time.perf_counter() - started, 1.0)
+        ids = {clause: str(provision_id) for provision_id, _, _, clause in rows}
+        for clause in ("1", "1.a", "1500.a"):
+            start, end = snapshot.clause_bounds[snapshot.row(ids[clause])]
+            self.assertEqual(
+                [snapshot.provision_id(i) for i in range(start, end)],
+                [ids[clause.partition(".")[0]], ids[clause.partition(".")[0] + ".a"]],
+            )
+        self.assertEqual(snapshot.parent(ids["1500.a"]), ids["1500"])
+        self.assertEqual(snapshot.parent(ids["2000"]), ids[None])
+
+
+class IngestLawDataTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        for name in ("luat.txt", "nghi_dinh.txt"):
+            with open(os.path.join(self.dir, name), "w", encoding="utf-8") as f:
+                f.write(SAMPLE_LAW_TEXT)
+        self.manifest = os.path.join(self.dir, "manifest.json")
+        with open(self.manifest, "w", encoding="utf-8") as f:
+            json.dump([{"file": "luat.txt", "title": "Luật Doanh nghiệp", "document_number": "59/2020/QH14",
+                        "effective_date": "2021-01-01"}], f)
+
+    def ingest(self, *args):
+        call_command("ingest_law_data", self.dir, "--manifest", self.manifest, "--workers", "1", *args,
+                     stdout=mock.MagicMock())
+
+    def test_ingests_directory_with_manifest_and_skips_unchanged_files(self):
+        self.ingest()
+        law = LawDocument.objects.get(title="Luật Doanh nghiệp")
+        self.assertEqual(law.document_number, "59/2020/QH14")
+        self.assertEqual(str(law.effective_date), "2021-01-01")
+        self.assertTrue(LawDocument.objects.filter(title="nghi_dinh").exists())
+        keys = set(law.provisions.values_list("article_number", "provision_id"))
+        self.assertTrue({(1, None), (4, "34"), (17, "1.a"), (17, "1.b"), (17, "2")} <= keys)
+        section = law.provisions.get(article_number=17, provision_id="1.a").section_info
+        self.assertEqual(section, "Mục 1 ĐĂNG KÝ DOANH NGHIỆP")
+
+        ids = dict(LawProvision.objects.values_list("id", "content"))
+        with mock.patch.object(LawProvision.objects, "bulk_create") as bulk_create:
+            self.ingest()
+        bulk_create.assert_not_called()
+
+        with open(os.path.join(self.dir, "luat.txt"), "a", encoding="utf-8") as f:
+            f.write("3. Tổ chức, cá nhân có quyền mua cổ phần.\n")
+        self.ingest()
+        self.assertTrue(law.provisions.filter(article_number=17, provision_id="3").exists())
+        # Unchanged provisions keep their ids, so their Qdrant points survive re-ingestion.
+        self.assertTrue(set(ids) <= set(LawProvision.objects.values_list("id", flat=True)))
+
+    def test_manifest_changes_update_the_same_document_without_reparsing(self):
+        self.ingest()
+        law = LawDocument.objects.get(source_file="luat.txt")
+        ids = set(law.provisions.values_list("id", flat=True))
+        with open(self.manifest, "w", encoding="utf-8") as f:
+            json.dump([{"file": "luat.txt", "title": "Luật Doanh nghiệp 2020", "document_number": "59/2020/QH14",
+                        "effective_date": "2021-01-01"}], f)
+        with mock.patch("chatbot.management.commands.ingest_law_data.parse_law_document") as parse:
+            self.ingest()
+        parse.assert_not_called()
+        self.assertEqual(LawDocument.objects.count(), 2)
+        law.refresh_from_db()
+        self.assertEqual(law.title, "Luật Doanh nghiệp 2020")
+        self.assertEqual(set(law.provisions.values_list("id", flat=True)), ids)
+
+    def test_same_file_name_in_different_directories_are_separate_documents(self):
+        for folder in ("2020", "2014"):
+            os.makedirs(os.path.join(self.dir, folder))
+            with open(os.path.join(self.dir, folder, "luat.txt"), "w", encoding="utf-8") as f:
+                f.write(SAMPLE_LAW_TEXT)
+        with open(self.manifest, "w", encoding="utf-8") as f:
+            json.dump([{"file": "2020/luat.txt", "title": "Luật Doanh nghiệp 2020"},
+                       {"file": "2014/luat.txt", "title": "Luật Doanh nghiệp 2014"}], f)
+        call_command("ingest_law_data", os.path.join(self.dir, "2020"), os.path.join(self.dir, "2014"),
+                     "--manifest", self.manifest, "--workers", "1", stdout=mock.MagicMock())
+        self.assertEqual(dict(LawDocument.objects.values_list("source_file", "title")),
+                         {"2020/luat.txt": "Luật Doanh nghiệp 2020", "2014/luat.txt": "Luật Doanh nghiệp 2014"})
+
+
+class EvaluationTests(SimpleTestCase):
+    def test_recall_and_mrr_count_articles_not_provisions(self):
+        golden = [
+            GoldenQuestion("Vốn điều lệ là gì?", [4], None),
+            GoldenQuestion("Chuyển nhượng phần vốn góp", [51, 52], "luat.txt"),
+            GoldenQuestion("Giải thể", [207], None),
+        ]
+        ranked = [
+            (golden[0], [("luat.txt", 4), ("luat.txt", 4), ("luat.txt", 7)]),
+            (golden[1], [("khac.txt", 52), ("luat.txt", 52), ("luat.txt", 52), ("luat.txt", 51)]),
+            (golden[2], [("luat.txt", 206)]),
+        ]
+        result = retrieval_metrics(ranked, ks=(1, 3))
+        self.assertAlmostEqual(result["recall@1"], 1 / 3)
+        self.assertAlmostEqual(result["recall@3"], (1 + 0.5 + 0) / 3)
+        self.assertAlmostEqual(result["mrr"], (1 + 1 / 2 + 0) / 3)
+        self.assertIsNone(result["details"][2]["first_relevant_rank"])
+        self.assertEqual(parse_server_timing("embed;dur=2.5, llm;desc=\"x\";dur=50, total;dur=60"),
+                         {"embed": 2.5, "llm": 50.0, "total": 60.0})
+
+    def test_compare_reports_flags_regressions_beyond_tolerance(self):
+        def report(recall, p95, embed_p95, rps):
+            return {
+                "retrieval": {"recall@5": recall, "mrr": 0.8},
+                "load": [{"concurrency": 4, "rps": rps, "latency_ms": {"p95": p95}, "stages_ms": {"embed": {"p95": embed_p95}}}],
+                "memory": {"peak_rss_mb": 500},
+            }
+
+        baseline = report(0.90, 100.0, 0.2, 40.0)
+        self.assertEqual(compare_reports(report(0.89, 110.0, 0.9, 35.0), baseline), [])
+        regressions = compare_reports(report(0.80, 130.0, 5.0, 20.0), baseline)
+        self.assertEqual([r.split(":")[0] for r in regressions],
+                         ["recall@5", "concurrency=4 p95", "concurrency=4 embed p95", "concurrency=4 req/s"])
+
+    def test_golden_set_refers_to_articles_in_the_fixture_corpus(self):
+        corpus = os.path.join(BENCHMARK_DATA_DIR, "luat_doanh_nghiep_trich.txt")
+        articles = {p["article_number"] for p in parse_law_file(corpus)}
+        golden = load_golden_set(GOLDEN_SET)
+        self.assertGreaterEqual(len(golden), 20)
+        for item in golden:
+            self.assertLessEqual(set(item.articles), articles, item.question)
+        encoder = HashingEncoder(dim=64)
+        vectors = encoder.encode([golden[0].question, golden[0].question])
+        self.assertEqual(vectors.shape, (2, 64))
+        np.testing.assert_allclose(vectors[0], vectors[1])
+        self.assertAlmostEqual(float(np.linalg.norm(vectors[0])), 1.0, places=5)
+
+
+class TerminalChatLoadTests(SimpleTestCase):
+    def test_load_mode_streams_with_bounded_concurrency_and_counts_errors(self):
+        import httpx
+        import terminal_chat
+
+        state = {"active": 0, "peak": 0}
+
+        async def handler(request):
+            question = json.loads(request.content)["question"]
+            state["active"] += 1
+            state["peak"] = max(state["peak"], state["active"])
+            await asyncio.sleep(0.01)
+            state["active"] -= 1
+            if "503" in question:
+                return httpx.Response(503, json={"error": "không sẵn sàng"})
+            body = "".join([
+                views.sse_event("sources", {"question": question, "sources": []}),
+                views.sse_event("token", {"text": "Trả lời"}),
+                views.sse_event("done", {"answer": "Trả lời"}),
+            ])
+            return httpx.Response(200, content=body.encode(), headers={"Server-Timing": "llm;dur=5.0, total;dur=9.0"})
+
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", suffix=".txt", delete=False) as f:
+            f.write("# câu hỏi mẫu\nVốn điều lệ là gì?\n\nLỗi 503?\n")
+        self.addCleanup(os.unlink, f.name)
+        csv_path = f.name + ".csv"
+        self.addCleanup(lambda: os.path.exists(csv_path) and os.unlink(csv_path))
+
+        args = terminal_chat.parse_args(["--load", f.name, "--stream", "--concurrency", "2", "--requests", "6",
+                                         "--warmup", "2", "--unique", "--csv", csv_path])
+        questions = terminal_chat.load_questions(f.name)
+        self.assertEqual(questions, ["Vốn điều lệ là gì?", "Lỗi 503?"])
+        with mock.patch("builtins.print"):
+            results, elapsed = asyncio.run(terminal_chat.run_load(args, questions, transport=httpx.MockTransport(handler)))
+        terminal_chat.write_csv(csv_path, results)
+
+        self.assertEqual(state["peak"], 2)
+        self.assertEqual([r["index"] for r in results], list(range(6)))
+        summary = terminal_chat.summarize(results, elapsed)
+        self.assertEqual((summary["requests"], summary["errors"]), (6, 3))
+        self.assertEqual(summary["error_kinds"], {"HTTP 503": 3})
+        ok = [r for r in results if not r["error"]]
+        self.assertTrue(all(r["ttfb"] is not None and r["ttft"] is not None for r in ok))
+        self.assertEqual(ok[0]["server_timing"], "llm;dur=5.0, total;dur=9.0")
+        with open(csv_path, encoding="utf-8") as f:
+            self.assertEqual(len(f.read().splitlines()), 7)
@@ -0,0 +1,84 @@
+# src/chatbot/timing.py
+"""Đo thời gian từng bước của pipeline RAG trong một request.
+
+`request_timer()` gắn một `StageTimer` vào context hiện tại (contextvars, nên đi theo cả
+coroutine và asyncio.to_thread). Mọi đoạn code trên đường đi của request bọc bước của
+mình bằng `with stage("embed"):`; ngoài request (lệnh quản trị, test) thì đó là no-op.
+
+Khi request kết thúc, thời gian mỗi bước được ghi vào histogram chatbot_stage_seconds và
+trả về client qua header Server-Timing. Mỗi bước chỉ tốn hai lần gọi perf_counter và
+một lần cộng dict, nên có thể bật thường trực trong production.
+"""
+import contextvars
+import time
+from contextlib import contextmanager
+
+from . import metrics
+
+# -- metrics --
+STAGE_SECONDS = metrics.histogram("chatbot_stage_seconds", "Thời gian từng bước của pipeline RAG.", ["stage"])
+REQUEST_SECONDS = metrics.histogram("chatbot_request_seconds", "Thời gian xử lý một request chatbot.", ["view"])
+REQUESTS = metrics.counter("chatbot_requests_total", "Số request chatbot theo view và mã trạng thái.", ["view", "status"])
+REQUEST_ERRORS = metrics.counter(
+    "chatbot_request_errors_total", "Số lỗi trong pipeline theo bước và lớp lỗi.", ["stage", "error"]
+)
+
+_current = contextvars.ContextVar("chatbot_stage_timer", default=None)
+
+
+class StageTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            REQUEST_ERRORS.inc(stage=name, error=type(e).__name__)
+            raise
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - started
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def observe(self):
+        for name, seconds in self.stages.items():
+            STAGE_SECONDS.observe(seconds, stage=name)
+
+    def server_timing(self):
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        parts.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(parts)
+
+
+@contextmanager
+def request_timer():
+    timer = StageTimer()
+    token = _current.set(timer)
+    try:
+        yield timer
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def stage(name):
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+def finish(timer, response, view):
+    """Ghi số liệu của request và gắn header Server-Timing vào response."""
+    timer.observe()
+    REQUEST_SECONDS.observe(timer.elapsed(), view=view)
+    REQUESTS.inc(view=view, status=response.status_code)
+    response["Server-Timing"] = timer.server_timing()
+    return response
@@ -1,6 +1,9 @@
 from django.urls import path
-from .views import ChatbotAPIView 
+from .views import ChatbotAPIView, ChatbotBatchAPIView, ChatbotStreamAPIView, metrics_view
 
 urlpatterns = [
     path('ask/', ChatbotAPIView.as_view(), name='chatbot_ask'),
+    path('ask/stream/', ChatbotStreamAPIView.as_view(), name='chatbot_ask_stream'),
+    path('ask/batch/', ChatbotBatchAPIView.as_view(), name='chatbot_ask_batch'),
+    path('metrics/', metrics_view, name='chatbot_metrics'),
 ]
\ No newline at end of file
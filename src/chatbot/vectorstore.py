@@ -0,0 +1,425 @@
+# src/chatbot/vectorstore.py
+"""Backend lưu và tìm kiếm vector, dùng chung cho các view và create_embeddings.
+
+- `qdrant` (mặc định): collection Qdrant như trước.
+- `local`: vector đã chuẩn hoá (float32 hoặc int8 kèm hệ số tỉ lệ) trong file `.npy`
+  được mở bằng memory-map, nên mọi worker trên cùng máy dùng chung page cache thay vì
+  mỗi tiến trình giữ một bản. Tìm kiếm là một phép nhân ma trận-vector (brute force);
+  khi có `hnswlib` và số vector >= LOCAL_HNSW_THRESHOLD, một đồ thị HNSW được dựng lúc
+  ghi và dùng khi tìm kiếm. Không cần dịch vụ Qdrant, phù hợp cho môi trường dev/test
+  và corpus nhỏ (vài nghìn vector 768 chiều).
+
+Backend `local` ghi theo kiểu sao chép rồi thay thế: `upsert()`/`delete()` chỉ gom thay
+đổi, `commit()` ghi một phiên bản file mới rồi đổi `manifest.json` bằng os.replace. Worker
+đang đọc phát hiện manifest đổi (theo mtime) và mở lại phiên bản mới ở lần tìm kiếm kế tiếp.
+
+Với int8, tìm kiếm brute force chuyển ma trận sang float32 theo từng khối
+LOCAL_SEARCH_CHUNK_ROWS hàng, không tạo bản float32 của cả ma trận ở mỗi truy vấn; `commit()`
+giữ nguyên giá trị int8 và hệ số tỉ lệ của các vector không đổi (chỉ lượng tử hoá vector mới),
+nên sai số lượng tử không tích luỹ qua các lần ghi tăng dần.
+"""
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import namedtuple
+
+import numpy as np
+from qdrant_client import AsyncQdrantClient, QdrantClient, models
+
+from .rag import SearchHit
+
+logger = logging.getLogger(__name__)
+
+try:
+    import hnswlib
+except ImportError:  # tuỳ chọn: chỉ cần cho corpus lớn
+    hnswlib = None
+
+# -- configuration --
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "qdrant")
+VECTOR_BACKENDS = ("qdrant", "local")
+QDRANT_HOST = os.getenv("QDRANT_HOST", "qdrant")
+QDRANT_PORT = int(os.getenv("QDRANT_PORT", 6333))
+QDRANT_COLLECTION = os.getenv("QDRANT_COLLECTION", "luat_doanh_nghiep_v1")
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", "/app/data/vector_index")
+LOCAL_INDEX_DTYPE = os.getenv("LOCAL_INDEX_DTYPE", "float32")
+LOCAL_HNSW_THRESHOLD = int(os.getenv("LOCAL_HNSW_THRESHOLD", 50000))
+LOCAL_SEARCH_CHUNK_ROWS = int(os.getenv("LOCAL_SEARCH_CHUNK_ROWS", 16384))
+UPLOAD_BATCH_SIZE = 100
+
+VectorPoint = namedtuple("VectorPoint", ["id", "vector", "payload"])
+
+
+class VectorStore:
+    """Giao diện chung. Điểm số trả về là cosine similarity (lớn hơn là gần hơn)."""
+
+    name = None
+
+    def ping(self):
+        """Kiểm tra backend sẵn sàng (ném lỗi nếu không)."""
+
+    def ensure_collection(self, vector_size):
+        raise NotImplementedError
+
+    def search(self, vector, limit):
+        raise NotImplementedError
+
+    async def asearch(self, vector, limit):
+        return self.search(vector, limit)
+
+    def search_batch(self, vectors, limit):
+        """Nhiều truy vấn trong một lần gọi backend; trả về một danh sách hit cho mỗi vector."""
+        return [self.search(vector, limit) for vector in vectors]
+
+    async def asearch_batch(self, vectors, limit):
+        return self.search_batch(vectors, limit)
+
+    def scroll(self, with_payload=True):
+        """Duyệt mọi điểm dưới dạng (id, payload)."""
+        raise NotImplementedError
+
+    def upsert(self, points):
+        raise NotImplementedError
+
+    def delete(self, ids):
+        raise NotImplementedError
+
+    def commit(self):
+        """Ghi các thay đổi đang chờ (backend ghi ngay thì không làm gì)."""
+
+
+class QdrantVectorStore(VectorStore):
+    name = "qdrant"
+
+    def __init__(self, client=None, async_client=None, collection=QDRANT_COLLECTION, host=QDRANT_HOST, port=QDRANT_PORT):
+        self.collection = collection
+        self.client = client or QdrantClient(host=host, port=port)
+        self.async_client = async_client or (None if client else AsyncQdrantClient(host=host, port=port))
+
+    def ping(self):
+        self.client.get_collections()
+
+    def ensure_collection(self, vector_size):
+        """Tạo collection nếu chưa có. Trả về True nếu vừa tạo."""
+        try:
+            self.client.get_collection(collection_name=self.collection)
+            return False
+        except Exception as e:
+            message = str(e).lower()
+            if "not found" not in message and "doesn't exist" not in message and "status_code=404" not in message:
+                raise
+        self.client.create_collection(
+            collection_name=self.collection,
+            vectors_config=models.VectorParams(size=vector_size, distance=models.Distance.COSINE),
+        )
+        return True
+
+    @staticmethod
+    def _hits(response):
+        return [SearchHit(str(hit.id), hit.score, hit.payload) for hit in response.points]
+
+    def search(self, vector, limit):
+        return self._hits(self.client.query_points(
+            collection_name=self.collection,
+            query=list(map(float, vector)),
+            limit=limit,
+            with_payload=True
+        ))
+
+    async def asearch(self, vector, limit):
+        if self.async_client is None:
+            return await super().asearch(vector, limit)
+        return self._hits(await self.async_client.query_points(
+            collection_name=self.collection,
+            query=list(map(float, vector)),
+            limit=limit,
+            with_payload=True
+        ))
+
+    def _query_requests(self, vectors, limit):
+        return [models.QueryRequest(query=list(map(float, vector)), limit=limit, with_payload=True) for vector in vectors]
+
+    def search_batch(self, vectors, limit):
+        if not len(vectors):
+            return []
+        responses = self.client.query_batch_points(
+            collection_name=self.collection, requests=self._query_requests(vectors, limit)
+        )
+        return [self._hits(response) for response in responses]
+
+    async def asearch_batch(self, vectors, limit):
+        if self.async_client is None or not len(vectors):
+            return await super().asearch_batch(vectors, limit)
+        responses = await self.async_client.query_batch_points(
+            collection_name=self.collection, requests=self._query_requests(vectors, limit)
+        )
+        return [self._hits(response) for response in responses]
+
+    def scroll(self, with_payload=True):
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection,
+                limit=1000,
+                offset=offset,
+                with_payload=with_payload,
+                with_vectors=False
+            )
+            for point in points:
+                yield str(point.id), point.payload or {}
+            if offset is None:
+                break
+
+    def upsert(self, points):
+        points = [models.PointStruct(id=p.id, vector=list(map(float, p.vector)), payload=p.payload) for p in points]
+        for i in range(0, len(points), UPLOAD_BATCH_SIZE):
+            self.client.upsert(collection_name=self.collection, points=points[i: i+UPLOAD_BATCH_SIZE], wait=True)
+
+    def delete(self, ids):
+        ids = list(ids)
+        for i in range(0, len(ids), UPLOAD_BATCH_SIZE):
+            self.client.delete(
+                collection_name=self.collection,
+                points_selector=models.PointIdsList(points=ids[i: i+UPLOAD_BATCH_SIZE]),
+                wait=True
+            )
+
+
+def _normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def _quantize(matrix):
+    """(int8, hệ số tỉ lệ float32) theo từng hàng."""
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    return np.round(matrix / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+class _LocalSnapshot:
+    """Một phiên bản chỉ mục đã ghi: ids, payloads, ma trận (memory-map) và HNSW tuỳ chọn."""
+
+    def __init__(self, directory, manifest):
+        self.manifest = manifest
+        self.ids = manifest["ids"]
+        self.payloads = manifest["payloads"]
+        self.vectors = np.load(os.path.join(directory, manifest["vectors"]), mmap_mode="r")
+        self.scales = None
+        if manifest.get("scales"):
+            self.scales = np.load(os.path.join(directory, manifest["scales"]), mmap_mode="r")
+        self.hnsw = None
+        if manifest.get("hnsw") and hnswlib is not None:
+            self.hnsw = hnswlib.Index(space="ip", dim=manifest["dim"])
+            self.hnsw.load_index(os.path.join(directory, manifest["hnsw"]), max_elements=len(self.ids))
+
+    def dense(self):
+        """Ma trận float32 đã chuẩn hoá (giải lượng tử nếu lưu int8)."""
+        if self.scales is None:
+            return np.asarray(self.vectors)
+        return self.vectors.astype(np.float32) * self.scales[:, None]
+
+    def _scores(self, queries, chunk_rows=None):
+        """Cosine (q, n) của ma trận truy vấn với mọi vector; đọc ma trận theo từng khối hàng."""
+        chunk_rows = chunk_rows or LOCAL_SEARCH_CHUNK_ROWS
+        n = len(self.ids)
+        scores = np.empty((len(queries), n), dtype=np.float32)
+        for start in range(0, n, chunk_rows):
+            block = self.vectors[start:start + chunk_rows]
+            if self.scales is not None:
+                block = block.astype(np.float32) * self.scales[start:start + chunk_rows, None]
+            scores[:, start:start + chunk_rows] = queries @ block.T
+        return scores
+
+    def search(self, query, limit):
+        n = len(self.ids)
+        limit = min(limit, n)
+        if limit <= 0:
+            return []
+        if self.hnsw is not None:
+            self.hnsw.set_ef(max(limit * 4, 64))
+            labels, distances = self.hnsw.knn_query(query, k=limit)
+            return [(int(i), 1.0 - float(d)) for i, d in zip(labels[0], distances[0])]
+        scores = self._scores(query[None, :])[0]
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(i), float(scores[i])) for i in top]
+
+    def search_many(self, queries, limit):
+        """Như search cho một ma trận truy vấn (q, dim): một phép nhân ma trận thay vì q phép nhân ma trận-vector."""
+        n = len(self.ids)
+        limit = min(limit, n)
+        if limit <= 0:
+            return [[] for _ in queries]
+        if self.hnsw is not None:
+            self.hnsw.set_ef(max(limit * 4, 64))
+            labels, distances = self.hnsw.knn_query(queries, k=limit)
+            return [[(int(i), 1.0 - float(d)) for i, d in zip(row, dist)] for row, dist in zip(labels, distances)]
+        scores = self._scores(queries)
+        top = np.argpartition(-scores, limit - 1, axis=1)[:, :limit]
+        results = []
+        for row, candidates in zip(scores, top):
+            candidates = candidates[np.argsort(-row[candidates], kind="stable")]
+            results.append([(int(i), float(row[i])) for i in candidates])
+        return results
+
+
+class LocalVectorStore(VectorStore):
+    name = "local"
+
+    def __init__(self, directory=None, dtype=None, hnsw_threshold=LOCAL_HNSW_THRESHOLD):
+        directory, dtype = directory or LOCAL_INDEX_DIR, dtype or LOCAL_INDEX_DTYPE
+        if dtype not in ("float32", "int8"):
+            raise ValueError(f"LOCAL_INDEX_DTYPE không hợp lệ: '{dtype}' (chỉ hỗ trợ 'float32' hoặc 'int8').")
+        self.directory = directory
+        self.dtype = dtype
+        self.hnsw_threshold = hnsw_threshold
+        self._snapshot = None
+        self._manifest_mtime = None
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._deleted = set()
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, "manifest.json")
+
+    def snapshot(self):
+        """Phiên bản chỉ mục hiện hành (mở lại nếu manifest đã được ghi lại); None nếu chưa có."""
+        try:
+            mtime = os.stat(self.manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if mtime != self._manifest_mtime:
+            with self._lock:
+                if mtime != self._manifest_mtime:
+                    with open(self.manifest_path, "r", encoding="utf-8") as f:
+                        self._snapshot = _LocalSnapshot(self.directory, json.load(f))
+                    self._manifest_mtime = mtime
+                    logger.info(f"Đã mở chỉ mục vector cục bộ: {len(self._snapshot.ids)} vector.")
+        return self._snapshot
+
+    def ensure_collection(self, vector_size):
+        os.makedirs(self.directory, exist_ok=True)
+        snapshot = self.snapshot()
+        if snapshot is not None and snapshot.manifest["dim"] != vector_size:
+            raise ValueError(
+                f"Chỉ mục cục bộ có {snapshot.manifest['dim']} chiều, mô hình hiện tại có {vector_size} chiều."
+            )
+        return snapshot is None
+
+    def search(self, vector, limit):
+        snapshot = self.snapshot()
+        if snapshot is None:
+            logger.warning(f"Chưa có chỉ mục vector cục bộ tại '{self.directory}'. Hãy chạy create_embeddings.")
+            return []
+        query = _normalize(vector)
+        return [SearchHit(snapshot.ids[i], score, snapshot.payloads[i]) for i, score in snapshot.search(query, limit)]
+
+    def search_batch(self, vectors, limit):
+        snapshot = self.snapshot()
+        if snapshot is None or not len(vectors):
+            return [self.search(vector, limit) for vector in vectors]
+        queries = _normalize(np.stack([np.asarray(vector, dtype=np.float32) for vector in vectors]))
+        return [
+            [SearchHit(snapshot.ids[i], score, snapshot.payloads[i]) for i, score in ranked]
+            for ranked in snapshot.search_many(queries, limit)
+        ]
+
+    def scroll(self, with_payload=True):
+        snapshot = self.snapshot()
+        if snapshot is None:
+            return
+        for point_id, payload in zip(snapshot.ids, snapshot.payloads):
+            yield point_id, payload if with_payload else {}
+
+    def upsert(self, points):
+        with self._lock:
+            for p in points:
+                self._pending[str(p.id)] = (p.vector, p.payload)
+                self._deleted.discard(str(p.id))
+
+    def delete(self, ids):
+        with self._lock:
+            for point_id in ids:
+                self._pending.pop(str(point_id), None)
+                self._deleted.add(str(point_id))
+
+    def commit(self):
+        with self._lock:
+            pending, deleted = self._pending, self._deleted
+            self._pending, self._deleted = {}, set()
+        if not pending and not deleted:
+            return
+        snapshot = self.snapshot()
+        if snapshot is None and not pending:
+            return
+        ids, payloads, blocks = [], [], []
+        if snapshot is not None:
+            keep = [i for i, point_id in enumerate(snapshot.ids) if point_id not in pending and point_id not in deleted]
+            ids = [snapshot.ids[i] for i in keep]
+            payloads = [snapshot.payloads[i] for i in keep]
+            if self.dtype == "int8" and snapshot.scales is not None:
+                # Giữ nguyên int8 của vector không đổi: lượng tử hoá lại bản đã giải lượng tử sẽ tích luỹ sai số.
+                blocks.append((np.asarray(snapshot.vectors[keep]), np.asarray(snapshot.scales[keep])))
+            else:
+                blocks.append(snapshot.dense()[keep])
+        if pending:
+            ids.extend(pending)
+            payloads.extend(payload for _, payload in pending.values())
+            blocks.append(_normalize(np.stack([np.asarray(vector, dtype=np.float32) for vector, _ in pending.values()])))
+        dim = snapshot.manifest["dim"] if snapshot is not None else blocks[-1].shape[1]
+        if self.dtype == "int8":
+            quantized = [block if isinstance(block, tuple) else _quantize(block) for block in blocks]
+            vectors = np.concatenate([q for q, _ in quantized]) if quantized else np.zeros((0, dim), dtype=np.int8)
+            scales = np.concatenate([s for _, s in quantized]) if quantized else np.zeros(0, dtype=np.float32)
+            self._write(ids, payloads, vectors, scales)
+        else:
+            matrix = np.concatenate(blocks) if blocks else np.zeros((0, dim), dtype=np.float32)
+            self._write(ids, payloads, matrix)
+
+    def _write(self, ids, payloads, matrix, scales=None):
+        """matrix: float32 đã chuẩn hoá, hoặc int8 kèm `scales` khi dtype là int8."""
+        os.makedirs(self.directory, exist_ok=True)
+        version = uuid.uuid4().hex[:12]
+        manifest = {"version": version, "dim": int(matrix.shape[1]), "dtype": self.dtype, "ids": ids, "payloads": payloads}
+
+        if scales is not None:
+            manifest["vectors"], manifest["scales"] = f"vectors-{version}.npy", f"scales-{version}.npy"
+            np.save(os.path.join(self.directory, manifest["vectors"]), matrix)
+            np.save(os.path.join(self.directory, manifest["scales"]), scales)
+            matrix = matrix.astype(np.float32) * scales[:, None]  # cho HNSW
+        else:
+            manifest["vectors"] = f"vectors-{version}.npy"
+            np.save(os.path.join(self.directory, manifest["vectors"]), matrix.astype(np.float32))
+
+        if hnswlib is not None and len(ids) >= self.hnsw_threshold:
+            index = hnswlib.Index(space="ip", dim=manifest["dim"])
+            index.init_index(max_elements=len(ids), ef_construction=200, M=16)
+            index.add_items(matrix, np.arange(len(ids)))
+            manifest["hnsw"] = f"hnsw-{version}.bin"
+            index.save_index(os.path.join(self.directory, manifest["hnsw"]))
+
+        tmp_path = f"{self.manifest_path}.{version}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
+
+        # Worker đang memory-map phiên bản cũ vẫn đọc được file đã unlink cho tới khi mở lại.
+        current = {manifest[key] for key in ("vectors", "scales", "hnsw") if manifest.get(key)}
+        for name in os.listdir(self.directory):
+            if name.endswith((".npy", ".bin")) and name not in current:
+                os.remove(os.path.join(self.directory, name))
+        logger.info(f"Đã ghi chỉ mục vector cục bộ: {len(ids)} vector ({self.dtype}{', HNSW' if 'hnsw' in manifest else ''}).")
+
+
+def make_vector_store(backend=None):
+    backend = backend or VECTOR_BACKEND
+    if backend == "qdrant":
+        return QdrantVectorStore()
+    if backend == "local":
+        return LocalVectorStore()
+    raise ValueError(f"VECTOR_BACKEND không hợp lệ: '{backend}' (chỉ hỗ trợ 'qdrant' hoặc 'local').")
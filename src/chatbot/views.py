@@ -1,138 +1,256 @@
 import os
 import json
+import asyncio
 import logging
-from django.http import JsonResponse, HttpResponseBadRequest
+from django.http import HttpResponse, JsonResponse, HttpResponseBadRequest, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.views import View
-from qdrant_client import QdrantClient, models
-import google.generativeai as genai
 
-from .embedding import get_embedding_model
-from .models import LawProvision
+from . import metrics
+from .cache import rag_cache
+from .coalesce import flight_key, single_flight, stream_flight
+from .hierarchy import attach_expansion, expansion_hits
+from .lexical import HYBRID_CANDIDATE_FACTOR, reciprocal_rank_fusion
+from .llm import CircuitOpen
+from .rerank import RERANK_CANDIDATES
+from .semantic_cache import answer_cache
+from .services import ServiceUnavailable, services
+from .timing import StageTimer, finish, request_timer, stage
+from .rag import (
+    NO_PROVISIONS_ANSWER, ahydrate_provisions, build_prompt, fallback_answer, source_entry,
+)
 
 # -- configure logging --
 logger = logging.getLogger(__name__)
 
 # -- configuration --
-QDRANT_HOST = os.getenv("QDRANT_HOST", "qdrant")
-QDRANT_PORT = os.getenv("QDRANT_PORT", 6333)
-QDRANT_COLLECTION = os.getenv("QDRANT_COLLECTION", "luat_doanh_nghiep_v1")
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-
-# -- initialize clients --
-qdrant_client = None
-embedding_model = None
-gemini_model = None
-initialization_error = None
-
-try:
-    if not GEMINI_API_KEY:
-        raise ValueError("Không tìm thấy GEMINI_API_KEY trong biến môi trường.")
-    
-    logger.info("Đang khởi tạo Qdrant client...")
-    qdrant_client = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
-    qdrant_client.get_collections()
-    logger.info("Khởi tạo Qdrant client thành công.")
-
-    logger.info("Đang khởi tạo mô hình embedding...")
-    embedding_model = get_embedding_model()
-    logger.info("Khởi tạo mô hình embedding thành công.")
-    
-    logger.info("Đang cấu hình Gemini API...")
-    genai.configure(api_key=GEMINI_API_KEY)
-    gemini_model = genai.GenerativeModel('gemini-2.5-pro')
-    logger.info("Khởi tạo mô hình Gemini thành công.")
-
-except Exception as e:
-    logger.exception(f"LỖI NGHIÊM TRỌNG: Lỗi trong quá trình khởi tạo client: {e}")
-    initialization_error = str(e)
+SEARCH_LIMIT = int(os.getenv("SEARCH_LIMIT", 5))
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", 50))
+# Số lượt gọi LLM đồng thời của một request batch; nhỏ hơn LLM_MAX_CONCURRENCY để chừa slot cho câu hỏi lẻ.
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", 4))
+
+# -- metrics --
+BATCH_QUESTIONS = metrics.histogram(
+    "chatbot_batch_questions", "Số câu hỏi trong một request batch.", buckets=(1, 2, 5, 10, 20, 50, 100)
+)
+
+def unavailable_response(error):
+    logger.error(f"Dịch vụ chatbot không sẵn sàng: {error}")
+    return JsonResponse({"error": f"Dịch vụ chatbot không sẵn sàng: {error}"}, status=503)
+
+async def aencode_query(query):
+    vector = await rag_cache.aget_embedding(query)
+    if vector is None:
+        with stage("embed"):
+            embedding_batcher = await services.aget("embedding_batcher")
+            if embedding_batcher:
+                vector = await embedding_batcher.aencode(query)
+            else:
+                embedding_model = await services.aget("embedding_model")
+                vector = await asyncio.to_thread(embedding_model.encode, query)
+        await rag_cache.aset_embedding(query, vector)
+    return vector
+
+async def aencode_queries(queries):
+    """Vector của nhiều câu hỏi: lấy từ cache, các câu còn thiếu được encode trong một lần gọi mô hình."""
+    vectors = [await rag_cache.aget_embedding(query) for query in queries]
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        with stage("embed"):
+            embedding_model = await services.aget("embedding_model")
+            encoded = await asyncio.to_thread(
+                embedding_model.encode, [queries[i] for i in missing], batch_size=len(missing)
+            )
+        for i, vector in zip(missing, encoded):
+            vectors[i] = vector
+            await rag_cache.aset_embedding(queries[i], vector)
+    return vectors
+
+async def avector_search(query, limit):
+    logger.debug("Đang tạo embedding cho câu hỏi...")
+    query_vector = await aencode_query(query)
+    vector_store = await services.aget("vector_store")
+    logger.debug(f"Đang tìm kiếm điều khoản liên quan ({vector_store.name})...")
+    with stage("vector_search"):
+        return await vector_store.asearch(query_vector, limit)
+
+async def alookup_reference(query):
+    lexical_index = await services.aget("lexical_index")
+    if lexical_index is None:
+        return []
+    with stage("lookup"):
+        return await asyncio.to_thread(lexical_index.lookup, query)
+
+async def asearch_provisions(query, limit=SEARCH_LIMIT):
+    hits = await rag_cache.aget_hits(query, limit)
+    if hits is None:
+        lexical_index = await services.aget("lexical_index")
+        if lexical_index is None:
+            hits = await avector_search(query, limit)
+        else:
+            candidates = limit * HYBRID_CANDIDATE_FACTOR
+            vector_hits, lexical_hits = await asyncio.gather(
+                avector_search(query, candidates),
+                asyncio.to_thread(lexical_index.search, query, candidates),
+            )
+            hits = reciprocal_rank_fusion([vector_hits, lexical_hits], limit)
+        await rag_cache.aset_hits(query, limit, hits)
+    return hits
+
+async def asearch_provisions_batch(queries, limit=SEARCH_LIMIT):
+    """Như asearch_provisions cho nhiều câu hỏi: một lần encode và một request tìm kiếm vector cho cả lô."""
+    results = [await rag_cache.aget_hits(query, limit) for query in queries]
+    missing = [i for i, hits in enumerate(results) if hits is None]
+    if not missing:
+        return results
+    texts = [queries[i] for i in missing]
+    lexical_index = await services.aget("lexical_index")
+    candidates = limit if lexical_index is None else limit * HYBRID_CANDIDATE_FACTOR
+
+    async def vector_branch():
+        vectors = await aencode_queries(texts)
+        vector_store = await services.aget("vector_store")
+        with stage("vector_search"):
+            return await vector_store.asearch_batch(vectors, candidates)
+
+    if lexical_index is None:
+        fused = await vector_branch()
+    else:
+        vector_hits, lexical_hits = await asyncio.gather(
+            vector_branch(),
+            asyncio.to_thread(lambda: [lexical_index.search(text, candidates) for text in texts]),
+        )
+        fused = [reciprocal_rank_fusion([v, l], limit) for v, l in zip(vector_hits, lexical_hits)]
+    for i, hits in zip(missing, fused):
+        results[i] = hits
+        await rag_cache.aset_hits(queries[i], limit, hits)
+    return results
+
+def retrieval_limit(reranker):
+    """Có rerank thì lấy nhiều ứng viên hơn, cross-encoder sẽ giữ lại RERANK_TOP_K."""
+    return RERANK_CANDIDATES if reranker is not None else SEARCH_LIMIT
+
+def parse_question(request):
+    try:
+        data = json.loads(request.body)
+        query = data.get('question')
+        if not query or not isinstance(query, str) or not query.strip():
+            logger.warning("Nhận được yêu cầu không hợp lệ: Thiếu hoặc 'question' rỗng.")
+            return None, HttpResponseBadRequest("Yêu cầu không hợp lệ: Thiếu hoặc 'question' rỗng.")
+        logger.info(f"Nhận được câu hỏi: {query}")
+        return query, None
+    except json.JSONDecodeError:
+        logger.warning("Nhận được yêu cầu không hợp lệ: JSON không hợp lệ.")
+        return None, HttpResponseBadRequest("Yêu cầu không hợp lệ: JSON không hợp lệ.")
+
+def parse_questions(request):
+    """Danh sách câu hỏi của request batch; từng phần tử được kiểm tra riêng trong view."""
+    try:
+        questions = json.loads(request.body).get('questions')
+    except (json.JSONDecodeError, AttributeError):
+        logger.warning("Nhận được yêu cầu batch không hợp lệ: JSON không hợp lệ.")
+        return None, HttpResponseBadRequest("Yêu cầu không hợp lệ: JSON không hợp lệ.")
+    if not isinstance(questions, list) or not questions:
+        return None, HttpResponseBadRequest("Yêu cầu không hợp lệ: 'questions' phải là danh sách không rỗng.")
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        return None, HttpResponseBadRequest(f"Yêu cầu không hợp lệ: tối đa {BATCH_MAX_QUESTIONS} câu hỏi mỗi lô.")
+    logger.info(f"Nhận được lô {len(questions)} câu hỏi.")
+    return questions, None
+
+def prompt_metadata(prompt, llm=None):
+    """Kích thước prompt và mô hình đã dùng; None khi không gọi LLM (cache, không có điều khoản)."""
+    if prompt is None:
+        return {"prompt_tokens": None, "context_provisions": 0, "model": None}
+    return {
+        "prompt_tokens": prompt.tokens,
+        "context_provisions": len(prompt.provisions),
+        "model": llm.provider.label if llm is not None else None,
+    }
+
+def question_class(direct_hits):
+    return "lookup" if direct_hits else "general"
 
 @method_decorator(csrf_exempt, name='dispatch')
 class ChatbotAPIView(View):
-    def post(self, request, *args, **kwargs):
-        if initialization_error:
-            logger.error(f"Dịch vụ chatbot không sẵn sàng do lỗi khởi tạo: {initialization_error}")
-            return JsonResponse({"error": f"Dịch vụ chatbot không sẵn sàng: {initialization_error}"}, status=503)
+    """Trả lời một câu hỏi dạng JSON.
 
-        # -- request analyzing --
+    View bất đồng bộ: dưới ASGI (config/asgi.py, worker mặc định của gunicorn) mọi bước chờ
+    I/O (Qdrant, PostgreSQL, Gemini) đều nhường event loop, còn bước tốn CPU (BM25, mở rộng
+    theo điều) chạy trên thread pool, nên một worker phục vụ nhiều request cùng lúc.
+    """
+
+    async def post(self, request, *args, **kwargs):
+        with request_timer() as timer:
+            return finish(timer, await self.answer(request), "ask")
+
+    async def answer(self, request):
         try:
-            data = json.loads(request.body)
-            query = data.get('question')
-            if not query or not isinstance(query, str) or not query.strip():
-                logger.warning("Nhận được yêu cầu không hợp lệ: Thiếu hoặc 'question' rỗng.")
-                return HttpResponseBadRequest("Yêu cầu không hợp lệ: Thiếu hoặc 'question' rỗng.")   
-            logger.info(f"Nhận được câu hỏi: {query}")
-        except json.JSONDecodeError:
-            logger.warning("Nhận được yêu cầu không hợp lệ: JSON không hợp lệ.")
-            return HttpResponseBadRequest("Yêu cầu không hợp lệ: JSON không hợp lệ.")
+            llm_router = await services.aget("llm")
+            reranker = await services.aget("reranker")
+            article_index = await services.aget("article_index")
+        except ServiceUnavailable as e:
+            return unavailable_response(e)
+
+        # -- request analyzing --
+        with stage("parse"):
+            query, bad_request = parse_question(request)
+        if bad_request:
+            return bad_request
 
         # -- rag (retrieval-augmented generation) process --
+        metadata = prompt_metadata(None)
         try:
-            # -- prompt embedding -- 
-            logger.debug("Đang tạo embedding cho câu hỏi...")
-            query_vector = embedding_model.encode(query).tolist()
-            logger.debug("Tạo embedding câu hỏi thành công.")
-
-            # -- qdrant vector searching --
-            logger.debug("Đang tìm kiếm điều khoản liên quan trong Qdrant...")
-            search_result = qdrant_client.search(
-                collection_name=QDRANT_COLLECTION,
-                query_vector=query_vector,
-                limit=5
-            )
+            # -- explicit "Điều N khoản M" references, else hybrid bm25 + vector search (cached) --
+            direct_hits = await alookup_reference(query)
+            search_result = direct_hits or await asearch_provisions(query, retrieval_limit(reranker))
             hit_ids = [hit.id for hit in search_result]
-            logger.info(f"Tìm thấy {len(hit_ids)} ID điều khoản liên quan trong Qdrant.")
+            logger.info(f"Tìm thấy {len(hit_ids)} ID điều khoản liên quan{' (tra cứu trực tiếp)' if direct_hits else ''}.")
             logger.debug(f"Các ID liên quan: {hit_ids}")
 
-            # -- get content from postgresql --
-            relevant_provisions = LawProvision.objects.filter(id__in=hit_ids)
+            # -- parents/siblings from the in-memory article index (no extra query) --
+            with stage("expand"):
+                expansion = await asyncio.to_thread(article_index.expand, search_result) if article_index is not None else {}
+
+            # -- provisions from full payloads, postgresql only for the rest (one query, rank order) --
+            with stage("hydrate"):
+                hydrated = await ahydrate_provisions(expansion_hits(search_result, expansion))
+            scores = {hit.id: hit.score for hit in search_result}
+            relevant_provisions = [p for p in hydrated if str(p.id) in scores]
+            if reranker is not None and not direct_hits:
+                with stage("rerank"):
+                    relevant_provisions = await reranker.arerank(query, relevant_provisions)
+            relevant_provisions = attach_expansion(relevant_provisions, expansion, hydrated)
             if not relevant_provisions:
                 logger.warning("Không tìm thấy điều khoản nào trong PostgreSQL khớp với ID từ Qdrant.")
-                answer = "Tôi không tìm thấy điều khoản luật nào liên quan trực tiếp đến câu hỏi của bạn."
+                answer = NO_PROVISIONS_ANSWER
                 sources = []
             else:
-                logger.debug(f"Lấy được {relevant_provisions.count()} điều khoản từ PostgreSQL.")
-
-                # -- building context and prompt for gemini --
-                context_parts = []
-                for i, p in enumerate(relevant_provisions):
-                    context_prefix = f"Trích đoạn {i+1} (Lấy từ "
-                    if p.chapter_info: context_prefix += f"{p.chapter_info}, "
-                    if p.section_info: context_prefix += f"{p.section_info}, "
-                    context_prefix += f"Điều {p.article_number}, Khoản {p.provision_id or 'chung'}):"
-                    context_parts.append(f"{context_prefix}\n{p.content}")
-                context = "\n\n".join(context_parts)
-                prompt = f"""Dựa vào các trích đoạn sau từ Luật Doanh nghiệp Việt Nam: {context} 
-                Hãy trả lời câu hỏi sau của người dùng một chi tiết, đầy đủ, đúng trọng tâm và 
-                chính xác, không cắt bớt và CHỈ sử dụng thông tin từ các trích đoạn đã cung cấp. 
-                Luôn trả lời bằng tiếng Việt. Nếu thông tin không có trong trích đoạn, 
-                hãy trả lời "Tôi không tìm thấy thông tin liên quan trong các điều khoản được cung cấp.". 
-                Không được suy diễn hoặc thêm thông tin bên ngoài. Câu hỏi: "{query}" Trả lời:"""
-                logger.debug(f"Prompt đã tạo cho Gemini:\n{prompt}")
-
-                # -- gemini api calling --
-                logger.info("Đang gọi Gemini API...")
-                try:
-                    response = gemini_model.generate_content(prompt)
-                    answer = response.text
-                    logger.info("Nhận được câu trả lời từ Gemini.")
-                    logger.debug(f"Phản hồi thô từ Gemini: {answer}")
-                except Exception as gen_e:
-                    logger.exception(f"Lỗi khi gọi Gemini API: {gen_e}")
-                    answer = "Xin lỗi, tôi gặp sự cố khi tạo câu trả lời. Tuy nhiên, tôi tìm thấy các điều khoản sau có liên quan:\n" + "\n".join([f"- Điều {p.article_number}, Khoản {p.provision_id or 'chung'}" for p in relevant_provisions])
+                logger.debug(f"Dựng được {len(relevant_provisions)} điều khoản (từ payload Qdrant hoặc PostgreSQL).")
+
+                # -- semantic answer cache (same provisions, near-identical question) --
+                answer = query_vector = None
+                if answer_cache is not None and not direct_hits:
+                    query_vector = await aencode_query(query)
+                    with stage("answer_cache"):
+                        answer = await answer_cache.alookup(query_vector, [p.id for p in relevant_provisions])
+                    if answer is not None:
+                        logger.info("Dùng lại câu trả lời từ cache ngữ nghĩa.")
+
+                if answer is None:
+                    # -- identical in-flight questions (same question, same provisions) share one llm call --
+                    def generate():
+                        return self.generate_answer(llm_router, query, relevant_provisions, query_vector, direct_hits)
+                    if single_flight is not None:
+                        key = flight_key(query, [p.id for p in relevant_provisions], question_class(direct_hits))
+                        result = await single_flight.do(key, generate)
+                    else:
+                        result = await generate()
+                    answer, metadata = result["answer"], result["metadata"]
                 # -- source information preparing --
-                sources = [
-                    {
-                        "id": str(p.id),
-                        "document": p.document.title,
-                        "chapter": p.chapter_info or "N/A",
-                        "section": p.section_info or "N/A",
-                        "article": p.article_number,
-                        "provision": p.provision_id or "N/A",
-                        "score": next((hit.score for hit in search_result if hit.id == str(p.id)), None)
-                    } for p in relevant_provisions
-                ]
+                sources = [source_entry(p, scores.get(str(p.id))) for p in relevant_provisions]
+        except ServiceUnavailable as e:
+            return unavailable_response(e)
         except Exception as e:
             logger.exception(f"Lỗi trong quy trình RAG: {e}")
             return JsonResponse({"error": "Đã xảy ra lỗi trong quá trình xử lý yêu cầu."}, status=500)
@@ -141,8 +259,310 @@ class ChatbotAPIView(View):
         response_data = {
             "question": query,
             "answer": answer.strip(),
-            "sources": sources
+            "sources": sources,
+            "metadata": metadata,
         }
         logger.info("Đang gửi phản hồi cho client.")
         logger.debug(f"Dữ liệu phản hồi: {response_data}")
-        return JsonResponse(response_data)
\ No newline at end of file
+        with stage("serialize"):
+            return JsonResponse(response_data)
+
+    async def generate_answer(self, llm_router, query, provisions, query_vector=None, direct_hits=None):
+        """Prompt + LLM cho một câu hỏi; kết quả {"answer", "metadata"} có thể được chia sẻ giữa các request trùng."""
+        # -- building context and prompt for the llm (token-budgeted) --
+        with stage("prompt"):
+            prompt = build_prompt(query, provisions)
+        logger.debug(f"Prompt đã tạo cho LLM:\n{prompt.text}")
+
+        # -- llm calling (model routing; deadline, retries, circuit breaker in the gateway) --
+        llm = llm_router.route(prompt.tokens, question_class(direct_hits))
+        logger.info(f"Đang gọi LLM ({llm.provider.label})...")
+        try:
+            with stage("llm"):
+                answer = await llm.agenerate(prompt.text)
+            logger.info("Nhận được câu trả lời từ LLM.")
+            logger.debug(f"Phản hồi thô từ LLM: {answer}")
+            if query_vector is not None:
+                answer_cache.store(query_vector, [p.id for p in provisions], {p.document_id for p in provisions}, answer)
+        except CircuitOpen as gen_e:
+            logger.warning(f"Bỏ qua LLM: {gen_e}")
+            return {"answer": fallback_answer(provisions), "metadata": prompt_metadata(prompt, llm), "fallback": True}
+        except Exception as gen_e:
+            logger.exception(f"Lỗi khi gọi LLM: {gen_e}")
+            return {"answer": fallback_answer(provisions), "metadata": prompt_metadata(prompt, llm), "fallback": True}
+        return {"answer": answer, "metadata": prompt_metadata(prompt, llm)}
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ChatbotStreamAPIView(View):
+    """Phiên bản bất đồng bộ của ChatbotAPIView, trả câu trả lời dạng Server-Sent Events.
+
+    Luồng sự kiện: một sự kiện `sources`, nhiều sự kiện `token` khi LLM sinh văn bản,
+    cuối cùng là `done` (hoặc `error`). Cần chạy qua ASGI (config/asgi.py) để không
+    chiếm một worker trong suốt thời gian sinh câu trả lời.
+    """
+
+    async def post(self, request, *args, **kwargs):
+        # Server-Timing chỉ gồm các bước trước khi mở luồng; prompt và LLM được ghi vào histogram khi luồng kết thúc.
+        with request_timer() as timer:
+            return finish(timer, await self.open_stream(request), "ask_stream")
+
+    async def open_stream(self, request):
+        try:
+            llm_router = await services.aget("llm")
+            reranker = await services.aget("reranker")
+            article_index = await services.aget("article_index")
+        except ServiceUnavailable as e:
+            return unavailable_response(e)
+
+        with stage("parse"):
+            query, bad_request = parse_question(request)
+        if bad_request:
+            return bad_request
+
+        # -- retrieval runs before the stream opens so errors still map to status codes --
+        try:
+            direct_hits = await alookup_reference(query)
+            search_result = direct_hits or await asearch_provisions(query, retrieval_limit(reranker))
+            scores = {hit.id: hit.score for hit in search_result}
+            logger.info(f"Tìm thấy {len(scores)} ID điều khoản liên quan{' (tra cứu trực tiếp)' if direct_hits else ''}.")
+
+            with stage("expand"):
+                expansion = await asyncio.to_thread(article_index.expand, search_result) if article_index is not None else {}
+            with stage("hydrate"):
+                hydrated = await ahydrate_provisions(expansion_hits(search_result, expansion))
+            relevant_provisions = [p for p in hydrated if str(p.id) in scores]
+            if reranker is not None and not direct_hits:
+                with stage("rerank"):
+                    relevant_provisions = await reranker.arerank(query, relevant_provisions)
+            relevant_provisions = attach_expansion(relevant_provisions, expansion, hydrated)
+            use_answer_cache = answer_cache is not None and not direct_hits
+            query_vector = await aencode_query(query) if use_answer_cache else None
+        except ServiceUnavailable as e:
+            return unavailable_response(e)
+        except Exception as e:
+            logger.exception(f"Lỗi trong quy trình RAG: {e}")
+            return JsonResponse({"error": "Đã xảy ra lỗi trong quá trình xử lý yêu cầu."}, status=500)
+
+        response = StreamingHttpResponse(
+            self.stream_answer(
+                llm_router, query, query_vector, relevant_provisions, scores, use_answer_cache, question_class(direct_hits)
+            ),
+            content_type="text/event-stream"
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    async def stream_answer(self, llm_router, query, query_vector, provisions, scores, use_answer_cache=True,
+                            question_class=None):
+        sources = [source_entry(p, scores.get(str(p.id))) for p in provisions]
+        yield sse_event("sources", {"question": query, "sources": sources})
+
+        if not provisions:
+            logger.warning("Không tìm thấy điều khoản nào trong PostgreSQL khớp với ID từ Qdrant.")
+            yield sse_event("done", {"answer": NO_PROVISIONS_ANSWER, "metadata": prompt_metadata(None)})
+            return
+
+        if use_answer_cache:
+            timer = StageTimer()
+            with timer.stage("answer_cache"):
+                cached_answer = await answer_cache.alookup(query_vector, [p.id for p in provisions])
+            timer.observe()
+            if cached_answer is not None:
+                logger.info("Dùng lại câu trả lời từ cache ngữ nghĩa.")
+                yield sse_event("token", {"text": cached_answer})
+                yield sse_event("done", {"answer": cached_answer.strip(), "metadata": prompt_metadata(None)})
+                return
+
+        # -- identical in-flight questions share one llm stream --
+        def generate():
+            return self.generate_events(llm_router, query, query_vector, provisions, use_answer_cache, question_class)
+        if stream_flight is not None:
+            events = stream_flight.stream(flight_key(query, [p.id for p in provisions], question_class), generate)
+        else:
+            events = generate()
+        async for event, data in events:
+            # "fallback" chỉ báo cho lớp gộp request đừng chia sẻ câu trả lời dự phòng, không gửi cho client.
+            yield sse_event(event, {k: v for k, v in data.items() if k != "fallback"})
+
+    async def generate_events(self, llm_router, query, query_vector, provisions, use_answer_cache, question_class):
+        """Các sự kiện (event, data) sau `sources`: `token`... rồi `done` hoặc `error`."""
+        timer = StageTimer()
+        try:
+            with timer.stage("prompt"):
+                prompt = build_prompt(query, provisions)
+            logger.debug(f"Prompt đã tạo cho LLM:\n{prompt.text}")
+
+            # -- llm streaming --
+            llm = llm_router.route(prompt.tokens, question_class)
+            logger.info(f"Đang gọi LLM ({llm.provider.label}, streaming)...")
+            answer_parts = []
+            try:
+                with timer.stage("llm"):
+                    async for text in llm.astream(prompt.text):
+                        answer_parts.append(text)
+                        yield "token", {"text": text}
+                logger.info("Nhận được đầy đủ câu trả lời từ LLM.")
+            except Exception as gen_e:
+                if isinstance(gen_e, CircuitOpen):
+                    logger.warning(f"Bỏ qua LLM: {gen_e}")
+                else:
+                    logger.exception(f"Lỗi khi gọi LLM: {gen_e}")
+                if not answer_parts:
+                    yield "done", {
+                        "answer": fallback_answer(provisions), "metadata": prompt_metadata(prompt, llm), "fallback": True
+                    }
+                else:
+                    yield "error", {"error": "Câu trả lời bị gián đoạn do lỗi từ LLM."}
+                return
+
+            answer = "".join(answer_parts)
+            if use_answer_cache:
+                answer_cache.store(query_vector, [p.id for p in provisions], {p.document_id for p in provisions}, answer)
+            yield "done", {"answer": answer.strip(), "metadata": prompt_metadata(prompt, llm)}
+        finally:
+            timer.observe()
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ChatbotBatchAPIView(View):
+    """Nhiều câu hỏi trong một request: {"questions": [...]} -> {"results": [...]} theo đúng thứ tự đầu vào.
+
+    Truy xuất được gộp cho cả lô: một lần encode, một request tìm kiếm vector và một truy vấn
+    PostgreSQL để hydrate mọi điều khoản. Các lượt gọi LLM chạy song song, tối đa
+    BATCH_LLM_CONCURRENCY lượt cùng lúc. Câu hỏi không hợp lệ hoặc lỗi khi trả lời chỉ làm
+    hỏng mục tương ứng (trường `error`), không làm hỏng cả lô.
+    """
+
+    async def post(self, request, *args, **kwargs):
+        with request_timer() as timer:
+            return finish(timer, await self.answer(request), "ask_batch")
+
+    async def answer(self, request):
+        try:
+            llm_router = await services.aget("llm")
+            reranker = await services.aget("reranker")
+            article_index = await services.aget("article_index")
+        except ServiceUnavailable as e:
+            return unavailable_response(e)
+
+        with stage("parse"):
+            questions, bad_request = parse_questions(request)
+        if bad_request:
+            return bad_request
+        BATCH_QUESTIONS.observe(len(questions))
+
+        results = [None] * len(questions)
+        valid = []
+        for i, question in enumerate(questions):
+            if isinstance(question, str) and question.strip():
+                valid.append(i)
+            else:
+                results[i] = {"index": i, "question": question, "error": "Thiếu hoặc 'question' rỗng."}
+
+        # -- batched retrieval: direct lookups, one encode + one vector search, one hydration query --
+        try:
+            texts = [questions[i] for i in valid]
+            direct = [await alookup_reference(text) for text in texts]
+            general = [k for k, hits in enumerate(direct) if not hits]
+            searched = await asearch_provisions_batch([texts[k] for k in general], retrieval_limit(reranker))
+            search_results = list(direct)
+            for k, hits in zip(general, searched):
+                search_results[k] = hits
+
+            with stage("expand"):
+                expansions = await asyncio.to_thread(
+                    lambda: [article_index.expand(hits) if article_index is not None else {} for hits in search_results]
+                )
+            with stage("hydrate"):
+                unique_hits = {}
+                for hits, expansion in zip(search_results, expansions):
+                    for hit in expansion_hits(hits, expansion):
+                        unique_hits.setdefault(hit.id, hit)
+                hydrated = await ahydrate_provisions(list(unique_hits.values()))
+            by_id = {str(p.id): p for p in hydrated}
+            contexts = [[by_id[hit.id] for hit in hits if hit.id in by_id] for hits in search_results]
+            if reranker is not None:
+                with stage("rerank"):
+                    reranked = await reranker.arerank_many([(texts[k], contexts[k]) for k in general])
+                for k, provisions in zip(general, reranked):
+                    contexts[k] = provisions
+            contexts = [attach_expansion(c, expansion, hydrated) for c, expansion in zip(contexts, expansions)]
+            vectors = {}
+            if answer_cache is not None:
+                vectors = dict(zip(general, await aencode_queries([texts[k] for k in general])))
+        except ServiceUnavailable as e:
+            return unavailable_response(e)
+        except Exception as e:
+            logger.exception(f"Lỗi trong quy trình RAG (batch): {e}")
+            return JsonResponse({"error": "Đã xảy ra lỗi trong quá trình xử lý yêu cầu."}, status=500)
+
+        # -- llm calls fan out with bounded concurrency; one failing question does not fail the batch --
+        semaphore = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+
+        async def answer_item(k):
+            i = valid[k]
+            try:
+                item = await self.answer_one(
+                    llm_router, semaphore, texts[k], contexts[k], search_results[k], vectors.get(k), bool(direct[k])
+                )
+            except Exception as e:
+                logger.exception(f"Lỗi khi trả lời câu hỏi thứ {i} của lô: {e}")
+                item = {"error": "Đã xảy ra lỗi trong quá trình xử lý câu hỏi."}
+            results[i] = {"index": i, "question": texts[k], **item}
+
+        with stage("llm"):
+            await asyncio.gather(*(answer_item(k) for k in range(len(valid))))
+
+        with stage("serialize"):
+            return JsonResponse({
+                "results": results,
+                "metadata": {"questions": len(questions), "errors": sum(1 for r in results if "error" in r)},
+            })
+
+    async def answer_one(self, llm_router, semaphore, query, provisions, search_result, query_vector, is_direct):
+        if not provisions:
+            return {"answer": NO_PROVISIONS_ANSWER, "sources": [], "metadata": prompt_metadata(None)}
+        scores = {hit.id: hit.score for hit in search_result}
+        sources = [source_entry(p, scores.get(str(p.id))) for p in provisions]
+        provision_ids = [p.id for p in provisions]
+
+        if query_vector is not None:
+            cached_answer = await answer_cache.alookup(query_vector, provision_ids)
+            if cached_answer is not None:
+                return {"answer": cached_answer.strip(), "sources": sources, "metadata": prompt_metadata(None)}
+
+        prompt = build_prompt(query, provisions)
+        llm = llm_router.route(prompt.tokens, question_class(is_direct))
+        try:
+            async with semaphore:
+                answer = await llm.agenerate(prompt.text)
+            if query_vector is not None:
+                answer_cache.store(query_vector, provision_ids, {p.document_id for p in provisions}, answer)
+        except CircuitOpen as gen_e:
+            logger.warning(f"Bỏ qua LLM: {gen_e}")
+            answer = fallback_answer(provisions)
+        except Exception as gen_e:
+            logger.exception(f"Lỗi khi gọi LLM: {gen_e}")
+            answer = fallback_answer(provisions)
+        return {"answer": answer.strip(), "sources": sources, "metadata": prompt_metadata(prompt, llm)}
+
+
+def healthz(request):
+    """Liveness: tiến trình còn phục vụ được request, không phụ thuộc các thành phần."""
+    return JsonResponse({"status": "ok"})
+
+def readyz(request):
+    """Readiness: 200 khi mọi thành phần bắt buộc đã sẵn sàng, kèm trạng thái và thời gian tải từng thành phần."""
+    ready = services.ready
+    return JsonResponse(
+        {"status": "ready" if ready else "not_ready", "services": services.status()},
+        status=200 if ready else 503
+    )
+
+def metrics_view(request):
+    return HttpResponse(metrics.registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -2,6 +2,8 @@
 ASGI config for config project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+The streaming endpoint (``/api/chatbot/ask/stream/``) should be served through
+this module, e.g. ``uvicorn config.asgi:application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
@@ -14,3 +16,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_asgi_application()
+
+# Tải mô hình/kết nối trên luồng nền để worker nhận request ngay; /readyz báo khi đã sẵn sàng.
+from chatbot.services import CHATBOT_WARMUP, services  # noqa: E402
+
+if CHATBOT_WARMUP:
+    services.warm_up()
@@ -0,0 +1,96 @@
+# src/config/gunicorn.conf.py
+"""Cấu hình gunicorn cho môi trường production.
+
+    gunicorn config.asgi:application -c config/gunicorn.conf.py
+
+(chạy từ thư mục src/; `manage.py runserver` chỉ dùng khi phát triển).
+
+- Worker mặc định là UvicornWorker. Các view chatbot (/ask/, /ask/stream/, /ask/batch/) đều
+  bất đồng bộ nên một worker xử lý nhiều request cùng lúc trên event loop; view đồng bộ
+  dưới ASGI thì bị Django chạy lần lượt trên một luồng duy nhất, vì vậy không thêm view
+  đồng bộ nào vào đường phục vụ câu hỏi. GUNICORN_WORKER_CLASS=gthread với
+  config.wsgi:application vẫn chạy được nhưng mỗi request chiếm một luồng và SSE giữ luồng
+  suốt thời gian sinh câu trả lời.
+- preload_app: Django và mô hình embedding được tải một lần trong process master trước
+  khi fork. Các worker dùng chung trang bộ nhớ chứa trọng số theo copy-on-write, và
+  gc.freeze() giữ cho GC không chạm vào (và sao chép) các đối tượng đó. Thành phần giữ
+  luồng hoặc kết nối (Qdrant, Gemini, batcher, rerank, chỉ mục BM25) vẫn được khởi tạo
+  riêng trong từng worker bởi luồng warm-up sau khi fork.
+- Mỗi worker chỉ dùng cpu_count / workers luồng torch/ONNX Runtime (hoặc EMBEDDING_THREADS)
+  để các worker không tranh nhau lõi CPU.
+- max_requests/max_requests_jitter thay worker định kỳ để chặn rò rỉ bộ nhớ. Worker mới
+  được fork lại từ master nên có mô hình ngay, không phải tải lại.
+- Khi nhận SIGTERM, worker có graceful_timeout giây để trả lời nốt các request đang chạy.
+
+Mức tiết kiệm bộ nhớ phụ thuộc mô hình embedding và phần cứng nên repo không ghi sẵn số đo
+nào. Để so sánh trước/sau trên máy triển khai, chạy cùng một lệnh với ba cấu hình rồi so
+cột PSS/worker, Tổng PSS và Req/giây giữa các file JSON:
+
+    python manage.py benchmark_server --workers 1 2 4 --json preload.json
+    python manage.py benchmark_server --workers 1 2 4 --no-gc-freeze --json no-freeze.json
+    python manage.py benchmark_server --workers 1 2 4 --no-preload --json no-preload.json
+"""
+import gc
+import multiprocessing
+import os
+import sys
+
+# -- configuration --
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("GUNICORN_WORKERS", max(1, min(4, multiprocessing.cpu_count()))))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "uvicorn_worker.UvicornWorker")
+threads = int(os.getenv("GUNICORN_THREADS", 4))  # chỉ áp dụng cho gthread
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+gc_freeze = os.getenv("GUNICORN_GC_FREEZE", "1") == "1"  # chỉ có tác dụng khi preload
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 100))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+accesslog = os.getenv("GUNICORN_ACCESSLOG", "-")
+
+# Chia lõi CPU cho các worker. Biến môi trường phải được đặt trước khi ứng dụng được
+# import (preload) vì chatbot.embedding đọc EMBEDDING_THREADS lúc import.
+os.environ.setdefault("EMBEDDING_THREADS", str(max(1, multiprocessing.cpu_count() // workers)))
+
+# Luồng warm-up không sống sót qua fork: không chạy trong master khi preload (config/asgi.py
+# và config/wsgi.py đọc CHATBOT_WARMUP), mà chạy trong từng worker ở post_fork.
+warm_up_workers = os.getenv("CHATBOT_WARMUP", "1") == "1"
+if preload_app:
+    os.environ["CHATBOT_WARMUP"] = "0"
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    from chatbot.embedding import EMBEDDING_BACKEND
+    from chatbot.services import services
+
+    # Phiên ONNX Runtime giữ thread pool riêng, không an toàn khi fork; mô hình ONNX nhỏ
+    # và tải nhanh nên để từng worker tự tải.
+    if EMBEDDING_BACKEND != "onnx":
+        if services.preload("embedding_model"):
+            server.log.info("Đã preload mô hình embedding trong master.")
+        else:
+            server.log.warning("Không preload được mô hình embedding, các worker sẽ tự tải.")
+    if gc_freeze:
+        # Đưa mọi đối tượng hiện có ra khỏi tầm quét của GC để trang bộ nhớ không bị sao chép.
+        gc.collect()
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    from django.db import connections
+    from chatbot.embedding import EMBEDDING_THREADS, set_torch_threads
+
+    connections.close_all()  # không dùng chung kết nối DB (nếu có) của master
+    if "torch" in sys.modules:
+        set_torch_threads(EMBEDDING_THREADS)
+    if preload_app and warm_up_workers:
+        from chatbot.services import services
+        services.warm_up()
+
+
+def worker_exit(server, worker):
+    from django.db import connections
+    connections.close_all()
@@ -72,6 +72,26 @@ DATABASES = {
 }
 
 
+# Cache
+# The 'chatbot' alias backs the shared RAG cache (CHATBOT_CACHE_BACKEND=django)
+# and the cross-worker request coalescing lock (CHATBOT_COALESCE=django).
+
+CHATBOT_CACHE_URL = os.getenv('CHATBOT_CACHE_URL')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'chatbot': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CHATBOT_CACHE_URL,
+    } if CHATBOT_CACHE_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'chatbot',
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
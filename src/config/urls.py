@@ -1,7 +1,11 @@
 from django.contrib import admin
 from django.urls import path, include 
+from chatbot.views import healthz, metrics_view, readyz
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/chatbot/', include('chatbot.urls')),
+    path('healthz', healthz, name='healthz'),
+    path('readyz', readyz, name='readyz'),
+    path('metrics', metrics_view, name='metrics'),
 ]
\ No newline at end of file
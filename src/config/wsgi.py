@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_wsgi_application()
+
+# Tải mô hình/kết nối trên luồng nền để worker nhận request ngay; /readyz báo khi đã sẵn sàng.
+from chatbot.services import CHATBOT_WARMUP, services  # noqa: E402
+
+if CHATBOT_WARMUP:
+    services.warm_up()
@@ -1,8 +1,12 @@
+import argparse
+import asyncio
+import csv
 import requests
 import json
 import os
 import sys
 import time 
+from collections import Counter
 from dotenv import load_dotenv
 
 # # Tìm thư mục gốc của dự án
@@ -18,6 +22,10 @@ from dotenv import load_dotenv
 
 # --- Cấu hình API Endpoint ---
 CHATBOT_API_URL = os.getenv("CHATBOT_API_URL", "http://web:8000/api/chatbot/ask/")
+CHATBOT_STREAM_URL = os.getenv("CHATBOT_STREAM_URL", CHATBOT_API_URL.rstrip('/') + "/stream/")
+
+# Giữ kết nối TCP giữa các câu hỏi thay vì mở kết nối mới cho mỗi lần gọi.
+session = requests.Session()
 
 def ask_chatbot(question):
     """Gửi câu hỏi đến API chatbot và trả về (câu trả lời, thời gian xử lý)."""
@@ -28,7 +36,7 @@ def ask_chatbot(question):
     start_time = time.time() # <-- Bắt đầu đếm thời gian
 
     try:
-        response = requests.post(CHATBOT_API_URL, headers=headers, data=payload, timeout=90)
+        response = session.post(CHATBOT_API_URL, headers=headers, data=payload, timeout=90)
         end_time = time.time() # <-- Kết thúc đếm thời gian
         response_time = end_time - start_time # <-- Tính thời gian
 
@@ -68,7 +76,175 @@ def ask_chatbot(question):
         return f"Lỗi không xác định trong quá trình xử lý: {e}\n{traceback.format_exc()}", end_time - start_time
 
 
-if __name__ == "__main__":
+# --- Chế độ tạo tải (--load) ---
+def load_questions(path):
+    """Câu hỏi từ file: mỗi dòng một câu (bỏ dòng trống và dòng bắt đầu bằng '#'),
+    hoặc file .json dạng golden set của benchmark_rag ([{"question": ...}] hay danh sách chuỗi)."""
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    if path.endswith('.json'):
+        return [entry if isinstance(entry, str) else entry['question'] for entry in json.loads(text)]
+    return [line.strip() for line in text.splitlines() if line.strip() and not line.lstrip().startswith('#')]
+
+def percentile(values, q):
+    """Phân vị q (0-100) có nội suy tuyến tính; None nếu không có giá trị nào."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+async def send_question(client, url, question, stream):
+    """Gửi một câu hỏi và đọc hết phản hồi. Thời gian (giây) tính từ lúc gửi:
+    ttfb là byte đầu tiên của body, ttft là sự kiện `token` đầu tiên (chỉ khi streaming)."""
+    import httpx
+    result = {"status": None, "error": "", "ttfb": None, "ttft": None, "bytes": 0, "server_timing": ""}
+    started = time.perf_counter()
+    try:
+        async with client.stream("POST", url, json={"question": question}) as response:
+            result["status"] = response.status_code
+            result["server_timing"] = response.headers.get("server-timing", "")
+            buffer, events = b"", set()
+            async for chunk in response.aiter_bytes():
+                now = time.perf_counter() - started
+                if result["ttfb"] is None:
+                    result["ttfb"] = now
+                result["bytes"] += len(chunk)
+                buffer += chunk
+                if stream:
+                    *lines, buffer = buffer.split(b"\n")
+                    for line in lines:
+                        if line.startswith(b"event:"):
+                            event = line[6:].decode().strip()
+                            events.add(event)
+                            if event == "token" and result["ttft"] is None:
+                                result["ttft"] = now
+        if response.status_code != 200:
+            result["error"] = f"HTTP {response.status_code}"
+        elif stream and "error" in events:
+            result["error"] = "sự kiện error"
+        elif stream and "done" not in events:
+            result["error"] = "luồng thiếu sự kiện done"
+        elif not stream and "answer" not in json.loads(buffer):
+            result["error"] = "phản hồi thiếu answer"
+    except httpx.TimeoutException:
+        result["error"] = "timeout"
+    except httpx.HTTPError as e:
+        result["error"] = type(e).__name__
+    except ValueError:
+        result["error"] = "JSON không hợp lệ"
+    result["latency"] = time.perf_counter() - started
+    return result
+
+async def drive(client, url, questions, total, concurrency, rps=None, stream=False, unique=False, offset=0):
+    """Gửi `total` câu hỏi, tối đa `concurrency` request cùng lúc.
+
+    Không có rps: vòng kín, mỗi request xong thì request kế tiếp được gửi. Có rps: request thứ i
+    được lên lịch ở giây i / rps; nếu phải chờ slot, thời gian chờ (queue) được cộng vào độ trễ
+    để tải quá sức thể hiện ra số đo thay vì bị che đi.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    started = time.perf_counter()
+
+    async def one(i):
+        scheduled = started + i / rps if rps else None
+        if scheduled is not None:
+            await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+        question = questions[(offset + i) % len(questions)]
+        if unique:
+            question = f"{question} (#{offset + i})"  # tránh cache phía server
+        async with semaphore:
+            queue = time.perf_counter() - scheduled if scheduled is not None else 0.0
+            result = await send_question(client, url, question, stream)
+        result.update(index=offset + i, question=question, queue=queue, latency=result["latency"] + queue)
+        return result
+
+    return await asyncio.gather(*(one(i) for i in range(total)))
+
+async def run_load(args, questions, transport=None):
+    """Làm nóng (không ghi nhận) rồi đo; trả về (kết quả từng request, thời gian đo tính bằng giây)."""
+    import httpx
+    url = args.url or (CHATBOT_STREAM_URL if args.stream else CHATBOT_API_URL)
+    total = args.requests or len(questions)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    options = dict(concurrency=args.concurrency, rps=args.rps, stream=args.stream, unique=args.unique)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits, transport=transport) as client:
+        if args.warmup:
+            print(f"🔥 Làm nóng với {args.warmup} request...")
+            await drive(client, url, questions, args.warmup, offset=total, **options)
+        print(f"🚀 Gửi {total} request tới {url} (đồng thời {args.concurrency}"
+              f"{f', {args.rps:g} req/giây' if args.rps else ''}{', streaming' if args.stream else ''})...")
+        started = time.perf_counter()
+        results = await drive(client, url, questions, total, **options)
+        elapsed = time.perf_counter() - started
+    return results, elapsed
+
+def summarize(results, elapsed):
+    ok = [r for r in results if not r["error"]]
+    summary = {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "error_rate": (len(results) - len(ok)) / len(results) if results else 0.0,
+        "throughput": len(ok) / elapsed if elapsed else 0.0,
+        "error_kinds": Counter(r["error"] for r in results if r["error"]),
+    }
+    for name in ("latency", "ttfb", "ttft", "queue"):
+        values = [r[name] * 1000 for r in ok if r[name] is not None]
+        summary[name] = {q: percentile(values, q) for q in (50, 90, 95, 99, 100)} if values else None
+    return summary
+
+def print_summary(summary, elapsed):
+    print("=" * 70)
+    print(f"📊 {summary['requests']} request trong {elapsed:.2f}s: {summary['throughput']:.2f} req/giây thành công, "
+          f"lỗi {summary['errors']} ({summary['error_rate']:.1%})")
+    print(f"    {'(ms)':<22} {'p50':>9} {'p90':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    labels = {"latency": "Độ trễ", "ttfb": "Byte đầu tiên (TTFB)", "ttft": "Token đầu tiên", "queue": "Chờ slot (--rps)"}
+    for name, label in labels.items():
+        stats = summary[name]
+        if stats is None or (name == "queue" and not stats[100]):
+            continue
+        print(f"    {label:<22} " + " ".join(f"{stats[q]:>9.1f}" for q in (50, 90, 95, 99, 100)))
+    for error, count in summary["error_kinds"].most_common():
+        print(f"    ❌ {error}: {count}")
+
+def write_csv(path, results):
+    fields = ["index", "question", "status", "error", "queue_ms", "latency_ms", "ttfb_ms", "ttft_ms", "bytes", "server_timing"]
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for r in results:
+            row = {key: r[key] for key in ("index", "question", "status", "error", "bytes", "server_timing")}
+            for name in ("queue", "latency", "ttfb", "ttft"):
+                row[f"{name}_ms"] = "" if r[name] is None else f"{r[name] * 1000:.1f}"
+            writer.writerow(row)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Chatbot Luật Doanh nghiệp trên terminal; --load để tạo tải cho API.")
+    parser.add_argument('--load', metavar='FILE', help="Chạy không tương tác với các câu hỏi trong FILE (.txt hoặc .json).")
+    parser.add_argument('--url', help=f"Endpoint (mặc định {CHATBOT_API_URL}, hoặc {CHATBOT_STREAM_URL} với --stream).")
+    parser.add_argument('--stream', action='store_true', help="Dùng endpoint SSE và đo thời gian tới token đầu tiên.")
+    parser.add_argument('--concurrency', type=int, default=8, help="Số request tối đa cùng lúc (cũng là số kết nối).")
+    parser.add_argument('--requests', type=int, help="Tổng số request cần đo (mặc định: mỗi câu hỏi một lần).")
+    parser.add_argument('--rps', type=float, help="Tốc độ gửi mục tiêu (vòng hở); mặc định gửi liên tục (vòng kín).")
+    parser.add_argument('--warmup', type=int, default=0, help="Số request làm nóng trước khi đo.")
+    parser.add_argument('--unique', action='store_true', help="Thêm hậu tố vào mỗi câu hỏi để tránh cache phía server.")
+    parser.add_argument('--timeout', type=float, default=90, help="Thời gian chờ tối đa mỗi request (giây).")
+    parser.add_argument('--csv', help="Ghi kết quả từng request ra file CSV.")
+    return parser.parse_args(argv)
+
+def load_test(args):
+    questions = load_questions(args.load)
+    if not questions:
+        sys.exit(f"Không có câu hỏi nào trong {args.load}.")
+    results, elapsed = asyncio.run(run_load(args, questions))
+    print_summary(summarize(results, elapsed), elapsed)
+    if args.csv:
+        write_csv(args.csv, results)
+        print(f"📝 Đã ghi kết quả từng request vào {args.csv}")
+
+def interactive():
     print("\n🤖 Chatbot Luật Doanh nghiệp sẵn sàng!")
     print("   Nhập câu hỏi của bạn hoặc gõ 'quit' để thoát.")
     print("=" * 70)
@@ -91,4 +267,11 @@ if __name__ == "__main__":
             break
         except KeyboardInterrupt:
              print("\n👋 Tạm biệt!")
-             break
\ No newline at end of file
+             break
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.load:
+        load_test(args)
+    else:
+        interactive()